@@ -0,0 +1,78 @@
+"""
+Per alert cost of the correction with the reference cache against the plain scalar correction.
+
+Synthetic detections are given one at a time, as dicts, to :func:`lc_correction.reference.correct_candidate` with a
+warm :class:`lc_correction.reference.ReferenceCache` and to :func:`lc_correction.compute.apply_correction`. The
+process exits with 1 if the cached path is slower than the plain one by more than ``--threshold``. The report is JSON.
+
+Example::
+
+    python -m benchmarks.alerts --alerts 10000 --threshold 0.1
+"""
+import argparse
+import json
+import sys
+import timeit
+
+from lc_correction.kernels import apply_correction
+from lc_correction.reference import ReferenceCache, correct_candidate
+
+from .synthetic import make_detections
+
+
+def per_alert(function, candidates, repeat=7):
+    """
+    :return: Fastest of ``repeat`` passes over the candidates, in microseconds per alert
+    :rtype: float
+    """
+    seconds = min(timeit.repeat(lambda: [function(candidate) for candidate in candidates], number=1, repeat=repeat))
+    return seconds / len(candidates) * 1e6
+
+
+def run(n_alerts=10000, repeat=7, seed=0):
+    """
+    Run the benchmark.
+
+    :return: Microseconds per alert of each path and their ratio
+    :rtype: dict
+    """
+    candidates = make_detections(n_alerts, "uniform", seed=seed).to_dict("records")
+    cache = ReferenceCache(max_size=n_alerts)
+    for candidate in candidates:
+        correct_candidate(candidate, cache)
+    cached = per_alert(lambda candidate: correct_candidate(candidate, cache), candidates, repeat=repeat)
+    plain = per_alert(apply_correction, candidates, repeat=repeat)
+    record = {"alerts": n_alerts, "correct_candidate": cached, "apply_correction": plain, "ratio": cached / plain}
+    print("correct_candidate {correct_candidate:.3f} us, apply_correction {apply_correction:.3f} us, "
+          "ratio {ratio:.3f}".format(**record), file=sys.stderr)
+    return record
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="lc_correction per alert benchmark")
+    parser.add_argument("--alerts", type=int, default=10000, help="number of synthetic alerts")
+    parser.add_argument("--repeat", type=int, default=7, help="passes over the alerts, the fastest is reported")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="allowed slowdown of correct_candidate over apply_correction")
+    parser.add_argument("--output", default=None, help="JSON report, by default the standard output")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    record = run(args.alerts, repeat=args.repeat)
+    failed = record["ratio"] > 1 + args.threshold
+    report = {"threshold": args.threshold, "result": record, "failed": failed}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if failed:
+        print("correct_candidate is slower than apply_correction by {:.0%}".format(record["ratio"] - 1),
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
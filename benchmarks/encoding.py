@@ -0,0 +1,136 @@
+"""
+Benchmarks of the integer ``[objectId, fid]`` key against the string ids, step by step.
+
+Each step (grouping, sorting, finding the segments, joining two tables) is timed over the string columns, as pandas
+does it, and over the integer key of :mod:`lc_correction.keys`. The encoding itself is included in the time of the
+key. The report is JSON, with the speedup of each step.
+
+Example::
+
+    python -m benchmarks.encoding --sizes 1e5 1e6
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lc_correction.keys import encode_groups, encode_objects, group_keys, sort_groups
+from lc_correction.segments import segment_starts
+
+from .run import measure_time
+from .synthetic import DISTRIBUTIONS, make_detections, make_non_detections
+
+SIZES = [10 ** 4, 10 ** 5, 10 ** 6]  #: default number of detections
+
+
+def _group_strings(df, _):
+    return df.groupby(["objectId", "fid"], sort=True).ngroup().values
+
+
+def _group_key(df, _):
+    return encode_groups(df["objectId"], df["fid"].values)
+
+
+def _sort_strings(df, _):
+    return df[["objectId", "fid", "mjd"]].reset_index(drop=True).sort_values(
+        ["objectId", "fid", "mjd"], kind="mergesort").index.values
+
+
+def _sort_key(df, _):
+    return sort_groups(df["objectId"], df["fid"].values, df["mjd"].values)[0]
+
+
+def _segments_strings(df, _):
+    df = df.sort_values(["objectId", "fid"], kind="mergesort")
+    return segment_starts(df["objectId"].values, df["fid"].values)
+
+
+def _segments_key(df, _):
+    order, key = sort_groups(df["objectId"], df["fid"].values)
+    return segment_starts(key[order])
+
+
+def _join_strings(df, stats):
+    return stats.index.get_indexer(pd.MultiIndex.from_arrays([df["objectId"].values, df["fid"].values]))
+
+
+def _join_key(df, stats):
+    stats_codes, objects = encode_objects(stats.index.get_level_values("objectId"))
+    codes, _ = encode_objects(df["objectId"], categories=objects)
+    stats_key, stride = group_keys(stats_codes, stats.index.get_level_values("fid").values, stride=4)
+    key, _ = group_keys(codes, df["fid"].values, stride=stride)
+    order = np.argsort(stats_key, kind="stable")
+    position = np.minimum(np.searchsorted(stats_key[order], key), len(order) - 1)
+    return np.where((codes >= 0) & (stats_key[order][position] == key), order[position], -1)
+
+
+STEPS = {
+    "group": (_group_strings, _group_key),
+    "sort": (_sort_strings, _sort_key),
+    "segments": (_segments_strings, _segments_key),
+    "join": (_join_strings, _join_key),
+}  #: string and integer key versions of each step
+
+
+def run(sizes=None, distributions=None, steps=None, repeat=3, seed=0):
+    """
+    Run the benchmarks.
+
+    :return: A record for each run
+    :rtype: list of dict
+    """
+    sizes = SIZES if sizes is None else sizes
+    distributions = DISTRIBUTIONS if distributions is None else distributions
+    steps = list(STEPS) if steps is None else steps
+    results = []
+    for distribution in distributions:
+        for n_rows in sizes:
+            detections = make_detections(n_rows, distribution, seed=seed)
+            non_detections = make_non_detections(detections, seed=seed)
+            stats = detections.groupby(["objectId", "fid"]).size().to_frame("ndet")
+            for step in steps:
+                strings, key = STEPS[step]
+                df = non_detections if step == "join" else detections
+                string_seconds = min(measure_time(strings, (df, stats)) for _ in range(repeat))
+                key_seconds = min(measure_time(key, (df, stats)) for _ in range(repeat))
+                record = {
+                    "step": step,
+                    "distribution": distribution,
+                    "rows": n_rows,
+                    "strings_seconds": string_seconds,
+                    "key_seconds": key_seconds,
+                    "speedup": string_seconds / key_seconds if key_seconds > 0 else np.inf,
+                }
+                results.append(record)
+                print("{step:>9} {distribution:>10} {rows:>9} rows {strings_seconds:10.4f} s strings "
+                      "{key_seconds:10.4f} s key x{speedup:.1f}".format(**record), file=sys.stderr)
+    return results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="lc_correction key encoding benchmarks")
+    parser.add_argument("--sizes", nargs="+", type=float, default=SIZES, help="number of detections")
+    parser.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=DISTRIBUTIONS)
+    parser.add_argument("--steps", nargs="+", choices=list(STEPS), default=list(STEPS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each step, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report, by default the standard output")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = run([int(size) for size in args.sizes], args.distributions, args.steps, repeat=args.repeat,
+                  seed=args.seed)
+    if args.output is None:
+        json.dump({"results": results}, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Import time of the lc_correction modules, measured with ``python -X importtime`` in a fresh interpreter.
+
+The light module :mod:`lc_correction.kernels` has a budget: the process exits with 1 if its cumulative import time
+is over the budget, or if it imports one of the heavy modules (pandas, pyarrow). The other modules are reported for
+comparison. The report is JSON.
+
+Example::
+
+    python -m benchmarks.importtime --budget 0.3
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = ["lc_correction", "lc_correction.kernels", "lc_correction.reference", "lc_correction.compute"]  #: reported
+LIGHT_MODULES = ["lc_correction", "lc_correction.kernels"]  #: modules with a budget
+FORBIDDEN = ["pandas", "pyarrow"]  #: modules the light modules must not import
+
+
+def import_time(module):
+    """
+    Import a module in a fresh interpreter.
+
+    :return: Cumulative import time of the module in seconds, and the names of every imported module
+    :rtype: tuple
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             capture_output=True, text=True, check=True)
+    seconds = None
+    imported = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        imported.add(name.strip())
+        if name.strip() == module:
+            seconds = int(cumulative) / 1e6
+    return seconds, imported
+
+
+def run(modules=None, repeat=5):
+    """
+    Run the benchmarks.
+
+    :return: A record for each module, with the fastest of ``repeat`` imports
+    :rtype: list of dict
+    """
+    modules = MODULES if modules is None else modules
+    results = []
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            seconds, imported = import_time(module)
+            times.append(seconds)
+        record = {
+            "module": module,
+            "seconds": min(times),
+            "forbidden": sorted(name for name in imported if name in FORBIDDEN),
+        }
+        results.append(record)
+        print("{module:>25} {seconds:8.4f} s {forbidden}".format(**record), file=sys.stderr)
+    return results
+
+
+def check(results, budget):
+    """
+    Check the light modules against the budget.
+
+    :return: The failures, empty if every light module is within budget
+    :rtype: list of string
+    """
+    failures = []
+    for record in results:
+        if record["module"] not in LIGHT_MODULES:
+            continue
+        if record["seconds"] > budget:
+            failures.append("{module} takes {seconds:.4f} s".format(**record))
+        if record["forbidden"]:
+            failures.append("{} imports {}".format(record["module"], ", ".join(record["forbidden"])))
+    return failures
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="lc_correction import time benchmarks")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--budget", type=float, default=0.3, help="seconds allowed for each light module")
+    parser.add_argument("--repeat", type=int, default=5, help="imports of each module, the fastest is reported")
+    parser.add_argument("--output", default=None, help="JSON report, by default the standard output")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = run(args.modules, repeat=args.repeat)
+    failures = check(results, args.budget)
+    report = {"budget": args.budget, "results": results, "failures": failures}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print("over budget: " + failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Benchmarks of every stage of lc_correction over synthetic data.
+
+Each stage is timed separately over tables from 1e3 to 1e7 rows and several group size distributions. The report is
+JSON, with rows per second and peak memory of each run. With ``--compare`` the report is checked against a stored
+baseline and the process exits with 1 when a stage is slower or uses more memory than allowed.
+
+Example::
+
+    python -m benchmarks.run --sizes 1e3 1e4 1e5 --output report.json
+    python -m benchmarks.run --sizes 1e3 1e4 1e5 --compare report.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from lc_correction.compute import (apply_correction_df, apply_mag_stats, apply_object_stats_df, compute_dmdt,
+                                   compute_magstats, compute_object_stats, correct_detections, do_dmdt_df)
+from lc_correction.helpers import get_clean_corrected, get_ps1_ztf
+
+from .synthetic import DISTRIBUTIONS, make_detections, make_non_detections
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]  #: default number of detections
+
+
+class Data:
+    """Inputs of the stages, computed lazily so only the stages that run pay for them."""
+
+    def __init__(self, n_rows, distribution, seed=0):
+        self.detections = make_detections(n_rows, distribution, seed=seed)
+        self.non_detections = make_non_detections(self.detections, seed=seed)
+        self._corrected = None
+        self._magstats = None
+
+    @property
+    def corrected(self):
+        if self._corrected is None:
+            self._corrected = correct_detections(self.detections)
+        return self._corrected
+
+    @property
+    def magstats(self):
+        if self._magstats is None:
+            self._magstats = compute_magstats(self.corrected)
+        return self._magstats
+
+
+def _prepare(stage, data):
+    """Copies of the inputs of a stage (some stages modify their input), made outside the timed region."""
+    if stage in ["apply_correction_df", "correct_detections", "get_ps1_ztf"]:
+        return (data.detections.copy(),)
+    if stage == "apply_mag_stats":
+        return (data.corrected.reset_index(),)
+    if stage == "compute_magstats":
+        return (data.corrected,)
+    if stage == "apply_object_stats_df":
+        return data.corrected.reset_index(), data.magstats.reset_index()
+    if stage == "compute_object_stats":
+        return data.corrected, data.magstats
+    if stage in ["do_dmdt_df", "compute_dmdt"]:
+        return data.magstats.reset_index(), data.non_detections.copy()
+    if stage == "get_clean_corrected":
+        return (data.corrected.copy(),)
+    raise ValueError("Unknown stage {}".format(stage))
+
+
+STAGES = {
+    "apply_correction_df": lambda detections: detections.groupby(["objectId", "fid"]).apply(
+        apply_correction_df, calculate_dubious=True),
+    "correct_detections": correct_detections,
+    "apply_mag_stats": lambda corrected: corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats),
+    "compute_magstats": compute_magstats,
+    "apply_object_stats_df": apply_object_stats_df,
+    "compute_object_stats": compute_object_stats,
+    "do_dmdt_df": do_dmdt_df,
+    "compute_dmdt": compute_dmdt,
+    "get_ps1_ztf": get_ps1_ztf,
+    "get_clean_corrected": get_clean_corrected,
+}  #: benchmarked stages
+
+
+def measure_time(function, args):
+    """
+    Wall time of a call in seconds.
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def measure_memory(function, args):
+    """
+    Peak memory traced by tracemalloc during a call, in bytes. NumPy and pandas buffers are traced. Tracing slows
+    down the call, so it is not timed.
+    """
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(sizes=None, distributions=None, stages=None, repeat=1, memory=True, max_seconds=300., seed=0):
+    """
+    Run the benchmarks. A stage is not run over bigger tables once it takes more than ``max_seconds``.
+
+    :return: A record for each run
+    :rtype: list of dict
+    """
+    sizes = SIZES if sizes is None else sizes
+    distributions = DISTRIBUTIONS if distributions is None else distributions
+    stages = list(STAGES) if stages is None else stages
+    results = []
+    for distribution in distributions:
+        too_slow = set()
+        for n_rows in sizes:
+            data = Data(n_rows, distribution, seed=seed)
+            for stage in stages:
+                if stage in too_slow:
+                    continue
+                seconds = min(measure_time(STAGES[stage], _prepare(stage, data)) for _ in range(repeat))
+                record = {
+                    "stage": stage,
+                    "distribution": distribution,
+                    "rows": n_rows,
+                    "seconds": seconds,
+                    "rows_per_second": n_rows / seconds if seconds > 0 else np.inf,
+                    "peak_memory": measure_memory(STAGES[stage], _prepare(stage, data)) if memory else None,
+                }
+                results.append(record)
+                print("{stage:>22} {distribution:>10} {rows:>9} rows {seconds:10.4f} s "
+                      "{rows_per_second:14.0f} rows/s {peak_memory} B".format(**record), file=sys.stderr)
+                if seconds > max_seconds:
+                    too_slow.add(stage)
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Find the runs that are slower or use more memory than the baseline by more than ``threshold``.
+
+    :return: A record for each regression
+    :rtype: list of dict
+    """
+    baseline = {(r["stage"], r["distribution"], r["rows"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["stage"], result["distribution"], result["rows"])
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        speed = result["rows_per_second"] / reference["rows_per_second"]
+        if result["peak_memory"] is None or reference["peak_memory"] is None:
+            memory = np.nan
+        else:
+            memory = result["peak_memory"] / max(reference["peak_memory"], 1)
+        if speed < 1 - threshold or memory > 1 + threshold:
+            regressions.append({"stage": result["stage"], "distribution": result["distribution"],
+                                "rows": result["rows"], "speed_ratio": speed, "memory_ratio": memory})
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="lc_correction benchmarks")
+    parser.add_argument("--sizes", nargs="+", type=float, default=SIZES, help="number of detections")
+    parser.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=DISTRIBUTIONS)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each stage, the fastest is reported")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    parser.add_argument("--max-seconds", type=float, default=300., help="skip bigger sizes of slower stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report, by default the standard output")
+    parser.add_argument("--compare", default=None, help="JSON baseline report")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    warnings.simplefilter("ignore")
+    results = run([int(size) for size in args.sizes], args.distributions, args.stages, repeat=args.repeat,
+                  memory=not args.no_memory, max_seconds=args.max_seconds, seed=args.seed)
+    report = {"python": platform.python_version(), "numpy": np.__version__, "results": results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, threshold=args.threshold)
+        for regression in regressions:
+            print("REGRESSION {stage} {distribution} {rows} rows: speed x{speed_ratio:.2f}, "
+                  "memory x{memory_ratio:.2f}".format(**regression), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
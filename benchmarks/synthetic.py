@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from lc_correction.helpers import COL_PS1_ZTF
+
+DISTRIBUTIONS = ["singletons", "uniform", "mixed", "long"]  #: group size distributions
+
+
+def group_sizes(n_rows, distribution, rng):
+    """
+    Sizes of the ``[objectId, fid]`` groups of a synthetic table.
+
+    - singletons: every group has one detection
+    - uniform: groups of 20 detections
+    - mixed: heavy tailed sizes (Pareto), most groups are short and a few are long
+    - long: ten very long light curves
+    """
+    if distribution == "singletons":
+        sizes = np.ones(n_rows, dtype=np.int64)
+    elif distribution == "uniform":
+        sizes = np.full(max(n_rows // 20, 1), 20, dtype=np.int64)
+    elif distribution == "mixed":
+        sizes = np.ceil(rng.pareto(1.2, n_rows)).astype(np.int64) + 1
+        sizes = sizes[np.cumsum(sizes) <= n_rows]
+        if len(sizes) == 0:
+            sizes = np.array([n_rows], dtype=np.int64)
+    elif distribution == "long":
+        sizes = np.full(min(10, n_rows), max(n_rows // 10, 1), dtype=np.int64)
+    else:
+        raise ValueError("Unknown distribution {}".format(distribution))
+    sizes[-1] += n_rows - sizes.sum()
+    return sizes
+
+
+def make_detections(n_rows, distribution="uniform", seed=0):
+    """
+    Synthetic ZTF like detections with every column used by compute and helpers.
+
+    :param n_rows: Number of detections
+    :type n_rows: int
+
+    :param distribution: Group size distribution, one of :data:`DISTRIBUTIONS`
+    :type distribution: string
+
+    :param seed: Random seed
+    :type seed: int
+
+    :return: A dataframe with detections
+    :rtype: :py:class:`pd.DataFrame`
+    """
+    rng = np.random.default_rng(seed)
+    sizes = group_sizes(n_rows, distribution, rng)
+    n_groups = len(sizes)
+    group = np.repeat(np.arange(n_groups), sizes)
+    # two bands per object
+    object_number = group // 2
+    fid = (group % 2 + 1).astype(np.int32)
+    position = np.arange(n_rows) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    first_mjd = rng.uniform(58200, 59000, n_groups)
+    mjd = first_mjd[group] + position * rng.uniform(0.5, 3, n_rows)
+    magnr = rng.uniform(14, 20, n_groups)[group].astype(np.float32)
+    detections = pd.DataFrame({
+        "objectId": np.char.add("ZTF", np.char.zfill(object_number.astype(str), 9)).astype(object),
+        "candid": np.arange(n_rows, dtype=np.int64) + 1000000000000000000,
+        "mjd": mjd,
+        "fid": fid,
+        "pid": rng.integers(1, 10 ** 12, n_rows, dtype=np.int64),
+        "diffmaglim": rng.uniform(19, 21, n_rows).astype(np.float32),
+        "isdiffpos": rng.choice(["t", "f", "1", "0"], n_rows, p=[0.6, 0.2, 0.15, 0.05]).astype(object),
+        "nid": rng.integers(1, 2000, n_rows).astype(np.int32),
+        "ra": rng.uniform(0, 360, n_groups)[group] + rng.normal(0, 1e-5, n_rows),
+        "dec": rng.uniform(-30, 90, n_groups)[group] + rng.normal(0, 1e-5, n_rows),
+        "magpsf": (magnr + rng.uniform(-1, 4, n_rows)).astype(np.float32),
+        "sigmapsf": rng.uniform(0.01, 0.3, n_rows).astype(np.float32),
+        "magap": rng.uniform(15, 21, n_rows).astype(np.float32),
+        "sigmagap": rng.uniform(0.01, 0.3, n_rows).astype(np.float32),
+        "distnr": np.abs(rng.normal(1, 1.5, n_groups))[group].astype(np.float32),
+        "magnr": magnr,
+        "sigmagnr": rng.uniform(0.01, 0.1, n_groups)[group].astype(np.float32),
+        "chinr": rng.uniform(0, 4, n_groups)[group].astype(np.float32),
+        "sharpnr": rng.uniform(-0.3, 0.3, n_groups)[group].astype(np.float32),
+        "rb": rng.uniform(0, 1, n_rows).astype(np.float32),
+        "magapbig": rng.uniform(15, 21, n_rows).astype(np.float32),
+        "sigmagapbig": rng.uniform(0.01, 0.3, n_rows).astype(np.float32),
+        "rfid": rng.integers(1, 3, n_rows).astype(np.int64) + 100000000 * fid,
+        "jdendref": rng.uniform(2458000, 2459000, n_rows),
+        "ndethist": (position + 1).astype(np.int32),
+        "ncovhist": (position + 10).astype(np.int32),
+        "jdstarthist": first_mjd[group] + 2400000.5,
+        "jdendhist": mjd + 2400000.5,
+        "parent_candid": np.where(rng.uniform(0, 1, n_rows) < 0.2, 0, 1000000000000000000).astype(np.int64),
+    })
+    for column in COL_PS1_ZTF:
+        if column == "candid":
+            continue
+        if column.startswith("objectidps") or column == "nmtchps":
+            detections[column] = rng.integers(0, 10 ** 6, n_groups)[group]
+        else:
+            detections[column] = rng.uniform(0, 2, n_groups)[group].astype(np.float32)
+    return detections
+
+
+def make_non_detections(detections, ratio=1., seed=0):
+    """
+    Synthetic non detections of the objects of a detections table, before and during their light curves.
+
+    :param detections: Synthetic detections
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param ratio: Number of non detections per detection
+    :type ratio: float
+
+    :return: A dataframe with non detections
+    :rtype: :py:class:`pd.DataFrame`
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_rows = max(int(len(detections) * ratio), 1)
+    rows = rng.integers(0, len(detections), n_rows)
+    return pd.DataFrame({
+        "objectId": detections["objectId"].values[rows],
+        "fid": detections["fid"].values[rows],
+        "mjd": detections["mjd"].values[rows] - rng.uniform(-5, 30, n_rows),
+        "diffmaglim": rng.uniform(19, 21, n_rows).astype(np.float32),
+    })
@@ -0,0 +1,47 @@
+"""
+ALeRCE light curve correction.
+
+The submodules and the main functions are imported on first use, so ``import lc_correction`` is cheap:
+``lc_correction.correction`` only loads :mod:`lc_correction.kernels` (NumPy), while
+``lc_correction.correct_detections`` loads :mod:`lc_correction.compute` (pandas). The library does not configure
+logging, that is left to the application.
+"""
+import importlib
+
+__version__ = "1.0.0"
+
+_SUBMODULES = ["arrow", "bulk", "cache", "cli", "compute", "helpers", "incremental", "instrumentation", "io", "kernels",
+               "keys", "pipeline", "reference", "schema", "segments", "store", "stream"]
+_FUNCTIONS = {
+    "correction": "kernels",
+    "correction_kernel": "kernels",
+    "correction_status": "kernels",
+    "count_status": "kernels",
+    "flux_correction_kernel": "kernels",
+    "apply_correction": "kernels",
+    "near_stellar": "kernels",
+    "is_stellar": "kernels",
+    "classify_stellar": "kernels",
+    "is_dubious": "kernels",
+    "correct_detections": "compute",
+    "compute_magstats": "compute",
+    "apply_object_stats_df": "compute",
+    "compute_object_stats": "compute",
+    "compute_dmdt": "compute",
+    "get_clean_corrected": "helpers",
+    "coerce_schema": "schema",
+}  #: module of each function exported by the package
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    if name in _FUNCTIONS:
+        value = getattr(importlib.import_module("." + _FUNCTIONS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_FUNCTIONS))
@@ -0,0 +1,262 @@
+"""
+Arrow versions of the stages, taking and returning :py:class:`pa.Table` (or :py:class:`pa.RecordBatch`), so a
+parquet-in/parquet-out job never builds a pandas dataframe.
+
+The numeric columns are viewed as NumPy arrays without copies and given to the same segmented reductions used by
+:func:`lc_correction.compute.correct_detections`, :func:`lc_correction.compute.compute_magstats` and
+:func:`lc_correction.compute.compute_dmdt`, so both paths return the same values. The object ids are dictionary
+encoded by Arrow and the output ids are taken from the input arrays, so no Python strings are made. Rows are sorted
+with the integer ``[objectId, fid]`` key instead of a pyarrow ``group_by``, which does not keep the order that
+first/last values and ties need.
+
+Example::
+
+    detections = pq.read_table("detections.parquet")
+    corrected = correct_table(detections)
+    magstats = magstats_table(corrected)
+    pq.write_table(clean_corrected_table(corrected), "corrected.parquet")
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .compute import (_correction_columns, _dmdt_columns, _dubious_column, _join_groups, _magstats_columns,
+                      _object_magstats_columns, _object_stats_columns)
+from .helpers import COL_CORRECTED
+from .instrumentation import instrument
+from .keys import encode_objects, group_keys
+from .schema import ISDIFFPOS_SIGN
+from .segments import segment_starts
+
+DEFAULT_STEP_ID = 'corr_bulk_0.0.1'  #: step_id_corr if no step name is given
+
+
+def _table(data):
+    if isinstance(data, pa.RecordBatch):
+        return pa.Table.from_batches([data])
+    return data
+
+
+def _numpy(column):
+    """
+    NumPy array of an Arrow column. Numeric columns with a single chunk and no nulls are not copied. Nulls are NaN,
+    so integer and boolean columns with nulls are float64.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    if column.null_count > 0:
+        if not pa.types.is_floating(column.type):
+            column = column.cast(pa.float64())
+        column = column.fill_null(np.nan)
+    return column.to_numpy(zero_copy_only=False)
+
+
+def _set_column(table, name, values):
+    values = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values)
+    if name in table.column_names:
+        return table.set_column(table.column_names.index(name), name, values)
+    return table.append_column(name, values)
+
+
+def _columns(table, order):
+    """
+    Function returning the columns of a table as arrays in the given order, converting each column once.
+    """
+    cache = {}
+
+    def column(name):
+        if name not in cache:
+            cache[name] = _numpy(table[name])[order]
+        return cache[name]
+    return column
+
+
+def _isdiffpos_sign(isdiffpos):
+    """
+    Sign of the subtraction of each detection, as :func:`lc_correction.schema.isdiffpos_sign`: numeric columns are
+    unchanged and strings are mapped to 1.0 or -1.0, null if unknown.
+    """
+    if pa.types.is_dictionary(isdiffpos.type):
+        isdiffpos = isdiffpos.cast(isdiffpos.type.value_type)
+    if not (pa.types.is_string(isdiffpos.type) or pa.types.is_large_string(isdiffpos.type)):
+        return isdiffpos
+    positive = pa.array([value for value, sign in ISDIFFPOS_SIGN.items() if sign > 0])
+    negative = pa.array([value for value, sign in ISDIFFPOS_SIGN.items() if sign < 0])
+    return pc.if_else(pc.is_in(isdiffpos, value_set=positive), 1.,
+                      pc.if_else(pc.is_in(isdiffpos, value_set=negative), -1., pa.scalar(None, pa.float64())))
+
+
+def _take(column, rows):
+    return column.take(pa.array(rows, type=pa.int64()))
+
+
+@instrument()
+def correct_table(detections, calculate_dubious=True, fluxes=False, magnitudes=True):
+    """
+    Arrow version of :func:`lc_correction.compute.correct_detections`. The detections are sorted by objectId and
+    fid, and objectId, fid and candid stay as columns.
+
+    :param detections: Detections of many objects.
+    :type detections: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param calculate_dubious: If you want compute the dubious flag, set it like True
+    :type calculate_dubious: boolean
+
+    :param fluxes: If you want the corrected flux columns in µJy, set it like True
+    :type fluxes: boolean
+
+    :param magnitudes: If you want the corrected magnitude columns
+    :type magnitudes: boolean
+
+    :return: Corrected detections
+    :rtype: :py:class:`pa.Table`
+    """
+    table = _table(detections)
+    codes, _ = encode_objects(table["objectId"])
+    key, _ = group_keys(codes, _numpy(table["fid"]))
+    order = np.argsort(key, kind="stable")
+    table = table.take(pa.array(order, type=pa.int64()))
+    key = key[order]
+
+    table = _set_column(table, "isdiffpos", _isdiffpos_sign(table["isdiffpos"]))
+    column = _columns(table, slice(None))
+    for name, values in _correction_columns(column("magnr"), column("magpsf"), column("sigmagnr"), column("sigmapsf"),
+                                            column("isdiffpos"), column("distnr"), column("jdendref"),
+                                            magnitudes=magnitudes, fluxes=fluxes).items():
+        table = _set_column(table, name, values)
+
+    if calculate_dubious:
+        table = _set_column(table, "dubious", _dubious_column(_numpy(table["corrected"]), column("isdiffpos"),
+                                                              column("candid"), key))
+    return table
+
+
+@instrument()
+def magstats_table(corrected, flags=False):
+    """
+    Arrow version of :func:`lc_correction.compute.compute_magstats`, without overrides of the first detection
+    values.
+
+    :param corrected: Corrected detections of many objects.
+    :type corrected: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :return: Magnitude statistics with objectId and fid columns, sorted by objectId and fid
+    :rtype: :py:class:`pa.Table`
+    """
+    table = _table(corrected)
+    codes, _ = encode_objects(table["objectId"])
+    key, _ = group_keys(codes, _numpy(table["fid"]))
+    order = np.lexsort((_numpy(table["mjd"]), key))
+    starts = segment_starts(key[order])
+    response = _magstats_columns(_columns(table, order), starts, len(order), flags=flags)
+    rows = order[starts]
+    columns = {"objectId": _take(table["objectId"], rows), "fid": _take(table["fid"], rows)}
+    columns.update({name: pa.array(values) for name, values in response.items()})
+    return pa.table(columns)
+
+
+@instrument()
+def object_stats_table(corrected, magstats, step_name=None, flags=False):
+    """
+    Arrow version of :func:`lc_correction.compute.apply_object_stats_df`. Objects without magnitude statistics
+    get nulls in the magnitude statistics columns.
+
+    :param corrected: Corrected detections of many objects.
+    :type corrected: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param magstats: Magnitude statistics, as returned by :func:`magstats_table`.
+    :type magstats: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :return: Object statistics with an objectId column, sorted by objectId
+    :rtype: :py:class:`pa.Table`
+    """
+    table = _table(corrected)
+    magstats = _table(magstats)
+    codes, objects = encode_objects(table["objectId"])
+    order = np.lexsort((_numpy(table["mjd"]), codes))
+    starts = segment_starts(codes[order])
+    if flags:
+        table = _set_column(table, "isdiffpos", _isdiffpos_sign(table["isdiffpos"]))
+    response = _object_stats_columns(_columns(table, order), starts, len(order), flags=flags)
+    response["step_id_corr"] = pa.repeat(pa.scalar(DEFAULT_STEP_ID if step_name is None else step_name),
+                                         len(starts))
+
+    # magnitude statistics of each object, joined by object code
+    stats_codes, _ = encode_objects(magstats["objectId"], categories=objects)
+    stats_order = np.lexsort((_numpy(magstats["fid"]), stats_codes))
+    stats_order = stats_order[stats_codes[stats_order] >= 0]
+    stats_starts = segment_starts(stats_codes[stats_order])
+    object_stats = _object_magstats_columns(_columns(magstats, stats_order), stats_starts, len(stats_order))
+    position = np.full(len(starts), -1, dtype=np.int64)
+    position[stats_codes[stats_order[stats_starts]]] = np.arange(len(stats_starts))
+    missing = position < 0
+    for name, values in object_stats.items():
+        response[name] = pa.array(values[np.maximum(position, 0)] if len(values) > 0
+                                  else np.zeros(len(starts), dtype=values.dtype), mask=missing)
+
+    columns = {"objectId": _take(table["objectId"], order[starts])}
+    columns.update({name: values if isinstance(values, pa.Array) else pa.array(values)
+                    for name, values in response.items()})
+    return pa.table(columns)
+
+
+@instrument()
+def dmdt_table(magstats, non_detections, dt_min=0.5):
+    """
+    Arrow version of :func:`lc_correction.compute.compute_dmdt`.
+
+    :param magstats: Magnitude statistics, as returned by :func:`magstats_table`.
+    :type magstats: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param non_detections: Non detections of many objects.
+    :type non_detections: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param dt_min:
+    :type dt_min: float
+
+    :return: dm/dt with objectId and fid columns, sorted by objectId and fid
+    :rtype: :py:class:`pa.Table`
+    """
+    stats = _table(magstats)
+    table = _table(non_detections)
+    stats_codes, objects = encode_objects(stats["objectId"])
+    codes, _ = encode_objects(table["objectId"], categories=objects)
+    order, row, key = _join_groups(stats_codes, _numpy(stats["fid"]), codes, _numpy(table["fid"]),
+                                   _numpy(table["mjd"]))
+    starts = segment_starts(key)
+    stats_row = row[starts]
+    response = _dmdt_columns(_numpy(table["mjd"])[order], _numpy(table["diffmaglim"])[order], order, starts,
+                             _numpy(stats["first_mjd"])[stats_row], _numpy(stats["magpsf_first"])[stats_row],
+                             _numpy(stats["sigmapsf_first"])[stats_row], dt_min=dt_min)
+    columns = {"objectId": _take(table["objectId"], order[starts]), "fid": _take(table["fid"], order[starts])}
+    columns.update({name: pa.array(values) for name, values in response.items()})
+    return pa.table(columns)
+
+
+def clean_corrected_table(corrected, step_name=None):
+    """
+    Arrow version of :func:`lc_correction.helpers.get_clean_corrected`.
+
+    :param corrected: Corrected detections, as returned by :func:`correct_table`.
+    :type corrected: :py:class:`pa.Table` or :py:class:`pa.RecordBatch`
+
+    :param step_name:
+    :type step_name: string
+
+    :return: The columns in :data:`lc_correction.helpers.COL_CORRECTED`, with has_stamp and step_id_corr
+    :rtype: :py:class:`pa.Table`
+    """
+    table = _table(corrected)
+    table = _set_column(table, "has_stamp", pc.fill_null(pc.equal(table["parent_candid"], 0), False))
+    table = _set_column(table, "step_id_corr", pa.repeat(pa.scalar(DEFAULT_STEP_ID if step_name is None
+                                                                    else step_name), table.num_rows))
+    return table.select(COL_CORRECTED)
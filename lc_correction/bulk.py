@@ -0,0 +1,225 @@
+import logging
+import math
+import os
+import shutil
+import tempfile
+from collections import deque
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .pipeline import STAGES, hash_partition, run_stages
+
+logger = logging.getLogger(__name__)
+
+MEMORY_EXPANSION = 8  #: peak memory of the correction chain over the size of its input
+#: columns whose dtype depends on the data of each bucket, written as float64 so all the parts have the same schema
+FLOAT64_COLUMNS = {"dmdt": ["dm_first", "sigmadm_first"]}
+SPILL_BUFFER = 0.5  #: rows buffered by the spill of each input, as a fraction of the memory budget
+
+
+def _parquet_size(path):
+    """Rows and uncompressed bytes of a parquet file."""
+    metadata = pq.ParquetFile(path).metadata
+    size = sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+    return metadata.num_rows, size
+
+
+class _Spill:
+    """
+    Rows of a parquet file spilled to disk by bucket. The rows of each bucket are buffered in memory and each flush
+    writes the buffer to one Arrow IPC file, one record batch per bucket, so a single file is open at a time and the
+    number of files does not grow with the number of buckets. A bucket is a ``(modulus, residue)`` pair of the hash
+    of objectId.
+    """
+
+    def __init__(self, directory, name, schema, buffer_size):
+        self.directory = directory
+        self.name = name
+        self.schema = schema
+        self.buffer_size = buffer_size
+        self.buffers = {}
+        self.buffered = 0
+        self.locations = {}
+        self.sizes = {}
+        self.rows = {}
+        self.references = {}
+        self.n_files = 0
+
+    def __contains__(self, bucket):
+        return bucket in self.locations or bucket in self.buffers
+
+    def size(self, bucket):
+        """Bytes of the rows of a bucket."""
+        return self.sizes.get(bucket, 0)
+
+    def write(self, bucket, batch):
+        self.buffers.setdefault(bucket, []).append(batch)
+        self.sizes[bucket] = self.sizes.get(bucket, 0) + batch.nbytes
+        self.rows[bucket] = self.rows.get(bucket, 0) + batch.num_rows
+        self.buffered += batch.nbytes
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffers:
+            return
+        path = os.path.join(self.directory, "{}-{}.arrow".format(self.name, self.n_files))
+        self.n_files += 1
+        index = 0
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, self.schema) as writer:
+                for bucket, batches in self.buffers.items():
+                    for batch in batches:
+                        writer.write_batch(batch)
+                        self.locations.setdefault(bucket, []).append((path, index))
+                        index += 1
+                    self.references[path] = self.references.get(path, 0) + 1
+        self.buffers = {}
+        self.buffered = 0
+
+    def batches(self, bucket):
+        """Record batches of a bucket, read one at a time."""
+        self.flush()
+        for path, index in self.locations.get(bucket, []):
+            with pa.memory_map(path, "r") as source:
+                yield pa.ipc.open_file(source).get_batch(index)
+
+    def read(self, bucket):
+        """Rows of a bucket as a dataframe, with mjd."""
+        table = pa.Table.from_batches(list(self.batches(bucket)), schema=self.schema)
+        df = table.to_pandas()
+        if "mjd" not in df.columns:
+            df["mjd"] = df["jd"] - 2400000.5
+        return df
+
+    def remove(self, bucket):
+        """Forget a bucket, deleting the files that no other bucket uses."""
+        self.buffers.pop(bucket, None)
+        self.sizes.pop(bucket, None)
+        self.rows.pop(bucket, None)
+        for path in {path for path, _ in self.locations.pop(bucket, [])}:
+            self.references[path] -= 1
+            if self.references[path] == 0:
+                del self.references[path]
+                os.remove(path)
+
+
+def _partition(batches, modulus, spill):
+    """Write the rows of record batches to the buckets of the hash of their objectId modulo ``modulus``."""
+    for batch in batches:
+        residues = hash_partition(batch.column("objectId").to_pandas(), modulus)
+        for residue in np.unique(residues):
+            spill.write((modulus, int(residue)), batch.filter(pa.array(residues == residue)))
+    spill.flush()
+
+
+def _split(bucket, n_parts, spills):
+    """
+    Split a bucket in ``n_parts`` buckets. The hash of a row of the bucket ``(modulus, residue)`` modulo
+    ``modulus * n_parts`` is ``residue + j * modulus``, so detections and non detections of an object stay together.
+
+    :return: The new buckets
+    :rtype: list
+    """
+    modulus, residue = bucket
+    for spill in spills:
+        _partition(spill.batches(bucket), modulus * n_parts, spill)
+        spill.remove(bucket)
+    return [(modulus * n_parts, residue + j * modulus) for j in range(n_parts)]
+
+
+def bulk_correct_parquet(detections_path, non_detections_path, out_dir, memory_budget=1024, step_name=None,
+                         flags=False, dt_min=0.5, tmp_dir=None):
+    """
+    Run the whole correction chain from parquet files to parquet files with bounded memory.
+
+    Instead of sorting the inputs, the rows are spilled to disk in buckets by a hash of objectId (the groups never
+    straddle two buckets), reading one batch of the inputs at a time. Then each bucket is processed in memory and its
+    results are written as a part of ``out_dir/corrected``, ``out_dir/magstats``, ``out_dir/objstats`` and
+    ``out_dir/dmdt``. The number of buckets is chosen so a bucket fits the memory budget on average, and a bucket
+    over the budget (skewed by large objects) is split again with a larger modulus of the hash before it is read. A
+    single object over the budget cannot be split and is processed anyway.
+
+    :param detections_path: Parquet file with detections, with mjd or jd.
+    :type detections_path: string
+
+    :param non_detections_path: Parquet file with non detections, with mjd or jd.
+    :type non_detections_path: string
+
+    :param out_dir: Output directory
+    :type out_dir: string
+
+    :param memory_budget: Memory budget in MB
+    :type memory_budget: int
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param dt_min:
+    :type dt_min: float
+
+    :param tmp_dir: Directory for the buckets, by default a temporary directory
+    :type tmp_dir: string
+
+    :return: Number of buckets processed, after splitting the ones over the memory budget
+    :rtype: int
+
+    Example::
+
+        bulk_correct_parquet("detections.parquet", "non_detections.parquet", "output", memory_budget=4096)
+    """
+    budget = memory_budget * 1024 ** 2
+    detections_rows, detections_size = _parquet_size(detections_path)
+    non_detections_rows, non_detections_size = _parquet_size(non_detections_path)
+    n_buckets = max(1, math.ceil((detections_size + non_detections_size) * MEMORY_EXPANSION / budget))
+    row_size = max(detections_size / max(detections_rows, 1), non_detections_size / max(non_detections_rows, 1), 1)
+    batch_size = max(1, int(budget / (MEMORY_EXPANSION * row_size)))
+    logger.info('{} buckets, batches of {} rows'.format(n_buckets, batch_size))
+
+    bucket_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        spills = []
+        for name, path in [("detections", detections_path), ("non_detections", non_detections_path)]:
+            parquet = pq.ParquetFile(path)
+            spill = _Spill(bucket_dir, name, parquet.schema_arrow, budget * SPILL_BUFFER)
+            _partition(parquet.iter_batches(batch_size=batch_size), n_buckets, spill)
+            spills.append(spill)
+        detections, non_detections = spills
+        for stage in STAGES:
+            os.makedirs(os.path.join(out_dir, stage), exist_ok=True)
+
+        pending = deque((n_buckets, bucket) for bucket in range(n_buckets))
+        unsplittable = set()
+        n_parts = 0
+        while pending:
+            bucket = pending.popleft()
+            if bucket not in detections:
+                non_detections.remove(bucket)
+                continue
+            n_split = math.ceil((detections.size(bucket) + non_detections.size(bucket)) * MEMORY_EXPANSION / budget)
+            if n_split > 1 and bucket not in unsplittable:
+                rows = detections.rows[bucket]
+                buckets = _split(bucket, n_split, spills)
+                # a bucket whose detections all land in one part is (almost surely) a single object
+                unsplittable.update(part for part in buckets if detections.rows.get(part) == rows)
+                pending.extend(buckets)
+                continue
+            if n_split > 1:
+                logger.warning('bucket {} of one object is over the memory budget'.format(bucket))
+            results = run_stages(detections.read(bucket), non_detections.read(bucket), step_name=step_name,
+                                 flags=flags, dt_min=dt_min)
+            detections.remove(bucket)
+            non_detections.remove(bucket)
+            for stage, result in results.items():
+                result = result.astype({name: "float64" for name in FLOAT64_COLUMNS.get(stage, [])})
+                pq.write_table(pa.Table.from_pandas(result),
+                               os.path.join(out_dir, stage, "part-{:05d}.parquet".format(n_parts)))
+            n_parts += 1
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+    return n_parts
@@ -0,0 +1,366 @@
+"""
+Result cache of the bulk pipeline, so objects without new detections or non detections are not recomputed.
+
+Each ``[objectId, fid]`` pair has a content fingerprint: a hash of its candids and of the mjd of its non detections.
+The hash of a group is the sum of the hashes of its rows, so it does not depend on the row order and it is computed
+for every group at once with the segmented reductions. The fingerprint of an object combines the fingerprints of its
+groups.
+
+:class:`ResultCache` is an SQLite file with the magstats and dmdt rows of each group and the objstats row of each
+object, keyed by fingerprint and library version. The fingerprints are salted with the parameters of the run and a
+hash of the source of the stage modules, so a change of the implementation does not hit rows computed by another one.
+When the cache grows over ``max_bytes`` the least recently used rows are evicted. :func:`run_cached` looks up every
+object, runs the pipeline on the objects with a missing or stale row and splices the cached rows back in, so a rerun
+costs O(changed objects) instead of O(catalog).
+
+Example::
+
+    cache = ResultCache("results.sqlite", max_bytes=2 ** 30)
+    results = run_cached(detections, non_detections, cache, n_jobs=8)
+    magstats = results["magstats"]
+"""
+import functools
+import hashlib
+import importlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import __version__
+from .keys import encode_objects, group_keys
+from .pipeline import run_bulk
+from .segments import segment_lengths, segment_starts
+
+CACHED_STAGES = ["magstats", "objstats", "dmdt"]  #: outputs of the pipeline kept in the cache
+GROUP_STAGES = ["magstats", "dmdt"]  #: stages with a row per ``[objectId, fid]``, objstats has a row per object
+OBJECT_FID = 0  #: fid of the objstats rows in the cache
+#: modules of the pipeline stages, a change in their source changes the fingerprints
+STAGE_MODULES = ["compute", "helpers", "keys", "kernels", "pipeline", "schema", "segments"]
+
+
+def _hash_groups(df, column):
+    """Order independent hash and number of rows of every ``[objectId, fid]`` group."""
+    codes, oids = encode_objects(df["objectId"])
+    fid = np.asarray(df["fid"].values, dtype=np.int64)
+    key, _ = group_keys(codes, fid)
+    order = np.argsort(key, kind="stable")
+    starts = segment_starts(key[order])
+    hashes = pd.util.hash_array(np.asarray(df[column].values))[order]
+    # uint64 sums wrap around, which is fine for a hash
+    total = np.add.reduceat(hashes, starts) if len(starts) else np.zeros(0, dtype=np.uint64)
+    first = order[starts]
+    index = pd.MultiIndex.from_arrays([np.asarray(oids, dtype=object)[codes[first]], fid[first]],
+                                      names=["objectId", "fid"])
+    return pd.DataFrame({"hash": total, "count": segment_lengths(starts, len(key))}, index=index)
+
+
+def group_fingerprints(detections, non_detections=None):
+    """
+    Content fingerprint of every ``[objectId, fid]`` pair with detections. It changes when a detection (by candid)
+    or a non detection (by mjd) of the pair is added or removed.
+
+    :param detections: A dataframe with objectId, fid and candid
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param non_detections: A dataframe with objectId, fid and mjd
+    :type non_detections: :py:class:`pd.DataFrame`
+
+    :return: Fingerprint of each pair, indexed by objectId and fid
+    :rtype: :py:class:`pd.Series`
+    """
+    detections = detections.reset_index() if "objectId" not in detections.columns else detections
+    frame = _hash_groups(detections, "candid")
+    if non_detections is not None:
+        non_detections = non_detections.reset_index() if "objectId" not in non_detections.columns else non_detections
+        nd = _hash_groups(non_detections, "mjd").reindex(frame.index, fill_value=0)
+        frame["nd_hash"] = nd["hash"].values.astype(np.uint64)
+        frame["nd_count"] = nd["count"].values
+    return pd.Series(pd.util.hash_pandas_object(frame, index=False).values, index=frame.index, name="fingerprint")
+
+
+def object_fingerprints(fingerprints):
+    """
+    Fingerprint of every object, from the fingerprints of its groups.
+
+    :param fingerprints: Fingerprints of the groups, as returned by :func:`group_fingerprints`
+    :type fingerprints: :py:class:`pd.Series`
+
+    :return: Fingerprint of each object, indexed by objectId
+    :rtype: :py:class:`pd.Series`
+    """
+    fingerprints = fingerprints.sort_index(level="objectId", sort_remaining=False, kind="mergesort")
+    oid = fingerprints.index.get_level_values("objectId")
+    groups = pd.DataFrame({"fid": fingerprints.index.get_level_values("fid"), "fingerprint": fingerprints.values})
+    hashes = pd.util.hash_pandas_object(groups, index=False).values
+    starts = segment_starts(np.asarray(oid, dtype=object))
+    frame = pd.DataFrame({"hash": np.add.reduceat(hashes, starts) if len(starts) else np.zeros(0, dtype=np.uint64),
+                          "count": segment_lengths(starts, len(hashes))})
+    return pd.Series(pd.util.hash_pandas_object(frame, index=False).values,
+                     index=pd.Index(oid[starts], name="objectId"), name="fingerprint")
+
+
+@functools.lru_cache(maxsize=None)
+def implementation_hash():
+    """
+    Hash of the source of the modules in :data:`STAGE_MODULES`.
+
+    :return: Hexadecimal SHA-1 digest
+    :rtype: string
+    """
+    digest = hashlib.sha1()
+    for name in STAGE_MODULES:
+        module = importlib.import_module("." + name, __package__)
+        with open(module.__file__, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def _salt(**params):
+    """
+    Hash of the pipeline parameters and of the stage implementation, mixed in the fingerprints so other parameters
+    or another implementation do not hit.
+    """
+    params["implementation"] = implementation_hash()
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).digest()
+    return np.frombuffer(digest[:8], dtype=np.uint64)[0]
+
+
+def _signed(values):
+    # SQLite integers are signed
+    return np.asarray(values, dtype=np.uint64).view(np.int64).tolist()
+
+
+class ResultCache:
+    """
+    Size bounded cache of pipeline rows in an SQLite file.
+
+    :param path: Path of the SQLite file, created if it does not exist
+    :type path: string
+
+    :param max_bytes: Maximum size of the cached rows, the least recently used rows are evicted over it. The size is
+        kept as a running total, so a cache file must have one writer at a time.
+    :type max_bytes: int
+
+    :param version: Version of the results, rows of other versions are dropped when the cache is opened
+    :type version: string
+    """
+
+    def __init__(self, path, max_bytes=2 ** 30, version=__version__):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = version
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (stage TEXT, oid TEXT, fid INTEGER, "
+                                    "fingerprint INTEGER, version TEXT, used REAL, size INTEGER, payload TEXT, "
+                                    "PRIMARY KEY (stage, oid, fid))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS columns (stage TEXT PRIMARY KEY, layout TEXT)")
+            self.connection.execute("DELETE FROM results WHERE version != ?", (version,))
+        self.bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def size(self):
+        """
+        :return: Size of the cached rows in bytes
+        :rtype: int
+        """
+        return self.bytes
+
+    def _layout(self, stage):
+        row = self.connection.execute("SELECT layout FROM columns WHERE stage = ?", (stage,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _wanted(self, oids, fids, fingerprints):
+        """Fill the temporary table of the keys of a query."""
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (position INTEGER, oid TEXT, fid INTEGER, "
+                       "fingerprint INTEGER)")
+        cursor.execute("DELETE FROM wanted")
+        cursor.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?)",
+                           zip(range(len(fingerprints)), map(str, oids), map(int, fids), fingerprints))
+        return cursor
+
+    def get(self, stage, oids, fids, fingerprints):
+        """
+        Cached rows of some keys with the given fingerprints. The hits are marked as used.
+
+        :param stage: magstats, objstats or dmdt
+        :type stage: string
+
+        :param oids: Object id of each key
+        :type oids: list
+
+        :param fids: Filter id of each key (:data:`OBJECT_FID` for objstats)
+        :type fids: list
+
+        :param fingerprints: Fingerprint of each key
+        :type fingerprints: :py:class:`numpy.ndarray`
+
+        :return: The cached rows with the index of the stage (None if the stage was never cached), and whether each
+            key was found. A key cached as missing is found but has no row.
+        :rtype: tuple(:py:class:`pd.DataFrame`, :py:class:`numpy.ndarray`)
+        """
+        found = np.zeros(len(fingerprints), dtype=bool)
+        layout = self._layout(stage)
+        if layout is None:
+            return None, found
+        cursor = self._wanted(oids, fids, _signed(fingerprints))
+        rows = cursor.execute("SELECT w.position, r.rowid, r.payload FROM wanted w JOIN results r ON r.stage = ? AND "
+                              "r.oid = w.oid AND r.fid = w.fid AND r.fingerprint = w.fingerprint AND r.version = ?",
+                              (stage, self.version)).fetchall()
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("UPDATE results SET used = ? WHERE rowid = ?",
+                                        [(now, rowid) for _, rowid, _ in rows])
+        found[[position for position, _, _ in rows]] = True
+        frame = pd.DataFrame([json.loads(payload) for _, _, payload in rows if payload is not None],
+                             columns=layout["columns"])
+        frame = frame.astype(dict(zip(layout["columns"], layout["dtypes"])))
+        return frame.set_index(layout["index"]), found
+
+    def put(self, stage, frame, fingerprints, missing=None):
+        """
+        Cache the rows of a stage, replacing the rows of the same keys, and evict over ``max_bytes``.
+
+        :param stage: magstats, objstats or dmdt
+        :type stage: string
+
+        :param frame: Rows of the stage, indexed by objectId (and fid)
+        :type frame: :py:class:`pd.DataFrame`
+
+        :param fingerprints: Fingerprint of each row
+        :type fingerprints: :py:class:`numpy.ndarray`
+
+        :param missing: Fingerprints of the keys without a row (e.g. dmdt of a group without non detections), indexed
+            like ``frame``
+        :type missing: :py:class:`pd.Series`
+        """
+        index = list(frame.index.names)
+        flat = frame.reset_index()
+        layout = {"index": index, "columns": list(flat.columns), "dtypes": [str(dtype) for dtype in flat.dtypes]}
+        oids = flat["objectId"].astype(str).tolist()
+        fids = flat["fid"].astype(int).tolist() if "fid" in index else [OBJECT_FID] * len(flat)
+        payloads = [json.dumps(row) for row in zip(*[flat[column].tolist() for column in flat.columns])]
+        sizes = list(map(len, payloads))
+        fingerprints = _signed(fingerprints)
+        if missing is not None and len(missing):
+            oids += missing.index.get_level_values("objectId").astype(str).tolist()
+            fids += missing.index.get_level_values("fid").astype(int).tolist() if "fid" in index \
+                else [OBJECT_FID] * len(missing)
+            fingerprints += _signed(missing.values)
+            payloads += [None] * len(missing)
+            sizes += [0] * len(missing)
+        # the replaced rows leave the running size
+        replaced = self._wanted(oids, fids, fingerprints).execute(
+            "SELECT COALESCE(SUM(r.size), 0) FROM wanted w JOIN results r ON r.stage = ? AND r.oid = w.oid AND "
+            "r.fid = w.fid", (stage,)).fetchone()[0]
+        now = time.time()
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO columns VALUES (?, ?)", (stage, json.dumps(layout)))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([stage] * len(oids), oids, fids, fingerprints, [self.version] * len(oids), [now] * len(oids),
+                    sizes, payloads))
+        self.bytes += sum(sizes) - replaced
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used rows until the cached rows fit in ``max_bytes``. The rows are read in the
+        order of use from an index, so only the evicted rows are visited.
+        """
+        if self.bytes <= self.max_bytes:
+            return
+        evicted, freed = [], 0
+        for rowid, size in self.connection.execute("SELECT rowid, size FROM results ORDER BY used, rowid"):
+            if self.bytes - freed <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            freed += size
+        with self.connection:
+            self.connection.executemany("DELETE FROM results WHERE rowid = ?", evicted)
+        self.bytes -= freed
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
+        self.bytes = 0
+
+
+def run_cached(detections, non_detections, cache, step_name=None, flags=False, dt_min=0.5, n_jobs=1, **kwargs):
+    """
+    Run the whole correction chain, recomputing only the objects whose fingerprint is not in the cache. The magstats,
+    objstats and dmdt are the same as :func:`lc_correction.pipeline.run_bulk`. The parameters are part of the
+    fingerprints, so a run with other parameters recomputes every object and replaces its cached rows.
+
+    :param detections: A dataframe with detections.
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param non_detections: A dataframe with non detections.
+    :type non_detections: :py:class:`pd.DataFrame`
+
+    :param cache: Cache of the results
+    :type cache: :py:class:`ResultCache`
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param dt_min:
+    :type dt_min: float
+
+    :param n_jobs: Number of processes for the recomputed objects, as in :func:`lc_correction.pipeline.run_bulk`
+    :type n_jobs: int
+
+    :return: magstats, objstats and dmdt dataframes, the corrected detections of the recomputed objects only and
+        ``dirty``, the recomputed object ids
+    :rtype: dict
+    """
+    salt = _salt(step_name=step_name, flags=flags, dt_min=dt_min)
+    groups = group_fingerprints(detections, non_detections) ^ salt
+    objects = object_fingerprints(groups)
+    group_oids = groups.index.get_level_values("objectId")
+    group_fids = groups.index.get_level_values("fid")
+
+    # an object is clean if every row of it is cached
+    cached, hit = {}, np.ones(len(objects), dtype=bool)
+    for stage in GROUP_STAGES:
+        cached[stage], found = cache.get(stage, group_oids, group_fids, groups.values)
+        hit &= ~objects.index.isin(group_oids[~found])
+    cached["objstats"], found = cache.get("objstats", objects.index, [OBJECT_FID] * len(objects), objects.values)
+    hit &= found
+    clean, dirty = objects.index[hit], objects.index[~hit]
+
+    results = {}
+    fresh = None
+    if len(dirty):
+        fresh = run_bulk(detections[detections["objectId"].isin(dirty)],
+                         non_detections[non_detections["objectId"].isin(dirty)],
+                         n_jobs=n_jobs, step_name=step_name, flags=flags, dt_min=dt_min, **kwargs)
+        dirty_groups = groups[group_oids.isin(dirty)]
+        for stage in GROUP_STAGES:
+            cache.put(stage, fresh[stage], dirty_groups.reindex(fresh[stage].index).values,
+                      missing=dirty_groups[~dirty_groups.index.isin(fresh[stage].index)])
+        cache.put("objstats", fresh["objstats"], objects.reindex(fresh["objstats"].index).values)
+    for stage in CACHED_STAGES:
+        parts = []
+        if len(clean):
+            rows = cached[stage]
+            parts.append(rows[rows.index.get_level_values("objectId").isin(clean)])
+        if fresh is not None:
+            parts.append(fresh[stage])
+        results[stage] = pd.concat(parts).sort_index() if parts else None
+    results["corrected"] = fresh["corrected"] if fresh is not None else None
+    results["dirty"] = dirty
+    return results
@@ -0,0 +1,34 @@
+import argparse
+import logging
+
+from .bulk import bulk_correct_parquet
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="lc-correction", description="ALeRCE light curve correction")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bulk = subparsers.add_parser("bulk", help="correct parquet files with bounded memory")
+    bulk.add_argument("--detections", required=True, help="parquet file with detections")
+    bulk.add_argument("--non-detections", required=True, help="parquet file with non detections")
+    bulk.add_argument("--out", required=True, help="output directory")
+    bulk.add_argument("--memory-budget", type=int, default=1024, help="memory budget in MB")
+    bulk.add_argument("--step-name", default=None)
+    bulk.add_argument("--flags", action="store_true", help="compute flags")
+    bulk.add_argument("--dt-min", type=float, default=0.5)
+    bulk.add_argument("--tmp-dir", default=None, help="directory for temporary files")
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s.%(funcName)s: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',)
+    args = get_parser().parse_args(argv)
+    if args.command == "bulk":
+        bulk_correct_parquet(args.detections, args.non_detections, args.out, memory_budget=args.memory_budget,
+                             step_name=args.step_name, flags=args.flags, dt_min=args.dt_min, tmp_dir=args.tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,170 +2,44 @@ import numpy as np
 import pandas as pd
 import logging
 
-DISTANCE_THRESHOLD = 1.4  #: max threshold for distnr
-SCORE_THRESHOLD = 0.4  #: max threshold for sgscore
-CHINR_THRESHOLD = 2  #: max threshold for chinr
-SHARPNR_MAX = 0.1  #: max value for sharpnr
-SHARPNR_MIN = -0.13  #: min value for sharpnr
-ZERO_MAG = 100.  #: default value for zero magnitude (a big value!)
-TRIPLE_NAN = (np.nan, np.nan, np.nan)
-MAGNITUDE_THRESHOLD = 13.2
-
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(name)s.%(funcName)s: %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',)
-
-
-def correction(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, oid=None):
-    """
-    Correction function. Implement of correction formula.
-
-    :param magnr: Magnitude of nearest source in reference image PSF-catalog within 30 arcsec [mag]
-    :type magnr: float
-
-    :param magpsf: Magnitude from PSF-fit photometry [mag]
-    :type magpsf: float
-
-    :param sigmagnr: 1-sigma uncertainty in magnr within 30 arcsec [mag]
-    :type sigmagnr: float
-
-    :param sigmapsf: 1-sigma uncertainty in magpsf [mag]
-    :type sigmapsf: float
-
-    :param isdiffpos: 1 => candidate is from positive (sci minus ref) subtraction; 0 => candidate is from negative (ref minus sci) subtraction
-    :type isdiffpos: int
-
-    :return: Correction for magnitude, sigma and sigma_ext
-    :rtype: tuple
-
-    Example::
-
-        (m_corr, s_corr, s_corr_ext) = correction(a, b, c, d, e)
-    """
-    if magnr < 0 or magpsf < 0:
-        return TRIPLE_NAN
-
-    try:
-        aux1 = 10**(-0.4 * magnr)
-        aux2 = 10**(-0.4 * magpsf)
-        aux3 = aux1 + isdiffpos * aux2
-        if aux3 > 0:
-            magpsf_corr = -2.5 * np.log10(aux3)
-            aux4 = aux2**2 * sigmapsf**2 - aux1**2 * sigmagnr**2
-
-            if aux4 >= 0:
-                sigmapsf_corr = np.sqrt(aux4) / aux3
-            else:
-                sigmapsf_corr = ZERO_MAG
-
-            sigmapsf_corr_ext = aux2 * sigmapsf / aux3
-        else:
-            magpsf_corr = ZERO_MAG
-            sigmapsf_corr = ZERO_MAG
-            sigmapsf_corr_ext = ZERO_MAG
-
-        return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
-
-    except Exception as e:
-        logging.error('Object {}: {}'.format(oid, e))
-        return TRIPLE_NAN
-
-
-def apply_correction(candidate):
-    """
-    Correction function for a set of detections
-
-    :param candidate: A dataframe with detections of a candidate.
-    :type candidate: :py:class:`pd.DataFrame`
-
-    :return: Wrapper for correction for magnitude, sigma and sigma_ext
-    :rtype: tuple
-
-    Example::
-
-        (m_corr, s_corr, s_corr_ext) = correction(a, b, c, d, e)
+from .instrumentation import instrument
+from .kernels import (DISTANCE_THRESHOLD, SCORE_THRESHOLD, CHINR_THRESHOLD, SHARPNR_MAX, SHARPNR_MIN, ZERO_MAG,
+                      TRIPLE_NAN, MAGNITUDE_THRESHOLD, STATUS_OK, STATUS_NEGATIVE_MAG, STATUS_NONPOSITIVE_FLUX,
+                      STATUS_NEGATIVE_VARIANCE, STATUS_NONFINITE, STATUS_NAMES, correction, magnitude_to_flux,
+                      correction_status, count_status, correction_kernel, correction_vectorized, apply_correction,
+                      near_stellar, is_stellar, is_dubious, StellarThresholds, DEFAULT_THRESHOLDS, classify_stellar,
+                      FLUX_ZERO_POINT, MICROJANSKY, flux_correction_kernel, flux_to_magnitude, _corrected_fluxes,
+                      _magnitudes, _microjansky)
+from .segments import (segment_starts, segment_lengths, segment_count, segment_sum, segment_mean, segment_std,
+                       segment_min, segment_max, segment_median, segment_nunique, segment_first_of_max)
+from .keys import encode_objects, group_keys, sort_groups
+from .schema import isdiffpos_sign
+
+logger = logging.getLogger(__name__)
+
+STELLAR_COLUMNS = ['distnr', 'distpsnr1', 'sgscore1', 'chinr', 'sharpnr']  #: first detection inputs of stellar flags
+MAGNITUDE_COLUMNS = ['magpsf_corr', 'sigmapsf_corr', 'sigmapsf_corr_ext']  #: corrected magnitude columns [mag]
+FLUX_COLUMNS = ['flux_corr', 'flux_corr_err', 'flux_corr_err_ext']  #: corrected flux columns [µJy]
+
+
+def log_status(status, corrected=None):
     """
-    isdiffpos = 1 if (candidate["isdiffpos"] in ["t", "1"]) else -1
-    magnr = candidate["magnr"]
-    magpsf = candidate['magpsf']
-    sigmagnr = candidate['sigmagnr']
-    sigmapsf = candidate['sigmapsf']
-
-    magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext = correction(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
-
-    return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
-
-
-def near_stellar(first_distnr, first_distpsnr1, first_sgscore1, first_chinr, first_sharpnr):
-    """
-    Get if object is near stellar
-
-    :param first_distnr: Distance to nearest source in reference image PSF-catalog within 30 arcsec [pixels]
-    :type first_distnr: :py:class:`float`
-
-    :param first_distpsnr1: Distance of closest source from PS1 catalog; if exists within 30 arcsec [arcsec]
-    :type first_distpsnr1: :py:class:`float`
-
-    :param first_sgscore1: Star/Galaxy score of closest source from PS1 catalog 0 <= sgscore <= 1 where closer to 1 implies higher likelihood of being a star
-    :type first_sgscore1: :py:class:`float`
-
-    :param first_chinr: DAOPhot chi parameter of nearest source in reference image PSF-catalog within 30 arcsec
-    :type first_chinr: :py:class:`float`
-
-    :param first_sharpnr: DAOPhot sharp parameter of nearest source in reference image PSF-catalog within 30 arcsec
-    :type first_sharpnr: :py:class:`float`
-
-
-    :return: if the object is near stellar
-    :rtype: tuple
-    """
-
-    nearZTF = 0 <= first_distnr < DISTANCE_THRESHOLD
-    nearPS1 = 0 <= first_distpsnr1 < DISTANCE_THRESHOLD
-    stellarPS1 = first_sgscore1 > SCORE_THRESHOLD
-    stellarZTF = first_chinr < CHINR_THRESHOLD and SHARPNR_MIN < first_sharpnr < SHARPNR_MAX
-    return nearZTF, nearPS1, stellarPS1, stellarZTF
-
-
-def is_stellar(nearZTF, nearPS1, stellarPS1, stellarZTF):
-    """
-    Get if object is stellar
-
-    :param nearZTF:
-    :type nearZTF: bool
-
-    :param nearPS1:
-    :type nearPS1: bool
-
-    :param stellarPS1:
-    :type stellarPS1: bool
-
-    :param stellarZTF:
-    :type stellarZTF: bool
-
-    :return: if the object is stellar
-    :rtype: bool
-
-    """
-    return (nearZTF & nearPS1 & stellarPS1) | (nearZTF & ~nearPS1 & stellarZTF)
-
-
-def is_dubious(corrected, isdiffpos, corr_magstats):
-    """Get if object is dubious
-
-    :param corrected:
-    :type corrected: bool
-
-    :param isdiffpos:
-    :type isdiffpos: bool
+    Count the branches of the detections (see :func:`count_status`) and log once the number of detections with non
+    finite inputs.
 
-    :param corr_magstats:
-    :type corr_magstats: bool
+    :param status: Status of each detection, from :func:`correction_kernel`
+    :type status: :py:class:`numpy.ndarray`
 
-    :return: if the object is dubious
-    :rtype: bool
+    :param corrected: Only count the detections that are corrected
+    :type corrected: :py:class:`numpy.ndarray`
     """
-    return (~corrected & (isdiffpos == -1)) | (corr_magstats & ~corrected) | (~corr_magstats & corrected)
+    count_status(status, corrected)
+    nonfinite = status == STATUS_NONFINITE
+    if corrected is not None:
+        nonfinite &= corrected
+    n = np.count_nonzero(nonfinite)
+    if n > 0:
+        logger.warning('{} corrected detections with non finite inputs'.format(n))
 
 
 def dmdt(magpsf_first, sigmapsf_first, nd_diffmaglim, mjd_first, nd_mjd):
@@ -210,13 +84,76 @@ def dmdt(magpsf_first, sigmapsf_first, nd_diffmaglim, mjd_first, nd_mjd):
     return df
 
 
-def apply_correction_df(df, calculate_dubious = False):
+def _correction_columns(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, distnr, jdendref, magnitudes=True,
+                        fluxes=False):
+    """
+    Corrected columns of detections given as arrays: corrected, the :data:`MAGNITUDE_COLUMNS` and (or) the
+    :data:`FLUX_COLUMNS`, and mjdendref. Both outputs come from the same corrected fluxes, and they are float64 for
+    any input precision (:func:`lc_correction.schema.coerce_schema` casts them to a compact schema).
+    """
+    with np.errstate(invalid="ignore"):
+        corrected = np.asarray(distnr < DISTANCE_THRESHOLD)
+    *results, status = _corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+    log_status(status, corrected)
+    columns = {"corrected": corrected}
+    if magnitudes:
+        for name, values in zip(MAGNITUDE_COLUMNS, _magnitudes(*results, status)):
+            columns[name] = np.where(corrected, values, np.nan)
+    if fluxes:
+        for name, values in zip(FLUX_COLUMNS, _microjansky(*results, status)):
+            columns[name] = np.where(corrected, values, np.nan)
+    columns["mjdendref"] = jdendref - 2400000.5
+    return columns
+
+
+def add_magnitudes(corrected):
+    """
+    Add the corrected magnitude columns to detections corrected with ``magnitudes=False``, from their flux columns.
+
+    :param corrected: A dataframe with the :data:`FLUX_COLUMNS`
+    :type corrected: :py:class:`pd.DataFrame`
+
+    :return: The dataframe with the :data:`MAGNITUDE_COLUMNS`, the same dataframe if it already has them
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        corrected = correct_detections(detections, fluxes=True, magnitudes=False)
+        magstats = compute_magstats(add_magnitudes(corrected))
+    """
+    if all(name in corrected.columns for name in MAGNITUDE_COLUMNS):
+        return corrected
+    dtype = corrected["flux_corr"].dtype
+    magnitudes = flux_to_magnitude(*[corrected[name].values for name in FLUX_COLUMNS])
+    return corrected.assign(**{name: values.astype(dtype) for name, values in zip(MAGNITUDE_COLUMNS, magnitudes)})
+
+
+def _dubious_column(corrected, isdiffpos, candid, key):
+    """
+    Dubious flag of detections sorted by ``[objectId, fid]`` key, using the corrected state of the first detection
+    (lowest candid) of each group.
+    """
+    starts = segment_starts(key)
+    first = np.lexsort((candid, key))[starts]
+    corr_magstats = np.repeat(corrected[first], segment_lengths(starts, len(key)))
+    return is_dubious(corrected, isdiffpos, corr_magstats)
+
+
+@instrument(groups=1)
+def apply_correction_df(df, calculate_dubious = False, fluxes=False, magnitudes=True):
     """
     Correction function for a set of detections with the same object id and filter id. Use with pd.DataFrame.apply(this)
 
     :param df: A dataframe with detections of a candidate.
     :type df: :py:class:`pd.DataFrame`
 
+    :param fluxes: If you want the :data:`FLUX_COLUMNS`, the corrected flux in µJy, set it like True
+    :type fluxes: boolean
+
+    :param magnitudes: If you want the :data:`MAGNITUDE_COLUMNS`. Without them, :func:`add_magnitudes` computes them
+        later from the fluxes
+    :type magnitudes: boolean
+
     :return: A pandas dataframe with detections corrected
     :rtype: :py:class:`pd.DataFrame`
 
@@ -227,15 +164,11 @@ def apply_correction_df(df, calculate_dubious = False):
 
     df.set_index("candid", inplace=True)
 
-    df['isdiffpos'] = df['isdiffpos'].map({'t': 1., 'f': -1., '1': 1., '0': -1.})
-    df["corrected"] = df["distnr"] < DISTANCE_THRESHOLD
-    correction_results = df.apply(
-        lambda x: correction(x.magnr, x.magpsf, x.sigmagnr, x.sigmapsf, x.isdiffpos, x.objectId)
-        if x["corrected"]
-        else (np.nan, np.nan, np.nan), axis=1, result_type="expand")
-
-    df["magpsf_corr"], df["sigmapsf_corr"], df["sigmapsf_corr_ext"] = correction_results[0], correction_results[1], correction_results[2]
-    df["mjdendref"] = df["jdendref"] - 2400000.5
+    df['isdiffpos'] = isdiffpos_sign(df['isdiffpos'], dtype=np.float64)
+    for column, values in _correction_columns(df["magnr"].values, df["magpsf"].values, df["sigmagnr"].values,
+                                              df["sigmapsf"].values, df["isdiffpos"].values, df["distnr"].values,
+                                              df["jdendref"].values, magnitudes=magnitudes, fluxes=fluxes).items():
+        df[column] = values
 
     if calculate_dubious:
         corr_magstats = df.loc[df.index.min()]["corrected"]
@@ -244,6 +177,48 @@ def apply_correction_df(df, calculate_dubious = False):
     return df.drop(["objectId", "fid"], axis=1)
 
 
+@instrument(groups=lambda result: len(result.index.droplevel("candid").unique()))
+def correct_detections(detections, calculate_dubious=True, fluxes=False, magnitudes=True):
+    """
+    Correction function for all detections of all objects in a single pass. It returns the same dataframe as
+    applying :func:`apply_correction_df` to each ``[objectId, fid]`` group, without the per-group overhead.
+
+    :param detections: A dataframe with detections of many objects.
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param calculate_dubious: If you want compute the dubious flag, set it like True
+    :type calculate_dubious: boolean
+
+    :param fluxes: If you want the :data:`FLUX_COLUMNS`, the corrected flux in µJy, set it like True
+    :type fluxes: boolean
+
+    :param magnitudes: If you want the :data:`MAGNITUDE_COLUMNS`. Without them, :func:`add_magnitudes` computes them
+        later from the fluxes
+    :type magnitudes: boolean
+
+    :return: A pandas dataframe with detections corrected, indexed by objectId, fid and candid
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        corrected = correct_detections(detections)
+    """
+    order, key = sort_groups(detections["objectId"], detections["fid"].values)
+    df = detections.take(order).reset_index(drop=True)
+    key = key[order]
+
+    df['isdiffpos'] = isdiffpos_sign(df['isdiffpos'], dtype=np.float64)
+    for column, values in _correction_columns(df["magnr"].values, df["magpsf"].values, df["sigmagnr"].values,
+                                              df["sigmapsf"].values, df["isdiffpos"].values, df["distnr"].values,
+                                              df["jdendref"].values, magnitudes=magnitudes, fluxes=fluxes).items():
+        df[column] = values
+
+    if calculate_dubious:
+        df["dubious"] = _dubious_column(df["corrected"].values, df["isdiffpos"].values, df["candid"].values, key)
+
+    return df.set_index(["objectId", "fid", "candid"])
+
+
 def get_flag_saturation(detections):
     detections = detections[detections.corrected]
     total = detections['magpsf_corr'].count()
@@ -260,7 +235,9 @@ def get_flag_reference(detections, first_detection):
     return last_reference > first_detection
 
 
-def apply_mag_stats(df, distnr=None, distpsnr1=None, sgscore1=None, chinr=None, sharpnr=None, flags=False):
+@instrument(groups=1)
+def apply_mag_stats(df, distnr=None, distpsnr1=None, sgscore1=None, chinr=None, sharpnr=None, flags=False,
+                    thresholds=None):
     """
     :param df: A dataframe with corrected detections of a candidate.
     :type df: :py:class:`pd.DataFrame`
@@ -283,6 +260,9 @@ def apply_mag_stats(df, distnr=None, distpsnr1=None, sgscore1=None, chinr=None,
     :param flags: If you want compute flags, set it like True
     :type flags: boolean
 
+    :param thresholds: Thresholds of the near and stellar flags, by default :data:`DEFAULT_THRESHOLDS`
+    :type thresholds: :py:class:`StellarThresholds`
+
     :return: A pandas dataframe with magnitude statistics
     :rtype: :py:class:`pd.DataFrame`
     """
@@ -303,18 +283,19 @@ def apply_mag_stats(df, distnr=None, distpsnr1=None, sgscore1=None, chinr=None,
     chinr = df_min.chinr if chinr is None else chinr
     sharpnr = df_min.sharpnr if sharpnr is None else sharpnr
 
-    response["nearZTF"], response["nearPS1"], response["stellarZTF"], response["stellarPS1"] = near_stellar(distnr,
-                                                                                                            distpsnr1,
-                                                                                                            sgscore1,
-                                                                                                            chinr,
-                                                                                                            sharpnr)
-    response["stellar"] = is_stellar(response["nearZTF"], response["nearPS1"], response["stellarZTF"], response["stellarPS1"])
+    nearZTF, nearPS1, stellarPS1, stellarZTF = near_stellar(distnr, distpsnr1, sgscore1, chinr, sharpnr,
+                                                            thresholds=thresholds)
+    response["nearZTF"] = nearZTF
+    response["nearPS1"] = nearPS1
+    response["stellarZTF"] = stellarZTF
+    response["stellarPS1"] = stellarPS1
+    response["stellar"] = is_stellar(nearZTF, nearPS1, stellarPS1, stellarZTF)
     # number of detections and dubious detections
     response["ndet"] = df.shape[0]
     response["ndubious"] = df.dubious.sum()
 
     # reference id
-    rfids = df.rfid.unique().astype(np.float)
+    rfids = df.rfid.unique().astype(float)
     rfids = rfids[~np.isnan(rfids)]
     response["nrfid"] = len(rfids)
 
@@ -356,6 +337,207 @@ def apply_mag_stats(df, distnr=None, distpsnr1=None, sgscore1=None, chinr=None,
     return pd.Series(response)
 
 
+def _first_detection_value(first, override, keys):
+    """
+    Get the first detection value of each group, replaced by an override when it is given. The override can be a
+    scalar applied to every group, or a :py:class:`pd.Series` indexed by objectId or by [objectId, fid].
+    """
+    if override is None:
+        return first
+    if not isinstance(override, pd.Series):
+        return np.full(len(first), override, dtype=np.float64)
+    if isinstance(override.index, pd.MultiIndex):
+        values = override.reindex(keys).values
+    else:
+        values = override.reindex(keys.get_level_values("objectId")).values
+    values = values.astype(np.float64)
+    return np.where(np.isnan(values), first, values)
+
+
+def _magstats_columns(column, starts, n, flags=False, first_value=None, thresholds=None):
+    """
+    Magnitude statistics of detections sorted by ``[objectId, fid]`` and mjd, one value per segment.
+
+    :param column: Function returning a column of the sorted detections as an array
+    :type column: callable
+
+    :param starts: Start position of each ``[objectId, fid]`` segment
+    :type starts: :py:class:`numpy.ndarray`
+
+    :param n: Number of detections
+    :type n: int
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param first_value: Function of a column name and its values at the first detection, returning the values to use
+        for the near/stellar flags (e.g. overridden values)
+    :type first_value: callable
+
+    :param thresholds: Thresholds of the near and stellar flags
+    :type thresholds: :py:class:`StellarThresholds`
+
+    :return: Statistics of each segment
+    :rtype: dict
+    """
+    lengths = segment_lengths(starts, n)
+    # first detection is the first row of the segment, last detection the first row with the maximum mjd
+    idxmin = starts
+    idxmax = segment_first_of_max(column("mjd"), starts)
+    first_value = (lambda name, first: first) if first_value is None else first_value
+
+    def first(name):
+        return column(name)[idxmin]
+
+    def last(name):
+        return column(name)[idxmax]
+
+    def stats(name):
+        values = column(name)
+        dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+        return [result.astype(dtype) for result in (segment_mean(values, starts),
+                                                    segment_median(values, starts),
+                                                    segment_max(values, starts),
+                                                    segment_min(values, starts),
+                                                    segment_std(values, starts))]
+
+    response = {}
+    # corrected at the first detection?
+    response["corrected"] = first("corrected")
+
+    stellar = classify_stellar(*[first_value(name, first(name)) for name in STELLAR_COLUMNS], thresholds=thresholds)
+    for name in ["nearZTF", "nearPS1", "stellarZTF", "stellarPS1", "stellar"]:
+        response[name] = stellar[name]
+    # number of detections and dubious detections
+    response["ndet"] = lengths
+    response["ndubious"] = segment_sum(column("dubious"), starts).astype(np.int64)
+
+    # reference id
+    response["nrfid"] = segment_nunique(column("rfid"), starts)
+
+    # psf magnitude statatistics
+    (response["magpsf_mean"], response["magpsf_median"], response["magpsf_max"], response["magpsf_min"],
+     response["sigmapsf"]) = stats("magpsf")
+    response["magpsf_first"] = first("magpsf")
+    response["sigmapsf_first"] = first("sigmapsf")
+    response["magpsf_last"] = last("magpsf")
+
+    # psf corrected magnitude statatistics
+    (response["magpsf_corr_mean"], response["magpsf_corr_median"], response["magpsf_corr_max"],
+     response["magpsf_corr_min"], response["sigmapsf_corr"]) = stats("magpsf_corr")
+    response["magpsf_corr_first"] = first("magpsf_corr")
+    response["magpsf_corr_last"] = last("magpsf_corr")
+
+    # corrected psf magnitude statistics
+    (response["magap_mean"], response["magap_median"], response["magap_max"], response["magap_min"],
+     response["sigmap"]) = stats("magap")
+    response["magap_first"] = first("magap")
+    response["magap_last"] = last("magap")
+
+    # time statistics
+    response["first_mjd"] = first("mjd")
+    response["last_mjd"] = last("mjd")
+
+    # flags
+    if flags:
+        magpsf_corr = np.where(column("corrected"), column("magpsf_corr"), np.nan)
+        total = segment_count(magpsf_corr, starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            satured = segment_sum(magpsf_corr < MAGNITUDE_THRESHOLD, starts)
+            response["saturation_rate"] = np.where(total > 0, satured / total, np.nan)
+    return response
+
+
+@instrument()
+def compute_magstats(corrected, distnr=None, distpsnr1=None, sgscore1=None, chinr=None, sharpnr=None, flags=False,
+                     thresholds=None):
+    """
+    Magnitude statistics of all objects in a single pass. It returns the same dataframe as applying
+    :func:`apply_mag_stats` to each ``[objectId, fid]`` group. The detections are sorted once by objectId, fid and
+    mjd, and every statistic is a segmented reduction over that order.
+
+    :param corrected: A dataframe with corrected detections of many objects. Without the corrected magnitudes they
+        are computed with :func:`add_magnitudes`.
+    :type corrected: :py:class:`pd.DataFrame`
+
+    :param distnr: Value for all objects, or a series indexed by objectId or by [objectId, fid]
+    :type distnr: float or :py:class:`pd.Series`
+
+    :param distpsnr1: Value for all objects, or a series indexed by objectId or by [objectId, fid]
+    :type distpsnr1: float or :py:class:`pd.Series`
+
+    :param sgscore1: Value for all objects, or a series indexed by objectId or by [objectId, fid]
+    :type sgscore1: float or :py:class:`pd.Series`
+
+    :param chinr: Value for all objects, or a series indexed by objectId or by [objectId, fid]
+    :type chinr: float or :py:class:`pd.Series`
+
+    :param sharpnr: Value for all objects, or a series indexed by objectId or by [objectId, fid]
+    :type sharpnr: float or :py:class:`pd.Series`
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param thresholds: Thresholds of the near and stellar flags, by default :data:`DEFAULT_THRESHOLDS`
+    :type thresholds: :py:class:`StellarThresholds`
+
+    :return: A pandas dataframe with magnitude statistics indexed by objectId and fid
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        magstats = compute_magstats(corrected)
+    """
+    if "objectId" not in corrected.columns:
+        corrected = corrected.reset_index()
+    corrected = add_magnitudes(corrected)
+    order, key = sort_groups(corrected["objectId"], corrected["fid"].values, corrected["mjd"].values)
+    df = corrected.take(order)
+    n = len(df)
+    starts = segment_starts(key[order])
+    keys = pd.MultiIndex.from_arrays([df["objectId"].values[starts], df["fid"].values[starts]],
+                                     names=["objectId", "fid"])
+    overrides = {"distnr": distnr, "distpsnr1": distpsnr1, "sgscore1": sgscore1, "chinr": chinr, "sharpnr": sharpnr}
+    response = _magstats_columns(lambda column: df[column].values, starts, n, flags=flags, thresholds=thresholds,
+                                 first_value=lambda column, first: _first_detection_value(first, overrides[column],
+                                                                                          keys))
+    return pd.DataFrame(response, index=keys)
+
+
+def classify_stellar_df(first, thresholds=None):
+    """
+    Near and stellar flags of first detections, without recomputing the magnitude statistics. With several profiles
+    all of them are evaluated in one call to :func:`classify_stellar`.
+
+    :param first: A dataframe with :data:`STELLAR_COLUMNS` of the first detection of each ``[objectId, fid]`` pair,
+        as returned by ``get_ps1_ztf(corrected, columns=STELLAR_COLUMNS)``
+    :type first: :py:class:`pd.DataFrame`
+
+    :param thresholds: A profile, or profiles by name
+    :type thresholds: :py:class:`StellarThresholds` or dict
+
+    :return: nearZTF, nearPS1, stellarZTF, stellarPS1 and stellar columns, as in :func:`compute_magstats`, with the
+        index of ``first`` (objectId and fid if they are columns). With profiles by name the columns are
+        ``(profile, flag)``.
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        first = get_ps1_ztf(corrected, columns=STELLAR_COLUMNS)
+        flags = classify_stellar_df(first, {"default": DEFAULT_THRESHOLDS, "strict": StellarThresholds(score=0.5)})
+    """
+    if "objectId" in first.columns:
+        first = first.set_index(["objectId", "fid"])
+    names = ["nearZTF", "nearPS1", "stellarZTF", "stellarPS1", "stellar"]
+    profiles = thresholds if isinstance(thresholds, dict) else None
+    flags = classify_stellar(*[first[column].values for column in STELLAR_COLUMNS],
+                             thresholds=list(profiles.values()) if profiles is not None else thresholds)
+    if profiles is None:
+        return pd.DataFrame({name: flags[name] for name in names}, index=first.index)
+    return pd.DataFrame({(profile, name): flags[name][i] for i, profile in enumerate(profiles) for name in names},
+                        index=first.index)
+
+
 def apply_objstats_from_correction(df, flags=False):
     """
     :param df: A dataframe with corrected detections of a candidate.
@@ -423,6 +605,84 @@ def apply_objstats_from_magstats(df):
     return pd.Series(response)
 
 
+def _object_stats_columns(column, starts, n, flags=False):
+    """
+    Object statistics of corrected detections sorted by objectId and mjd, one value per object, as
+    :func:`apply_objstats_from_correction`.
+
+    :param column: Function returning a column of the sorted detections as an array
+    :type column: callable
+
+    :param starts: Start position of each object
+    :type starts: :py:class:`numpy.ndarray`
+
+    :param n: Number of detections
+    :type n: int
+
+    :return: Statistics of each object
+    :rtype: dict
+    """
+    mjd = column("mjd")
+    # last detection is the first row with the maximum mjd (as argmax)
+    idxmax = segment_first_of_max(mjd, starts)
+    response = {}
+    response["ndethist"] = column("ndethist")[idxmax]
+    response["ncovhist"] = column("ncovhist")[idxmax]
+    response["mjdstarthist"] = column("jdstarthist")[idxmax] - 2400000.5
+    response["mjdendhist"] = column("jdendhist")[idxmax] - 2400000.5
+    response["meanra"] = segment_mean(column("ra"), starts)
+    response["meandec"] = segment_mean(column("dec"), starts)
+    response["sigmara"] = segment_std(column("ra"), starts)
+    response["sigmadec"] = segment_std(column("dec"), starts)
+    response["firstmjd"] = segment_min(mjd, starts)
+    response["lastmjd"] = mjd[idxmax]
+    response["deltamjd"] = response["lastmjd"] - response["firstmjd"]
+
+    # flags
+    if flags:
+        with np.errstate(invalid="ignore"):
+            response["diffpos"] = segment_min(column("isdiffpos"), starts) > 0
+            response["reference_change"] = segment_max(column("mjdendref"), starts) > response["firstmjd"]
+    return response
+
+
+def _object_magstats_columns(column, starts, n):
+    """
+    Object statistics of magnitude statistics sorted by objectId and fid, one value per object, as
+    :func:`apply_objstats_from_magstats`.
+
+    :param column: Function returning a column of the sorted magnitude statistics as an array
+    :type column: callable
+
+    :param starts: Start position of each object
+    :type starts: :py:class:`numpy.ndarray`
+
+    :param n: Number of magnitude statistics
+    :type n: int
+
+    :return: Statistics of each object
+    :rtype: dict
+    """
+    response = {}
+    for name in ["nearZTF", "nearPS1", "stellar", "corrected"]:
+        response[name] = np.logical_and.reduceat(column(name).astype(bool), starts) if n > 0 else np.zeros(0, bool)
+    response["ndet"] = segment_sum(column("ndet"), starts).astype(np.int64)
+    response["ndubious"] = segment_sum(column("ndubious"), starts).astype(np.int64)
+
+    # row of g (fid 1) and r (fid 2) of each object, -1 if missing
+    fid = column("fid")
+    positions = np.arange(n)
+    g = np.maximum.reduceat(np.where(fid == 1, positions, -1), starts) if n > 0 else np.zeros(0, np.int64)
+    r = np.maximum.reduceat(np.where(fid == 2, positions, -1), starts) if n > 0 else np.zeros(0, np.int64)
+    both = (g >= 0) & (r >= 0)
+    for name, source in [("g-r_max", "magpsf_min"), ("g-r_max_corr", "magpsf_corr_min"),
+                         ("g-r_mean", "magpsf_mean"), ("g-r_mean_corr", "magpsf_corr_mean")]:
+        values = column(source).astype(np.float64)
+        response[name] = np.where(both, values[g] - values[r], np.nan)
+    return response
+
+
+@instrument()
 def apply_object_stats_df(corrected, magstats, step_name=None, flags=False):
     """
     :param corrected: A dataframe with corrected detections.
@@ -438,9 +698,68 @@ def apply_object_stats_df(corrected, magstats, step_name=None, flags=False):
     :return: Object statistics in a dataframe
     :rtype: :py:class:`pd.DataFrame`
     """
-    basic_stats = corrected.groupby("objectId").apply(apply_objstats_from_correction, flags=flags)
-    obj_magstats = magstats.groupby("objectId").apply(apply_objstats_from_magstats)
+    basic_stats = corrected.groupby("objectId", observed=True).apply(apply_objstats_from_correction, flags=flags)
+    obj_magstats = magstats.groupby("objectId", observed=True).apply(apply_objstats_from_magstats)
+    basic_stats['step_id_corr'] = 'corr_bulk_0.0.1' if step_name is None else step_name
+    return basic_stats.join(obj_magstats)
+
+
+@instrument()
+def compute_object_stats(corrected, magstats, step_name=None, flags=False):
+    """
+    Object statistics of all objects in a single pass. It returns the same dataframe as
+    :func:`apply_object_stats_df`: the detections are sorted once by objectId and mjd and the magnitude statistics by
+    objectId and fid, and every statistic is a segmented reduction. The g-r colors take the g and r rows of each
+    object from the sorted magnitude statistics, and they are NaN when a band is missing.
+
+    :param corrected: A dataframe with corrected detections of many objects.
+    :type corrected: :py:class:`pd.DataFrame`
+
+    :param magstats: A dataframe with magnitude statistics.
+    :type magstats: :py:class:`pd.DataFrame`
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :return: Object statistics in a dataframe, indexed by objectId
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        objstats = compute_object_stats(corrected, magstats)
+    """
+    if "objectId" not in corrected.columns:
+        corrected = corrected.reset_index()
+    if "objectId" not in magstats.columns:
+        magstats = magstats.reset_index()
+
+    codes, _ = encode_objects(corrected["objectId"])
+    order = np.lexsort((corrected["mjd"].values, codes))
+    starts = segment_starts(codes[order])
+    basic_stats = pd.DataFrame(_object_stats_columns(lambda column: corrected[column].values[order], starts,
+                                                     len(order), flags=flags),
+                               index=pd.Index(corrected["objectId"].values[order[starts]], name="objectId"))
+    if not flags:
+        # as the numeric series of apply_objstats_from_correction, the columns share a dtype
+        basic_stats = basic_stats.astype(np.result_type(*basic_stats.dtypes))
     basic_stats['step_id_corr'] = 'corr_bulk_0.0.1' if step_name is None else step_name
+
+    stats_codes, _ = encode_objects(magstats["objectId"])
+    stats_order = np.lexsort((magstats["fid"].values, stats_codes))
+    stats_starts = segment_starts(stats_codes[stats_order])
+    obj_magstats = pd.DataFrame(_object_magstats_columns(lambda column: magstats[column].values[stats_order],
+                                                         stats_starts, len(stats_order)),
+                                index=pd.Index(magstats["objectId"].values[stats_order[stats_starts]], name="objectId"))
+    fid = magstats["fid"].values[stats_order]
+    if len(fid) and (np.logical_or.reduceat(fid == 1, stats_starts) &
+                     np.logical_or.reduceat(fid == 2, stats_starts)).all():
+        # as apply_objstats_from_magstats, the colors keep the magnitude dtype when no object misses a band
+        for name, source in [("g-r_max", "magpsf_min"), ("g-r_max_corr", "magpsf_corr_min"),
+                             ("g-r_mean", "magpsf_mean"), ("g-r_mean_corr", "magpsf_corr_mean")]:
+            obj_magstats[name] = obj_magstats[name].astype(magstats[source].dtype)
     return basic_stats.join(obj_magstats)
 
 
@@ -493,6 +812,7 @@ def do_dmdt(df, dt_min=0.5):
     return pd.Series(response)
 
 
+@instrument()
 def do_dmdt_df(magstats, non_dets, dt_min=0.5):
     """
     :param magstats:  A dataframe with magnitude statistics.
@@ -509,6 +829,145 @@ def do_dmdt_df(magstats, non_dets, dt_min=0.5):
     non_dets_magstats = non_dets.join(magstats, on=["objectId", "fid"], how="inner", rsuffix="_stats")
 
     apply_dmdt_df = lambda x: do_dmdt(x, dt_min=dt_min)
-    result = non_dets_magstats.groupby(["objectId", "fid"]).apply(apply_dmdt_df)
+    result = non_dets_magstats.groupby(["objectId", "fid"], observed=True).apply(apply_dmdt_df)
     magstats.reset_index(inplace=True)
     return result
+
+
+def _join_groups(stats_codes, stats_fid, codes, fid, mjd):
+    """
+    Inner join of rows (e.g. non detections) with the ``[objectId, fid]`` groups of a statistics table, with object
+    codes from the same dictionary. Rows without statistics are skipped.
+
+    :return: Positions of the joined rows sorted by ``[objectId, fid]`` key and mjd, the statistics row of each one and
+        their keys
+    :rtype: tuple
+    """
+    stride = int(np.max(np.append(stats_fid, fid), initial=0)) + 1
+    stats_key, _ = group_keys(stats_codes, stats_fid, stride=stride)
+    key, _ = group_keys(codes, fid, stride=stride)
+    order = np.lexsort((mjd, key))
+    stats_order = np.argsort(stats_key, kind="stable")
+    sorted_key = stats_key[stats_order]
+    position = np.searchsorted(sorted_key, key[order])
+    found = (codes[order] >= 0) & (position < len(sorted_key))
+    found[found] = sorted_key[position[found]] == key[order][found]
+    order = order[found]
+    return order, stats_order[position[found]], key[order]
+
+
+def _dmdt_columns(mjd, diffmaglim, order, starts, mjd_first, magpsf_first, sigmapsf_first, dt_min=0.5):
+    """
+    dm/dt of non detections sorted by ``[objectId, fid]`` and mjd, one value per segment.
+
+    :param mjd: mjd of the sorted non detections
+    :param diffmaglim: diffmaglim of the sorted non detections, dm_sigma keeps its precision (as in :func:`dmdt`)
+    :param order: Input position of the sorted non detections, to break ties as idxmin
+    :param starts: Start position of each segment
+    :param mjd_first: first_mjd of each segment
+    :param magpsf_first: magpsf_first of each segment
+    :param sigmapsf_first: sigmapsf_first of each segment
+
+    :return: dm/dt of each segment
+    :rtype: dict
+    """
+    precision = diffmaglim.dtype if np.issubdtype(diffmaglim.dtype, np.floating) else np.float64
+    # dm_first and sigmadm_first are differences of two values of the inputs, in their precision
+    dm_precision = np.result_type(magpsf_first.dtype, precision)
+    sigmadm_precision = np.result_type(sigmapsf_first.dtype, precision)
+    # magpsf_first + sigmapsf_first is computed in the precision of the magnitude statistics, as in do_dmdt
+    first_precision = np.result_type(magpsf_first.dtype, sigmapsf_first.dtype)
+    n = len(mjd)
+    mjd = mjd.astype(np.float64)
+    diffmaglim = diffmaglim.astype(np.float64)
+    lengths = segment_lengths(starts, n)
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    mjd_first = mjd_first.astype(np.float64)
+    magpsf_first = magpsf_first.astype(np.float64)
+    sigmapsf_first = sigmapsf_first.astype(np.float64)
+
+    # mjd is sorted inside each segment, so the number of non detections before a date is its insertion point
+    before_cutoff = mjd < (mjd_first - dt_min)[segment]
+    n_cutoff = segment_sum(before_cutoff, starts).astype(np.int64)
+    n_first = segment_sum(mjd < mjd_first[segment], starts).astype(np.int64)
+    last_cutoff = np.where(n_cutoff > 0, mjd[np.maximum(starts + n_cutoff - 1, 0)], np.nan)
+    last_first = np.where(n_first > 0, mjd[np.maximum(starts + n_first - 1, 0)], np.nan)
+
+    response = {}
+    response["close_nondet"] = last_cutoff < last_first
+
+    # dm_sigma keeps the precision of diffmaglim, as in dmdt
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dt = mjd_first[segment] - mjd
+        magpsf_sigma = magpsf_first.astype(first_precision) + sigmapsf_first.astype(first_precision)
+        dm_sigma = magpsf_sigma[segment].astype(precision) - diffmaglim.astype(precision)
+        dmsigdt = dm_sigma / dt
+    dmsigdt = np.where(before_cutoff & ~np.isnan(dmsigdt), dmsigdt, np.inf)
+    min_dmsigdt = np.minimum.reduceat(dmsigdt, starts) if n > 0 else np.zeros(0)
+    found = np.isfinite(min_dmsigdt)
+
+    # on ties, the minimum is the first non detection in the input order (as idxmin)
+    candidates = np.flatnonzero((dmsigdt == min_dmsigdt[segment]) & found[segment])
+    candidates = candidates[np.lexsort((order[candidates], segment[candidates]))]
+    first_candidate = np.ones(len(candidates), dtype=bool)
+    first_candidate[1:] = segment[candidates][1:] != segment[candidates][:-1]
+    idxmin = np.zeros(len(starts), dtype=np.int64)
+    idxmin[segment[candidates[first_candidate]]] = candidates[first_candidate]
+
+    # as in do_dmdt_df, they keep that precision unless a segment without dm/dt makes them float64
+    with np.errstate(invalid="ignore"):
+        min_diffmaglim = np.where(found, diffmaglim[idxmin], np.nan)
+        response["dmdt_first"] = np.where(found, min_dmsigdt, np.nan)
+        response["dm_first"] = _first_difference(magpsf_first, min_diffmaglim, dm_precision, found)
+        response["sigmadm_first"] = _first_difference(sigmapsf_first, min_diffmaglim, sigmadm_precision, found)
+        response["dt_first"] = np.where(found, dt[idxmin], np.nan)
+    return response
+
+
+def _first_difference(first, diffmaglim, precision, found):
+    """Difference of a first detection value and diffmaglim, computed in the precision of the inputs."""
+    difference = first.astype(precision) - diffmaglim.astype(precision)
+    return difference if found.all() else difference.astype(np.float64)
+
+
+@instrument()
+def compute_dmdt(magstats, non_dets, dt_min=0.5):
+    """
+    Compute of dm/dt of all objects in a single pass. It returns the same dataframe as :func:`do_dmdt_df`, but the
+    magnitude statistics are not joined to every non detection: the non detections are sorted once by objectId, fid
+    and mjd, and the cutoff ``first_mjd - dt_min`` of each group is found as its insertion point in that order.
+
+    The dtypes are also those of :func:`do_dmdt_df`: dm_first and sigmadm_first keep the precision of magpsf_first,
+    sigmapsf_first and diffmaglim (float32 for float32 inputs), but they are float64 if some group has no non
+    detection before the cutoff.
+
+    :param magstats:  A dataframe with magnitude statistics.
+    :type magstats: :py:class:`pd.DataFrame`
+
+    :param non_dets:  A dataframe with non detections.
+    :type non_dets: :py:class:`pd.DataFrame`
+
+    :param dt_min:
+    :type dt_min: float
+
+    :return: Compute of dmdt of an object in a dataframe
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        dmdt = compute_dmdt(magstats, non_detections)
+    """
+    stats = magstats.set_index(["objectId", "fid"]) if "objectId" in magstats.columns else magstats
+    # both tables are encoded with the objects of magstats, so the join compares integer keys
+    stats_codes, objects = encode_objects(stats.index.get_level_values("objectId"))
+    codes, _ = encode_objects(non_dets["objectId"], categories=objects)
+    order, row, key = _join_groups(stats_codes, stats.index.get_level_values("fid").values, codes,
+                                   non_dets["fid"].values, non_dets["mjd"].values)
+    starts = segment_starts(key)
+    keys = pd.MultiIndex.from_arrays([non_dets["objectId"].values[order[starts]],
+                                      non_dets["fid"].values[order[starts]]], names=["objectId", "fid"])
+    stats_row = row[starts]
+    response = _dmdt_columns(non_dets["mjd"].values[order], non_dets["diffmaglim"].values[order], order, starts,
+                             stats["first_mjd"].values[stats_row], stats["magpsf_first"].values[stats_row],
+                             stats["sigmapsf_first"].values[stats_row], dt_min=dt_min)
+    return pd.DataFrame(response, index=keys)
@@ -1,5 +1,8 @@
 import pandas as pd
 
+from .keys import sort_groups
+from .segments import segment_starts
+
 COL_DATA_QUALITY = ['aimage', 'aimagerat', 'bimage', 'bimagerat', 'candid', 'chipsf', 'classtar', 'fid', 'fwhm',
                    'mindtoedge', 'nbad', 'nneg', 'objectId', 'scorr', 'seeratio', 'sky', 'sumrat', 'xpos', 'ypos']
 COL_SS_ZTF = ['candid', 'objectId', 'ssdistnr', 'ssmagnr', 'ssnamenr']
@@ -19,12 +22,29 @@ def get_ss_ztf(df):
     return df[COL_SS_ZTF]
 
 
-def get_ps1_ztf(df):
-    def ps1(group):
-        first = group.mjd.min()
-        data = group[COL_PS1_ZTF][group.mjd == first]
-        return pd.Series(data.iloc[0].to_dict())
-    return df.groupby(["objectId", "fid"]).apply(ps1).reset_index()
+def get_ps1_ztf(df, columns=None):
+    """
+    PS1 data of the first detection of each ``[objectId, fid]`` pair. The detections are sorted once by an integer
+    ``[objectId, fid]`` key and mjd with a stable sort, and the first row of each group is taken. If two detections
+    share the minimum mjd, the first one in the input order is used.
+
+    :param df: A dataframe with detections.
+    :type df: :py:class:`pd.DataFrame`
+
+    :param columns: Columns to get, by default :data:`COL_PS1_ZTF`
+    :type columns: list
+
+    :return: A dataframe with objectId, fid and the columns of the first detections
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        ps1 = get_ps1_ztf(detections, columns=["sgscore1", "distpsnr1"])
+    """
+    columns = COL_PS1_ZTF if columns is None else columns
+    order, key = sort_groups(df["objectId"], df["fid"].values, df["mjd"].values)
+    first = order[segment_starts(key[order])]
+    return pd.DataFrame({column: df[column].values[first] for column in ["objectId", "fid"] + list(columns)})
 
 
 def get_clean_corrected(df, step_name=None):
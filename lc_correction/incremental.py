@@ -0,0 +1,822 @@
+import bisect
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+from .kernels import (DISTANCE_THRESHOLD, MAGNITUDE_THRESHOLD, _isdiffpos, _mjd, _value, correction, correction_kernel,
+                      is_dubious, is_stellar, near_stellar)
+from .schema import isdiffpos_sign
+
+FIRST_FIELDS = ['mjd', 'corrected', 'magpsf', 'sigmapsf', 'magpsf_corr', 'magap', 'distnr', 'distpsnr1', 'sgscore1',
+                'chinr', 'sharpnr']  #: fields kept from the first detection
+LAST_FIELDS = ['mjd', 'magpsf', 'magpsf_corr', 'magap']  #: fields kept from the last detection
+OBJECT_LAST_FIELDS = ['mjd', 'ndethist', 'ncovhist', 'jdstarthist', 'jdendhist']  #: fields kept from the last detection
+
+
+def _lower_candid(candid, reference):
+    """If candid is lower than the candid of the reference. A missing candid is never lower, unless both are."""
+    if candid is None:
+        return False
+    return reference is None or candid < reference
+
+
+def _native(value):
+    # numpy scalars as Python values, so the states stay JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _nanmin(a, b):
+    return b if math.isnan(a) else a if math.isnan(b) else min(a, b)
+
+
+def _nanmax(a, b):
+    return b if math.isnan(a) else a if math.isnan(b) else max(a, b)
+
+
+def _frame_column(df, field):
+    """Values of a column of a fragment, NaN if it is missing."""
+    return df[field].values if field in df.columns else np.full(len(df), np.nan)
+
+
+def _frame_mjd(df):
+    return df["mjd"].values if "mjd" in df.columns else df["jd"].values - 2400000.5
+
+
+def _frame_isdiffpos(df):
+    return np.asarray(isdiffpos_sign(df["isdiffpos"], dtype=np.float64), dtype=np.float64)
+
+
+def _frame_row(df, position, fields, values):
+    return {field: _native(values[field][position] if field in values else _frame_column(df, field)[position])
+            for field in fields}
+
+
+def merge(a, b):
+    """
+    Merge two partial statistics of the same kind, e.g. of two fragments of a light curve. The merge is associative
+    and it does not modify its inputs, so partial statistics can be reduced in any tree. On equal mjd, the first
+    (last) detection is taken from ``a``, as if the detections of ``a`` arrived first.
+
+    :param a: Partial statistics
+    :type a: :py:class:`RunningStats`, :py:class:`IncrementalMagStats`, :py:class:`IncrementalObjectStats` or
+        :py:class:`IncrementalDmdt`
+
+    :param b: Partial statistics of the same kind
+    :type b: same as ``a``
+
+    :return: The statistics of both
+    :rtype: same as ``a``
+    """
+    return a.merge(b)
+
+
+def merge_partials(*partials):
+    """
+    Merge dictionaries of partial statistics by key, e.g. the outputs of :func:`partial_magstats` over several files.
+
+    :param partials: Dictionaries of partial statistics
+    :type partials: dict
+
+    :return: The merged statistics of each key
+    :rtype: dict
+
+    Example::
+
+        partials = [partial_magstats(pd.read_parquet(path)) for path in paths]
+        magstats = {key: stats.finalize() for key, stats in merge_partials(*partials).items()}
+    """
+    merged = {}
+    for partial in partials:
+        for key, stats in partial.items():
+            merged[key] = merge(merged[key], stats) if key in merged else stats
+    return merged
+
+
+def partial_magstats(detections):
+    """
+    Partial magnitude statistics of each ``[objectId, fid]`` pair of a fragment of light curves.
+
+    :param detections: A dataframe with (corrected) detections
+    :type detections: :py:class:`pd.DataFrame`
+
+    :return: :py:class:`IncrementalMagStats` by ``(objectId, fid)``
+    :rtype: dict
+    """
+    if "objectId" not in detections.columns:
+        detections = detections.reset_index()
+    return {key: IncrementalMagStats.from_frame(group)
+            for key, group in detections.groupby(["objectId", "fid"], observed=True, sort=False)}
+
+
+def partial_object_stats(detections):
+    """
+    Partial statistics of each object of a fragment of light curves.
+
+    :param detections: A dataframe with (corrected) detections
+    :type detections: :py:class:`pd.DataFrame`
+
+    :return: :py:class:`IncrementalObjectStats` by objectId
+    :rtype: dict
+    """
+    if "objectId" not in detections.columns:
+        detections = detections.reset_index()
+    return {key: IncrementalObjectStats.from_frame(group)
+            for key, group in detections.groupby("objectId", observed=True, sort=False)}
+
+
+class RunningStats:
+    """
+    Running statistics of a value: count, mean and variance (Welford), minimum and maximum. If ``keep_values`` is
+    True the non NaN values are also kept sorted, so the median is exact. Statistics of two sets of values are
+    merged with :meth:`merge` (the variance with the parallel form of Welford's algorithm), and the median stays
+    exact because the sorted values are merged too.
+
+    Keeping the values costs O(n) memory, and each :meth:`update` inserts into a sorted list, which is O(n) (a
+    memory move, fast for light curves of thousands of detections). Use ``keep_values=False`` when the median is not
+    needed: the other statistics are O(1) in memory and time.
+    """
+
+    def __init__(self, keep_values=True):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.nan
+        self.max = np.nan
+        self.keep_values = keep_values
+        self.values = []
+
+    def update(self, value):
+        """
+        Add a value to the statistics. NaN values are skipped, as in pandas. O(1), or O(n) with ``keep_values``.
+
+        :param value: A magnitude
+        :type value: float
+        """
+        if value is None or math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if math.isnan(self.min) else min(self.min, value)
+        self.max = value if math.isnan(self.max) else max(self.max, value)
+        if self.keep_values:
+            bisect.insort(self.values, value)
+
+    @classmethod
+    def from_values(cls, values, keep_values=True):
+        """
+        :param values: Values, NaN values are skipped
+        :type values: :py:class:`numpy.ndarray`
+
+        :return: The statistics of the values
+        :rtype: :py:class:`RunningStats`
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        stats = cls(keep_values=keep_values)
+        if len(values) == 0:
+            return stats
+        stats.count = len(values)
+        stats.mean = float(values.mean())
+        stats.m2 = float(((values - stats.mean) ** 2).sum())
+        stats.min = float(values.min())
+        stats.max = float(values.max())
+        if keep_values:
+            stats.values = np.sort(values).tolist()
+        return stats
+
+    def merge(self, other):
+        """
+        :param other: Statistics of other values
+        :type other: :py:class:`RunningStats`
+
+        :return: The statistics of both sets of values
+        :rtype: :py:class:`RunningStats`
+        """
+        stats = RunningStats(keep_values=self.keep_values and other.keep_values)
+        stats.count = self.count + other.count
+        if stats.count > 0:
+            delta = other.mean - self.mean
+            stats.mean = self.mean + delta * other.count / stats.count
+            stats.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / stats.count
+        stats.min = _nanmin(self.min, other.min)
+        stats.max = _nanmax(self.max, other.max)
+        if stats.keep_values:
+            stats.values = list(heapq.merge(self.values, other.values))
+        return stats
+
+    def get_mean(self):
+        return self.mean if self.count > 0 else np.nan
+
+    def get_std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    def get_median(self):
+        if self.count == 0 or not self.keep_values:
+            return np.nan
+        return (self.values[(self.count - 1) // 2] + self.values[self.count // 2]) / 2
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max,
+                "keep_values": self.keep_values, "values": list(self.values)}
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls(keep_values=state["keep_values"])
+        stats.count = state["count"]
+        stats.mean = state["mean"]
+        stats.m2 = state["m2"]
+        stats.min = state["min"]
+        stats.max = state["max"]
+        stats.values = list(state["values"])
+        return stats
+
+
+class IncrementalMagStats:
+    """
+    Magnitude statistics of one ``[objectId, fid]`` pair, updated with one detection at a time. The output of
+    :meth:`to_series` is the same as :func:`lc_correction.compute.apply_mag_stats` over all the detections seen.
+
+    The dubious flag depends on the corrected state of the first detection, which can change if an older detection
+    arrives late. Both possible counts are kept, so ``ndubious`` is exact in any arrival order. As in
+    :func:`lc_correction.compute.apply_correction_df`, the first detection of the dubious flag is the one with the
+    lowest candid, while the first values of the statistics are those of the detection with the lowest mjd.
+
+    The statistics are also partial aggregates: :meth:`from_frame` computes them for a fragment of the light curve,
+    :meth:`merge` combines two fragments and :meth:`finalize` gives the output, so fragments in different files or
+    nodes are reduced without moving their detections.
+
+    Example::
+
+        stats = IncrementalMagStats()
+        for alert in alerts:
+            stats.update(alert["candidate"])
+        magstats = stats.to_series()
+
+        stats = merge(IncrementalMagStats.from_frame(night_1), IncrementalMagStats.from_frame(night_2))
+        magstats = stats.finalize()
+    """
+
+    def __init__(self):
+        self.ndet = 0
+        self.ndubious_corrected = 0  # dubious detections if the first detection is corrected
+        self.ndubious_uncorrected = 0  # dubious detections if the first detection is not corrected
+        self.ncorrected = 0  # corrected detections with corrected magnitude
+        self.nsaturated = 0
+        self.rfids = set()
+        self.magpsf = RunningStats()
+        self.magpsf_corr = RunningStats()
+        self.magap = RunningStats()
+        self.first = None
+        self.last = None
+        self.dubious_reference = None  # candid and corrected of the detection with the lowest candid
+
+    def update(self, candidate, corrected_magnitudes=None):
+        """
+        Add a new detection to the statistics.
+
+        :param candidate: A detection, like the candidate of an alert. It must have mjd or jd, and candid.
+        :type candidate: dict
+
+        :param corrected_magnitudes: magpsf_corr, sigmapsf_corr and sigmapsf_corr_ext of the detection if they are
+            already computed
+        :type corrected_magnitudes: tuple
+
+        :return: The corrected magnitudes of the detection
+        :rtype: tuple
+        """
+        mjd = _mjd(candidate)
+        isdiffpos = _isdiffpos(candidate["isdiffpos"])
+        corrected = bool(_value(candidate, "distnr") < DISTANCE_THRESHOLD)
+        if corrected_magnitudes is None:
+            corrected_magnitudes = correction(_value(candidate, "magnr"), candidate["magpsf"],
+                                              _value(candidate, "sigmagnr"), candidate["sigmapsf"], isdiffpos) \
+                if corrected else (np.nan, np.nan, np.nan)
+        magpsf_corr = corrected_magnitudes[0]
+
+        self.ndet += 1
+        self.ndubious_corrected += bool(is_dubious(np.bool_(corrected), isdiffpos, np.bool_(True)))
+        self.ndubious_uncorrected += bool(is_dubious(np.bool_(corrected), isdiffpos, np.bool_(False)))
+        if corrected and not math.isnan(magpsf_corr):
+            self.ncorrected += 1
+            self.nsaturated += magpsf_corr < MAGNITUDE_THRESHOLD
+
+        rfid = _value(candidate, "rfid")
+        if not math.isnan(rfid):
+            self.rfids.add(float(rfid))
+
+        self.magpsf.update(candidate["magpsf"])
+        self.magpsf_corr.update(magpsf_corr)
+        self.magap.update(_value(candidate, "magap"))
+
+        candid = candidate.get("candid")
+        if self.dubious_reference is None or _lower_candid(candid, self.dubious_reference["candid"]):
+            self.dubious_reference = {"candid": candid, "corrected": corrected}
+
+        values = {"mjd": mjd, "corrected": corrected, "magpsf_corr": magpsf_corr}
+        if self.first is None or mjd < self.first["mjd"]:
+            self.first = {field: values[field] if field in values else _value(candidate, field)
+                          for field in FIRST_FIELDS}
+        if self.last is None or mjd > self.last["mjd"]:
+            self.last = {field: values[field] if field in values else _value(candidate, field)
+                         for field in LAST_FIELDS}
+        return corrected_magnitudes
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Statistics of a fragment of the detections of one ``[objectId, fid]`` pair, the same as updating them with
+        each detection in order. The corrected magnitudes are taken from the fragment if it has them.
+
+        :param df: Detections with mjd (or jd)
+        :type df: :py:class:`pd.DataFrame`
+
+        :rtype: :py:class:`IncrementalMagStats`
+        """
+        stats = cls()
+        if len(df) == 0:
+            return stats
+        mjd = _frame_mjd(df)
+        isdiffpos = _frame_isdiffpos(df)
+        with np.errstate(invalid="ignore"):
+            corrected = np.asarray(_frame_column(df, "distnr") < DISTANCE_THRESHOLD)
+        if "magpsf_corr" in df.columns:
+            magpsf_corr = df["magpsf_corr"].values.astype(np.float64)
+        else:
+            magpsf_corr = correction_kernel(_frame_column(df, "magnr"), df["magpsf"].values,
+                                            _frame_column(df, "sigmagnr"), df["sigmapsf"].values, isdiffpos)[0]
+        magpsf_corr = np.where(corrected, magpsf_corr, np.nan)
+
+        stats.ndet = len(df)
+        stats.ndubious_corrected = int(np.count_nonzero(is_dubious(corrected, isdiffpos, np.bool_(True))))
+        stats.ndubious_uncorrected = int(np.count_nonzero(is_dubious(corrected, isdiffpos, np.bool_(False))))
+        valid = corrected & ~np.isnan(magpsf_corr)
+        stats.ncorrected = int(np.count_nonzero(valid))
+        stats.nsaturated = int(np.count_nonzero(magpsf_corr[valid] < MAGNITUDE_THRESHOLD))
+        rfid = _frame_column(df, "rfid").astype(np.float64)
+        stats.rfids = set(rfid[~np.isnan(rfid)].tolist())
+        stats.magpsf = RunningStats.from_values(df["magpsf"].values)
+        stats.magpsf_corr = RunningStats.from_values(magpsf_corr)
+        stats.magap = RunningStats.from_values(_frame_column(df, "magap"))
+
+        # first occurrence of the extremes, as the strict comparisons of update
+        values = {"mjd": mjd, "corrected": corrected, "magpsf_corr": magpsf_corr}
+        stats.first = _frame_row(df, int(np.argmin(mjd)), FIRST_FIELDS, values)
+        stats.last = _frame_row(df, int(np.argmax(mjd)), LAST_FIELDS, values)
+        position = int(np.argmin(df["candid"].values)) if "candid" in df.columns else 0
+        stats.dubious_reference = {"candid": _native(df["candid"].values[position]) if "candid" in df.columns else None,
+                                   "corrected": bool(corrected[position])}
+        return stats
+
+    def merge(self, other):
+        """
+        :param other: Statistics of other detections of the same ``[objectId, fid]`` pair
+        :type other: :py:class:`IncrementalMagStats`
+
+        :return: The statistics of both, see :func:`merge`
+        :rtype: :py:class:`IncrementalMagStats`
+        """
+        stats = IncrementalMagStats()
+        stats.ndet = self.ndet + other.ndet
+        stats.ndubious_corrected = self.ndubious_corrected + other.ndubious_corrected
+        stats.ndubious_uncorrected = self.ndubious_uncorrected + other.ndubious_uncorrected
+        stats.ncorrected = self.ncorrected + other.ncorrected
+        stats.nsaturated = self.nsaturated + other.nsaturated
+        stats.rfids = self.rfids | other.rfids
+        stats.magpsf = self.magpsf.merge(other.magpsf)
+        stats.magpsf_corr = self.magpsf_corr.merge(other.magpsf_corr)
+        stats.magap = self.magap.merge(other.magap)
+        first = self.first if other.first is None or (self.first is not None and
+                                                      not other.first["mjd"] < self.first["mjd"]) else other.first
+        last = self.last if other.last is None or (self.last is not None and
+                                                    not other.last["mjd"] > self.last["mjd"]) else other.last
+        stats.first = None if first is None else dict(first)
+        stats.last = None if last is None else dict(last)
+        reference = other.dubious_reference if self.dubious_reference is None or (
+            other.dubious_reference is not None and
+            _lower_candid(other.dubious_reference["candid"], self.dubious_reference["candid"])) \
+            else self.dubious_reference
+        stats.dubious_reference = None if reference is None else dict(reference)
+        return stats
+
+    @property
+    def ndubious(self):
+        if self.dubious_reference is None:
+            return 0
+        return self.ndubious_corrected if self.dubious_reference["corrected"] else self.ndubious_uncorrected
+
+    def to_series(self, flags=False):
+        """
+        :param flags: If you want compute flags, set it like True
+        :type flags: boolean
+
+        :return: A pandas series with magnitude statistics
+        :rtype: :py:class:`pd.Series`
+        """
+        first = self.first
+        last = self.last
+        response = {}
+        response['corrected'] = first["corrected"]
+        nearZTF, nearPS1, stellarPS1, stellarZTF = near_stellar(first["distnr"], first["distpsnr1"],
+                                                                first["sgscore1"], first["chinr"], first["sharpnr"])
+        response["nearZTF"] = nearZTF
+        response["nearPS1"] = nearPS1
+        response["stellarZTF"] = stellarZTF
+        response["stellarPS1"] = stellarPS1
+        response["stellar"] = is_stellar(nearZTF, nearPS1, stellarPS1, stellarZTF)
+        response["ndet"] = self.ndet
+        response["ndubious"] = self.ndubious
+        response["nrfid"] = len(self.rfids)
+
+        for name, stats, sigma in [("magpsf", self.magpsf, "sigmapsf"),
+                                   ("magpsf_corr", self.magpsf_corr, "sigmapsf_corr"),
+                                   ("magap", self.magap, "sigmap")]:
+            response[name + "_mean"] = stats.get_mean()
+            response[name + "_median"] = stats.get_median()
+            response[name + "_max"] = stats.max
+            response[name + "_min"] = stats.min
+            response[sigma] = stats.get_std()
+            response[name + "_first"] = first[name]
+            if name == "magpsf":
+                response["sigmapsf_first"] = first["sigmapsf"]
+            response[name + "_last"] = last[name]
+
+        response["first_mjd"] = first["mjd"]
+        response["last_mjd"] = last["mjd"]
+
+        if flags:
+            response["saturation_rate"] = self.nsaturated / self.ncorrected if self.ncorrected > 0 else np.nan
+        return pd.Series(response)
+
+    finalize = to_series  #: output of merged statistics, the columns of apply_mag_stats
+
+    def to_dict(self):
+        """
+        :return: The state of the statistics, that can be serialized as JSON
+        :rtype: dict
+        """
+        return {
+            "ndet": self.ndet,
+            "ndubious_corrected": self.ndubious_corrected,
+            "ndubious_uncorrected": self.ndubious_uncorrected,
+            "ncorrected": self.ncorrected,
+            "nsaturated": int(self.nsaturated),
+            "rfids": sorted(self.rfids),
+            "magpsf": self.magpsf.to_dict(),
+            "magpsf_corr": self.magpsf_corr.to_dict(),
+            "magap": self.magap.to_dict(),
+            "first": self.first,
+            "last": self.last,
+            "dubious_reference": self.dubious_reference,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        :param state: A state given by :meth:`to_dict`
+        :type state: dict
+
+        :return: The statistics with that state
+        :rtype: :py:class:`IncrementalMagStats`
+        """
+        stats = cls()
+        stats.ndet = state["ndet"]
+        stats.ndubious_corrected = state["ndubious_corrected"]
+        stats.ndubious_uncorrected = state["ndubious_uncorrected"]
+        stats.ncorrected = state["ncorrected"]
+        stats.nsaturated = state["nsaturated"]
+        stats.rfids = set(state["rfids"])
+        stats.magpsf = RunningStats.from_dict(state["magpsf"])
+        stats.magpsf_corr = RunningStats.from_dict(state["magpsf_corr"])
+        stats.magap = RunningStats.from_dict(state["magap"])
+        stats.first = None if state["first"] is None else dict(state["first"])
+        stats.last = None if state["last"] is None else dict(state["last"])
+        reference = state.get("dubious_reference")
+        if reference is None and stats.first is not None:
+            # states saved before the reference was kept, the first detection is the best guess
+            reference = {"candid": None, "corrected": stats.first["corrected"]}
+        stats.dubious_reference = None if reference is None else dict(reference)
+        return stats
+
+
+class IncrementalObjectStats:
+    """
+    Statistics of one object, updated with one detection at a time. The output of :meth:`to_series` is the same as
+    :func:`lc_correction.compute.apply_object_stats_df` for that object. As :class:`IncrementalMagStats`, they can
+    be computed for fragments with :meth:`from_frame` and merged.
+
+    Example::
+
+        stats = IncrementalObjectStats()
+        for alert in alerts:
+            stats.update(alert["candidate"])
+        objstats = stats.to_series(magstats={1: magstats_g, 2: magstats_r})
+    """
+
+    def __init__(self):
+        self.ra = RunningStats(keep_values=False)
+        self.dec = RunningStats(keep_values=False)
+        self.firstmjd = np.nan
+        self.last = None
+        self.min_isdiffpos = np.nan
+        self.max_mjdendref = np.nan
+
+    def update(self, candidate):
+        """
+        Add a new detection to the statistics.
+
+        :param candidate: A detection, like the candidate of an alert. It must have mjd or jd.
+        :type candidate: dict
+        """
+        mjd = _mjd(candidate)
+        self.ra.update(candidate["ra"])
+        self.dec.update(candidate["dec"])
+        self.firstmjd = mjd if math.isnan(self.firstmjd) else min(self.firstmjd, mjd)
+        if self.last is None or mjd > self.last["mjd"]:
+            self.last = {field: mjd if field == "mjd" else _value(candidate, field) for field in OBJECT_LAST_FIELDS}
+        self.min_isdiffpos = _nanmin(self.min_isdiffpos, _isdiffpos(candidate["isdiffpos"]))
+        mjdendref = candidate["mjdendref"] if "mjdendref" in candidate else _value(candidate, "jdendref") - 2400000.5
+        if not math.isnan(mjdendref):
+            self.max_mjdendref = mjdendref if math.isnan(self.max_mjdendref) else max(self.max_mjdendref, mjdendref)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Statistics of a fragment of the detections of one object, the same as updating them with each detection in
+        order.
+
+        :param df: Detections with mjd (or jd)
+        :type df: :py:class:`pd.DataFrame`
+
+        :rtype: :py:class:`IncrementalObjectStats`
+        """
+        stats = cls()
+        if len(df) == 0:
+            return stats
+        mjd = _frame_mjd(df)
+        stats.ra = RunningStats.from_values(df["ra"].values, keep_values=False)
+        stats.dec = RunningStats.from_values(df["dec"].values, keep_values=False)
+        stats.firstmjd = float(mjd.min())
+        stats.last = _frame_row(df, int(np.argmax(mjd)), OBJECT_LAST_FIELDS, {"mjd": mjd})
+        isdiffpos = _frame_isdiffpos(df)
+        if not np.isnan(isdiffpos).all():
+            stats.min_isdiffpos = _native(np.nanmin(isdiffpos))
+        mjdendref = df["mjdendref"].values if "mjdendref" in df.columns else _frame_column(df, "jdendref") - 2400000.5
+        mjdendref = np.asarray(mjdendref, dtype=np.float64)
+        if not np.isnan(mjdendref).all():
+            stats.max_mjdendref = float(np.nanmax(mjdendref))
+        return stats
+
+    def merge(self, other):
+        """
+        :param other: Statistics of other detections of the same object
+        :type other: :py:class:`IncrementalObjectStats`
+
+        :return: The statistics of both, see :func:`merge`
+        :rtype: :py:class:`IncrementalObjectStats`
+        """
+        stats = IncrementalObjectStats()
+        stats.ra = self.ra.merge(other.ra)
+        stats.dec = self.dec.merge(other.dec)
+        stats.firstmjd = _nanmin(self.firstmjd, other.firstmjd)
+        last = self.last if other.last is None or (self.last is not None and
+                                                   not other.last["mjd"] > self.last["mjd"]) else other.last
+        stats.last = None if last is None else dict(last)
+        stats.min_isdiffpos = _nanmin(self.min_isdiffpos, other.min_isdiffpos)
+        stats.max_mjdendref = _nanmax(self.max_mjdendref, other.max_mjdendref)
+        return stats
+
+    def to_series(self, magstats=None, step_name=None, flags=False):
+        """
+        :param magstats: Magnitude statistics of each band of the object, by fid
+        :type magstats: dict of :py:class:`IncrementalMagStats` or :py:class:`pd.Series`
+
+        :param step_name:
+        :type step_name: string
+
+        :param flags: If you want compute flags, set it like True
+        :type flags: boolean
+
+        :return: A pandas series with statistics of an object
+        :rtype: :py:class:`pd.Series`
+        """
+        last = self.last
+        response = {}
+        response["ndethist"] = last["ndethist"]
+        response["ncovhist"] = last["ncovhist"]
+        response["mjdstarthist"] = last["jdstarthist"] - 2400000.5
+        response["mjdendhist"] = last["jdendhist"] - 2400000.5
+        response["meanra"] = self.ra.get_mean()
+        response["meandec"] = self.dec.get_mean()
+        response["sigmara"] = self.ra.get_std()
+        response["sigmadec"] = self.dec.get_std()
+        response["firstmjd"] = self.firstmjd
+        response["lastmjd"] = last["mjd"]
+        response["deltamjd"] = response["lastmjd"] - response["firstmjd"]
+        if flags:
+            response["diffpos"] = self.min_isdiffpos > 0
+            response["reference_change"] = self.max_mjdendref > self.firstmjd
+        response["step_id_corr"] = 'corr_bulk_0.0.1' if step_name is None else step_name
+
+        if magstats is not None:
+            magstats = {fid: stats.to_series() if isinstance(stats, IncrementalMagStats) else stats
+                        for fid, stats in magstats.items()}
+            response["nearZTF"] = all(stats["nearZTF"] for stats in magstats.values())
+            response["nearPS1"] = all(stats["nearPS1"] for stats in magstats.values())
+            response["stellar"] = all(stats["stellar"] for stats in magstats.values())
+            response["corrected"] = all(stats["corrected"] for stats in magstats.values())
+            response["ndet"] = sum(stats["ndet"] for stats in magstats.values())
+            response["ndubious"] = sum(stats["ndubious"] for stats in magstats.values())
+            if 1 in magstats and 2 in magstats:
+                g = magstats[1]
+                r = magstats[2]
+                response["g-r_max"] = g["magpsf_min"] - r["magpsf_min"]  # 1=g ; 2=r
+                response["g-r_max_corr"] = g["magpsf_corr_min"] - r["magpsf_corr_min"]
+                response["g-r_mean"] = g["magpsf_mean"] - r["magpsf_mean"]
+                response["g-r_mean_corr"] = g["magpsf_corr_mean"] - r["magpsf_corr_mean"]
+            else:
+                response["g-r_max"] = np.nan
+                response["g-r_max_corr"] = np.nan
+                response["g-r_mean"] = np.nan
+                response["g-r_mean_corr"] = np.nan
+        return pd.Series(response)
+
+    finalize = to_series  #: output of merged statistics, the columns of apply_object_stats_df
+
+    def to_dict(self):
+        """
+        :return: The state of the statistics, that can be serialized as JSON
+        :rtype: dict
+        """
+        return {"ra": self.ra.to_dict(), "dec": self.dec.to_dict(), "firstmjd": self.firstmjd, "last": self.last,
+                "min_isdiffpos": self.min_isdiffpos, "max_mjdendref": self.max_mjdendref}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        :param state: A state given by :meth:`to_dict`
+        :type state: dict
+
+        :return: The statistics with that state
+        :rtype: :py:class:`IncrementalObjectStats`
+        """
+        stats = cls()
+        stats.ra = RunningStats.from_dict(state["ra"])
+        stats.dec = RunningStats.from_dict(state["dec"])
+        stats.firstmjd = state["firstmjd"]
+        stats.last = None if state["last"] is None else dict(state["last"])
+        stats.min_isdiffpos = state["min_isdiffpos"]
+        stats.max_mjdendref = state["max_mjdendref"]
+        return stats
+
+
+class IncrementalDmdt:
+    """
+    dm/dt of one ``[objectId, fid]`` pair, updated with one detection or non detection at a time. The output of
+    :meth:`to_series` is the same as :func:`lc_correction.compute.do_dmdt`.
+
+    Only the non detections before the first detection are kept: the first mjd can only decrease, so a later non
+    detection can never be used again. They are kept once per ``(mjd, fid)``, with only their diffmaglim, so a
+    replayed alert does not grow the state. A new non detection is merged in O(1). A detection older than the first one
+    changes the first mjd and magnitude, so the kept non detections are scanned again.
+
+    Example::
+
+        dmdt = IncrementalDmdt()
+        for alert in alerts:
+            dmdt.update_detection(alert["candidate"])
+            for prv in alert["prv_candidates"]:
+                if prv["candid"] is None:
+                    dmdt.update_non_detection(prv)
+        result = dmdt.to_series()
+    """
+
+    def __init__(self, dt_min=0.5):
+        self.dt_min = dt_min
+        self.first_mjd = np.nan
+        self.magpsf_first = np.nan
+        self.sigmapsf_first = np.nan
+        self.non_detections = {}  # (mjd, fid): diffmaglim in arrival order
+        self.best = None  # (dmsigdt, mjd, diffmaglim) of the minimum dm/dt
+
+    def _dmsigdt(self, mjd, diffmaglim):
+        return (self.magpsf_first + self.sigmapsf_first - diffmaglim) / (self.first_mjd - mjd)
+
+    def _merge(self, mjd, diffmaglim):
+        if not mjd < self.first_mjd - self.dt_min:
+            return
+        dmsigdt = self._dmsigdt(mjd, diffmaglim)
+        # on ties the first non detection is kept, as in idxmin
+        if not math.isnan(dmsigdt) and (self.best is None or dmsigdt < self.best[0]):
+            self.best = (dmsigdt, mjd, diffmaglim)
+
+    def update_detection(self, candidate):
+        """
+        Add a new detection.
+
+        :param candidate: A detection, like the candidate of an alert. It must have mjd or jd.
+        :type candidate: dict
+        """
+        mjd = _mjd(candidate)
+        if not math.isnan(self.first_mjd) and not mjd < self.first_mjd:
+            return
+        self.first_mjd = mjd
+        self.magpsf_first = candidate["magpsf"]
+        self.sigmapsf_first = candidate["sigmapsf"]
+        self.non_detections = {key: diffmaglim for key, diffmaglim in self.non_detections.items() if key[0] < mjd}
+        self.best = None
+        for (nd_mjd, _), diffmaglim in self.non_detections.items():
+            self._merge(nd_mjd, diffmaglim)
+
+    def update_non_detection(self, non_detection):
+        """
+        Add a new non detection.
+
+        :param non_detection: A non detection, like the previous candidates of an alert without candid. It must have
+            mjd or jd and diffmaglim. A non detection with the same mjd and fid as a kept one is ignored.
+        :type non_detection: dict
+        """
+        mjd = _mjd(non_detection)
+        if not math.isnan(self.first_mjd) and not mjd < self.first_mjd:
+            return
+        key = (mjd, non_detection.get("fid"))
+        if key in self.non_detections:
+            return
+        diffmaglim = _value(non_detection, "diffmaglim")
+        self.non_detections[key] = diffmaglim
+        if not math.isnan(self.first_mjd):
+            self._merge(mjd, diffmaglim)
+
+    def to_series(self):
+        """
+        :return: Compute of dmdt of an object
+        :rtype: :py:class:`pd.Series`
+        """
+        response = {}
+        cutoff = self.first_mjd - self.dt_min
+        before_cutoff = [mjd for mjd, _ in self.non_detections if mjd < cutoff]
+        before_first = [mjd for mjd, _ in self.non_detections if mjd < self.first_mjd]
+        response["close_nondet"] = len(before_cutoff) > 0 and max(before_cutoff) < max(before_first)
+        if self.best is not None:
+            dmsigdt, mjd, diffmaglim = self.best
+            response["dmdt_first"] = dmsigdt
+            response["dm_first"] = self.magpsf_first - diffmaglim
+            response["sigmadm_first"] = self.sigmapsf_first - diffmaglim
+            response["dt_first"] = self.first_mjd - mjd
+        else:
+            response["dmdt_first"] = np.nan
+            response["dm_first"] = np.nan
+            response["sigmadm_first"] = np.nan
+            response["dt_first"] = np.nan
+        return pd.Series(response)
+
+    def merge(self, other):
+        """
+        :param other: dm/dt of other detections and non detections of the same ``[objectId, fid]`` pair, with the
+            same ``dt_min``
+        :type other: :py:class:`IncrementalDmdt`
+
+        :return: The dm/dt of both, see :func:`merge`
+        :rtype: :py:class:`IncrementalDmdt`
+        """
+        dmdt = IncrementalDmdt.from_dict(self.to_dict())
+        if not math.isnan(other.first_mjd):
+            dmdt.update_detection({"mjd": other.first_mjd, "magpsf": other.magpsf_first,
+                                   "sigmapsf": other.sigmapsf_first})
+        for (mjd, fid), diffmaglim in other.non_detections.items():
+            dmdt.update_non_detection({"mjd": mjd, "fid": fid, "diffmaglim": diffmaglim})
+        return dmdt
+
+    def to_dict(self):
+        """
+        :return: The state of the dm/dt, that can be serialized as JSON
+        :rtype: dict
+        """
+        return {"dt_min": self.dt_min, "first_mjd": self.first_mjd, "magpsf_first": self.magpsf_first,
+                "sigmapsf_first": self.sigmapsf_first,
+                "non_detections": [[mjd, fid, diffmaglim] for (mjd, fid), diffmaglim in self.non_detections.items()],
+                "best": None if self.best is None else list(self.best)}
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        :param state: A state given by :meth:`to_dict`
+        :type state: dict
+
+        :return: The dm/dt with that state
+        :rtype: :py:class:`IncrementalDmdt`
+        """
+        dmdt = cls(dt_min=state["dt_min"])
+        dmdt.first_mjd = state["first_mjd"]
+        dmdt.magpsf_first = state["magpsf_first"]
+        dmdt.sigmapsf_first = state["sigmapsf_first"]
+        # states written before the deduplication have (mjd, diffmaglim) pairs without fid
+        dmdt.non_detections = {}
+        for nd in state["non_detections"]:
+            mjd, fid, diffmaglim = nd if len(nd) == 3 else (nd[0], None, nd[1])
+            dmdt.non_detections.setdefault((mjd, fid), diffmaglim)
+        dmdt.best = None if state["best"] is None else tuple(state["best"])
+        return dmdt
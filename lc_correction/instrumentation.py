@@ -0,0 +1,290 @@
+"""
+Opt-in instrumentation of the public stages.
+
+Every instrumented stage emits a record with its wall time, rows in and out, number of groups and (if enabled) peak
+allocation, plus the counters of the branches taken inside the stage (e.g. the NaN and ZERO_MAG branches of the
+correction). Records go to the sinks added with :func:`enable`. Without sinks, an instrumented call only checks an
+empty list, so the hooks can stay in production code.
+
+Example::
+
+    collector = MemoryCollector()
+    with instrumented(collector):
+        corrected = correct_detections(detections)
+    print(collector.summary())
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from functools import wraps
+
+PREFIX = "lc_correction"  #: prefix of the Prometheus metrics
+
+_sinks = []
+_options = {"memory": False}
+_local = threading.local()
+
+
+def enabled():
+    """
+    :return: True if there is some sink
+    :rtype: bool
+    """
+    return bool(_sinks)
+
+
+def enable(sink, memory=False):
+    """
+    Send the records of the instrumented stages to a sink.
+
+    :param sink: An object with an ``emit(record)`` method, like :class:`MemoryCollector`
+    :type sink: object
+
+    :param memory: If you want the peak allocation of each stage, set it like True. Tracing allocations with
+        :mod:`tracemalloc` slows down the stages.
+    :type memory: boolean
+    """
+    _sinks.append(sink)
+    _options["memory"] = _options["memory"] or memory
+
+
+def disable(sink=None):
+    """
+    Remove a sink, or every sink if None.
+    """
+    if sink is None:
+        _sinks.clear()
+    elif sink in _sinks:
+        _sinks.remove(sink)
+    if not _sinks:
+        _options["memory"] = False
+
+
+@contextlib.contextmanager
+def instrumented(sink, memory=False):
+    """
+    Context manager that enables a sink and removes it at exit.
+    """
+    enable(sink, memory=memory)
+    try:
+        yield sink
+    finally:
+        disable(sink)
+        if hasattr(sink, "flush"):
+            sink.flush()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def count(branch, value=1):
+    """
+    Add to the counter of a branch of the running stage. It does nothing when there are no sinks.
+
+    :param branch: Name of the branch
+    :type branch: string
+
+    :param value: Number of rows that took the branch
+    :type value: int
+    """
+    if not _sinks:
+        return
+    stack = _stack()
+    if stack:
+        stack[-1]["counters"][branch] += int(value)
+    else:
+        _emit({"stage": None, "seconds": 0., "rows_in": None, "rows_out": None, "groups": None,
+               "peak_memory": None, "counters": {branch: int(value)}})
+
+
+def _emit(record):
+    for sink in list(_sinks):
+        sink.emit(record)
+
+
+def _rows(value):
+    # pandas is not imported here, a dataframe can only exist if some other module imported it
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return len(value)
+    # arrow tables and record batches
+    if hasattr(value, "num_rows"):
+        return value.num_rows
+    # a series is the row of a single group, as returned by apply_mag_stats
+    return 1 if pd is not None and isinstance(value, pd.Series) else None
+
+
+def instrument(stage=None, groups=None):
+    """
+    Decorator of a stage. The rows in are the rows of the first argument, the rows out the rows of the result.
+
+    :param stage: Name of the stage, by default the name of the function
+    :type stage: string
+
+    :param groups: Function of the result returning the number of groups, by default the rows out. Use 1 for
+        functions applied to one group.
+    :type groups: callable or int
+    """
+    def decorator(function):
+        name = function.__name__ if stage is None else stage
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return function(*args, **kwargs)
+            record = {"stage": name, "seconds": 0., "rows_in": _rows(args[0]) if args else None, "rows_out": None,
+                      "groups": None, "peak_memory": None, "counters": defaultdict(int)}
+            stack = _stack()
+            # peak allocation is only traced in the outermost stage
+            trace = _options["memory"] and not stack and not tracemalloc.is_tracing()
+            stack.append(record)
+            if trace:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                record["seconds"] = time.perf_counter() - start
+                if trace:
+                    record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                stack.pop()
+            record["rows_out"] = _rows(result)
+            if callable(groups):
+                record["groups"] = groups(result)
+            else:
+                record["groups"] = record["rows_out"] if groups is None else groups
+            record["counters"] = dict(record["counters"])
+            _emit(record)
+            return result
+        return wrapper
+    return decorator
+
+
+class MemoryCollector:
+    """
+    Sink that keeps every record in memory.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records = []
+
+    def summary(self):
+        """
+        Totals by stage: calls, seconds, rows in, rows out, groups, maximum peak memory and a column for each branch
+        counter.
+
+        :rtype: :py:class:`pd.DataFrame`
+        """
+        import pandas as pd
+
+        totals = _aggregate(self.records)
+        return pd.DataFrame.from_dict({stage: dict({field: value for field, value in values.items()
+                                                    if field != "counters"}, **values["counters"])
+                                       for stage, values in totals.items()}, orient="index")
+
+
+class CallbackSink:
+    """
+    Sink that calls a function with each record.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, record):
+        self.callback(record)
+
+
+class PrometheusFileSink:
+    """
+    Sink that aggregates the records by stage and writes them to a file in the Prometheus text format, for the
+    textfile collector of the node exporter. The file is replaced atomically at most every ``interval`` seconds, and
+    on :meth:`flush`.
+    """
+
+    def __init__(self, path, interval=10.):
+        self.path = path
+        self.interval = interval
+        self.records = []
+        self.totals = {}
+        self.last_write = 0.
+
+    def emit(self, record):
+        self.records.append(record)
+        if time.monotonic() - self.last_write >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.totals = _aggregate(self.records, self.totals)
+        self.records = []
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            f.write(to_prometheus(self.totals))
+        os.replace(f.name, self.path)
+        self.last_write = time.monotonic()
+
+
+def _aggregate(records, totals=None):
+    totals = {} if totals is None else {stage: dict(values, counters=dict(values["counters"]))
+                                        for stage, values in totals.items()}
+    for record in records:
+        stage = record["stage"] or "unknown"
+        values = totals.setdefault(stage, {"calls": 0, "seconds": 0., "rows_in": 0, "rows_out": 0, "groups": 0,
+                                           "peak_memory": None, "counters": {}})
+        values["calls"] += 1
+        values["seconds"] += record["seconds"]
+        for field in ["rows_in", "rows_out", "groups"]:
+            values[field] += record[field] or 0
+        if record["peak_memory"] is not None:
+            values["peak_memory"] = max(values["peak_memory"] or 0, record["peak_memory"])
+        for branch, value in record["counters"].items():
+            values["counters"][branch] = values["counters"].get(branch, 0) + value
+    return totals
+
+
+def to_prometheus(totals):
+    """
+    Prometheus text format of the totals by stage.
+
+    :param totals: Totals by stage, as in :meth:`MemoryCollector.summary`
+    :type totals: dict
+
+    :rtype: string
+    """
+    metrics = [
+        ("calls", "counter", "Calls of each stage"),
+        ("seconds", "counter", "Wall time of each stage"),
+        ("rows_in", "counter", "Rows given to each stage"),
+        ("rows_out", "counter", "Rows returned by each stage"),
+        ("groups", "counter", "Groups processed by each stage"),
+    ]
+    lines = []
+    for field, kind, description in metrics:
+        name = "{}_stage_{}_total".format(PREFIX, field)
+        lines += ["# HELP {} {}".format(name, description), "# TYPE {} {}".format(name, kind)]
+        lines += ['{}{{stage="{}"}} {}'.format(name, stage, values[field]) for stage, values in totals.items()]
+    name = "{}_stage_peak_memory_bytes".format(PREFIX)
+    lines += ["# HELP {} Peak allocation of each stage".format(name), "# TYPE {} gauge".format(name)]
+    lines += ['{}{{stage="{}"}} {}'.format(name, stage, values["peak_memory"]) for stage, values in totals.items()
+              if values["peak_memory"] is not None]
+    name = "{}_branch_total".format(PREFIX)
+    lines += ["# HELP {} Rows that took each branch".format(name), "# TYPE {} counter".format(name)]
+    lines += ['{}{{stage="{}",branch="{}"}} {}'.format(name, stage, branch, value)
+              for stage, values in totals.items() for branch, value in sorted(values["counters"].items())]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,204 @@
+import logging
+import os
+from collections import OrderedDict
+
+import fastavro
+import pyarrow as pa
+
+from .helpers import COL_DATA_QUALITY, COL_PS1_ZTF, COL_SS_ZTF
+
+logger = logging.getLogger(__name__)
+
+COL_DETECTIONS = list(dict.fromkeys(
+    ['objectId', 'candid', 'mjd', 'fid', 'pid', 'diffmaglim', 'isdiffpos', 'nid', 'ra', 'dec', 'magpsf', 'sigmapsf',
+     'magap', 'sigmagap', 'distnr', 'magnr', 'sigmagnr', 'chinr', 'sharpnr', 'rb', 'magapbig', 'sigmagapbig', 'rfid',
+     'jdendref', 'ndethist', 'ncovhist', 'jdstarthist', 'jdendhist', 'parent_candid']
+    + COL_PS1_ZTF + COL_SS_ZTF + COL_DATA_QUALITY))  #: detection columns used by correction, statistics and helpers
+COL_NON_DETECTIONS = ['objectId', 'fid', 'mjd', 'diffmaglim']  #: non detection columns used by dm/dt
+
+_STRING = ['objectId', 'isdiffpos', 'ssnamenr']
+_INT32 = ['fid', 'nid', 'nneg', 'nbad', 'ndethist', 'ncovhist', 'nmtchps']
+_INT64 = ['candid', 'pid', 'rfid', 'objectidps1', 'objectidps2', 'objectidps3', 'parent_candid']
+_FLOAT64 = ['mjd', 'ra', 'dec', 'jdstarthist', 'jdendhist', 'jdendref', 'scorr']
+
+MAX_SEEN = 1000000  #: default number of detection ids and non detection keys kept to deduplicate alerts
+
+
+def _arrow_type(column):
+    """Arrow type of a column, the same type of the field in the ZTF avro schema (float fields are float32)."""
+    if column in _STRING:
+        return pa.string()
+    if column in _INT32:
+        return pa.int32()
+    if column in _INT64:
+        return pa.int64()
+    if column in _FLOAT64:
+        return pa.float64()
+    return pa.float32()
+
+
+def _avro_paths(source):
+    if isinstance(source, (str, os.PathLike)):
+        source = os.fspath(source)
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".avro"):
+                        yield os.path.join(root, name)
+        else:
+            yield source
+    else:
+        for path in source:
+            yield from _avro_paths(path)
+
+
+def read_alerts(source):
+    """
+    Read the alerts of a set of ZTF avro files. Files that can not be read are skipped with a warning.
+
+    :param source: An avro file, a directory with avro files (read recursively) or an iterable of them
+    :type source: str or iterable
+
+    :return: A generator of alerts
+    :rtype: generator of dict
+
+    Example::
+
+        for alert in read_alerts("data_examples/avros"):
+            candidate = alert["candidate"]
+    """
+    for path in _avro_paths(source):
+        try:
+            with open(path, "rb") as file:
+                for alert in fastavro.reader(file):
+                    yield alert
+        except Exception as e:
+            logger.warning('File {}: {}'.format(path, e))
+
+
+class _Buffer:
+    def __init__(self, columns):
+        self.columns = columns
+        self.schema = pa.schema([(column, _arrow_type(column)) for column in columns])
+        self.batch = -1
+        self.clear()
+
+    def clear(self):
+        self.data = {column: [] for column in self.columns}
+        self.size = 0
+        self.batch += 1  # number of flushed batches, identifies the rows of the buffer
+
+    def append(self, row):
+        for column in self.columns:
+            self.data[column].append(row.get(column))
+        self.size += 1
+        return self.size - 1
+
+    def replace(self, position, row):
+        for column in self.columns:
+            self.data[column][position] = row.get(column)
+
+    def flush(self):
+        batch = pa.RecordBatch.from_arrays([pa.array(self.data[column], type=field.type)
+                                            for column, field in zip(self.columns, self.schema)],
+                                           schema=self.schema)
+        self.clear()
+        return batch
+
+
+class _Seen:
+    """Keys seen recently, the least recently seen are forgotten over ``max_size``."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def read_avro_batches(source, batch_size=100000, columns=None, max_seen=MAX_SEEN):
+    """
+    Read ZTF alerts and flatten their candidates and previous candidates in columnar batches of detections and non
+    detections. Previous candidates are deduplicated across alerts, by candid for detections and by objectId, fid and
+    jd for non detections. ``mjd`` is derived from ``jd`` and only the given columns are kept, so memory is bounded
+    by the batch size and ``max_seen``: only the ``max_seen`` most recently seen detections and non detections are
+    remembered, and a duplicate of an older one is read again.
+
+    The candidate of an alert has ``parent_candid`` 0 (it has stamps), the previous candidates have the candid of the
+    alert. Fields missing in previous candidates (e.g. PS1 and reference fields) are null, so the candidate of an
+    alert is preferred to a previous candidate of the same detection: if the previous candidate came first (alerts
+    out of order), its row is replaced while it is in the current batch. If it was already yielded, the candidate is
+    also returned in a later batch, and the row with ``parent_candid`` 0 is the one to keep.
+
+    :param source: An avro file, a directory with avro files (read recursively) or an iterable of them
+    :type source: str or iterable
+
+    :param batch_size: Maximum number of rows of each batch
+    :type batch_size: int
+
+    :param columns: Detection columns to keep, by default :data:`COL_DETECTIONS`
+    :type columns: list
+
+    :param max_seen: Number of detection ids and of non detection keys remembered to deduplicate them
+    :type max_seen: int
+
+    :return: A generator of detections and non detections batches
+    :rtype: generator of tuple of :py:class:`pyarrow.RecordBatch`
+
+    Example::
+
+        for detections, non_detections in read_avro_batches("data_examples/avros"):
+            corrected = correct_detections(detections.to_pandas())
+    """
+    detections = _Buffer(COL_DETECTIONS if columns is None else list(columns))
+    non_detections = _Buffer(COL_NON_DETECTIONS)
+    seen_candids = _Seen(max_seen)  # candid: (batch, position, if it is the candidate of an alert)
+    seen_non_detections = _Seen(max_seen)
+
+    for alert in read_alerts(source):
+        oid = alert["objectId"]
+        candidates = [(alert["candidate"], 0)] + [(prv, alert["candid"]) for prv in alert["prv_candidates"] or []]
+        for candidate, parent_candid in candidates:
+            candid = candidate["candid"]
+            if candid is None:
+                key = (oid, candidate["fid"], candidate["jd"])
+                if seen_non_detections.get(key) is not None:
+                    continue
+                seen_non_detections.set(key, True)
+                non_detections.append({"objectId": oid, "fid": candidate["fid"], "mjd": candidate["jd"] - 2400000.5,
+                                       "diffmaglim": candidate["diffmaglim"]})
+            else:
+                seen = seen_candids.get(candid)
+                if seen is not None and (seen[2] or parent_candid != 0):
+                    continue
+                row = dict(candidate)
+                row["objectId"] = oid
+                row["mjd"] = candidate["jd"] - 2400000.5
+                row["parent_candid"] = parent_candid
+                if seen is not None and seen[0] == detections.batch:
+                    # the candidate of the alert replaces its previous candidate
+                    detections.replace(seen[1], row)
+                    position = seen[1]
+                else:
+                    position = detections.append(row)
+                seen_candids.set(candid, (detections.batch, position, parent_candid == 0))
+
+            if detections.size >= batch_size or non_detections.size >= batch_size:
+                yield detections.flush(), non_detections.flush()
+
+    if detections.size > 0 or non_detections.size > 0:
+        yield detections.flush(), non_detections.flush()
@@ -0,0 +1,567 @@
+"""
+Scalar and NumPy kernels of the correction: the correction formula, the near/stellar and dubious flags and their
+thresholds. This module only imports NumPy, so workers that only need this math do not pay the import of pandas and
+pyarrow. :mod:`lc_correction.compute` re-exports every name of this module.
+"""
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+from .instrumentation import count, enabled
+
+logger = logging.getLogger(__name__)
+
+DISTANCE_THRESHOLD = 1.4  #: max threshold for distnr
+SCORE_THRESHOLD = 0.4  #: max threshold for sgscore
+CHINR_THRESHOLD = 2  #: max threshold for chinr
+SHARPNR_MAX = 0.1  #: max value for sharpnr
+SHARPNR_MIN = -0.13  #: min value for sharpnr
+ZERO_MAG = 100.  #: default value for zero magnitude (a big value!)
+TRIPLE_NAN = (np.nan, np.nan, np.nan)
+MAGNITUDE_THRESHOLD = 13.2
+ISDIFFPOS_SIGN = {'t': 1, 'f': -1, '1': 1, '0': -1}  #: sign of the subtraction of each isdiffpos value
+FLUX_ZERO_POINT = 23.9  #: AB magnitude of a flux of 1 µJy
+MICROJANSKY = 10 ** (0.4 * FLUX_ZERO_POINT)  #: µJy of a flux 10**(-0.4 * magnitude)
+
+STATUS_OK = 0  #: the correction is valid
+STATUS_NEGATIVE_MAG = 1  #: magnr or magpsf is negative, the outputs are NaN
+STATUS_NONPOSITIVE_FLUX = 2  #: the corrected flux is not positive, the outputs are ZERO_MAG
+STATUS_NEGATIVE_VARIANCE = 3  #: the corrected variance is negative, sigmapsf_corr is ZERO_MAG
+STATUS_NONFINITE = 4  #: some input is NaN or infinite, the outputs are those of the formula
+STATUS_NAMES = {STATUS_OK: "ok", STATUS_NEGATIVE_MAG: "negative_magnitude", STATUS_NONPOSITIVE_FLUX: "nonpositive_flux",
+                STATUS_NEGATIVE_VARIANCE: "negative_variance", STATUS_NONFINITE: "nonfinite"}  #: name of each status
+
+
+@dataclass(frozen=True)
+class StellarThresholds:
+    """
+    Thresholds of the near and stellar flags. A profile is immutable, so it can be shared and used as a key, and
+    several profiles can be given to :func:`classify_stellar` at once.
+
+    Example::
+
+        strict = StellarThresholds(distance=1., score=0.5)
+    """
+    distance: float = DISTANCE_THRESHOLD  #: max distnr (ZTF) and distpsnr1 (PS1) of a near source
+    score: float = SCORE_THRESHOLD  #: min sgscore1 of a PS1 star
+    chinr: float = CHINR_THRESHOLD  #: max chinr of a ZTF star
+    sharpnr_min: float = SHARPNR_MIN  #: min sharpnr of a ZTF star
+    sharpnr_max: float = SHARPNR_MAX  #: max sharpnr of a ZTF star
+
+
+DEFAULT_THRESHOLDS = StellarThresholds()  #: thresholds of the module constants
+
+
+def _value(candidate, field):
+    """Field of a detection given as a dict, like the candidate of an alert, NaN if it is missing or null."""
+    value = candidate.get(field)
+    return np.nan if value is None else value
+
+
+def _mjd(candidate):
+    """mjd of a detection given as a dict, from its jd if it has no mjd."""
+    return candidate["mjd"] if "mjd" in candidate else candidate["jd"] - 2400000.5
+
+
+def _isdiffpos(value):
+    """
+    Sign of the isdiffpos of one detection, as :func:`lc_correction.schema.isdiffpos_sign` does for a column: strings
+    are mapped with :data:`ISDIFFPOS_SIGN` (NaN if unknown) and numbers are unchanged. The correction of an unknown
+    sign is ZERO_MAG, as in :func:`lc_correction.compute.correct_detections`.
+    """
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        return ISDIFFPOS_SIGN.get(value, np.nan)
+    return value
+
+
+def correction(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, oid=None):
+    """
+    Correction function. Implement of correction formula. :func:`correction_kernel` gives the same values for many
+    detections.
+
+    :param magnr: Magnitude of nearest source in reference image PSF-catalog within 30 arcsec [mag]
+    :type magnr: float
+
+    :param magpsf: Magnitude from PSF-fit photometry [mag]
+    :type magpsf: float
+
+    :param sigmagnr: 1-sigma uncertainty in magnr within 30 arcsec [mag]
+    :type sigmagnr: float
+
+    :param sigmapsf: 1-sigma uncertainty in magpsf [mag]
+    :type sigmapsf: float
+
+    :param isdiffpos: 1 => candidate is from positive (sci minus ref) subtraction; 0 => candidate is from negative (ref minus sci) subtraction
+    :type isdiffpos: int
+
+    :param oid: Object id, not used (kept for compatibility)
+    :type oid: string
+
+    :return: Correction for magnitude, sigma and sigma_ext
+    :rtype: tuple
+
+    Example::
+
+        (m_corr, s_corr, s_corr_ext) = correction(a, b, c, d, e)
+    """
+    if enabled():
+        # the branches of one detection, counted as the batch paths count them
+        count_status(_corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)[3])
+
+    if magnr < 0 or magpsf < 0:
+        return TRIPLE_NAN
+
+    try:
+        aux1 = 10**(-0.4 * magnr)
+        aux2 = 10**(-0.4 * magpsf)
+        aux3 = aux1 + isdiffpos * aux2
+        if aux3 > 0:
+            magpsf_corr = -2.5 * np.log10(aux3)
+            aux4 = aux2**2 * sigmapsf**2 - aux1**2 * sigmagnr**2
+
+            if aux4 >= 0:
+                sigmapsf_corr = np.sqrt(aux4) / aux3
+            else:
+                sigmapsf_corr = ZERO_MAG
+
+            sigmapsf_corr_ext = aux2 * sigmapsf / aux3
+        else:
+            magpsf_corr = ZERO_MAG
+            sigmapsf_corr = ZERO_MAG
+            sigmapsf_corr_ext = ZERO_MAG
+
+        return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+
+    except Exception as e:
+        logger.error('Object {}: {}'.format(oid, e))
+        return TRIPLE_NAN
+
+
+def magnitude_to_flux(magnitude):
+    """
+    Flux of a magnitude, ``10**(-0.4 * magnitude)``, as computed by the correction formula.
+
+    :param magnitude: Magnitudes [mag]
+    :type magnitude: :py:class:`numpy.ndarray`
+
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    with np.errstate(over="ignore", invalid="ignore"):
+        return 10**(-0.4 * np.asarray(magnitude, dtype=np.float64))
+
+
+def _status(negative, nonfinite, flux, variance):
+    status = np.full(flux.shape, STATUS_OK, dtype=np.int8)
+    with np.errstate(invalid="ignore"):
+        positive = flux > 0
+        status[positive & ~(variance >= 0)] = STATUS_NEGATIVE_VARIANCE
+    status[~positive] = STATUS_NONPOSITIVE_FLUX
+    status[nonfinite] = STATUS_NONFINITE
+    # checked first by the formula
+    status[negative] = STATUS_NEGATIVE_MAG
+    return status
+
+
+def _squared(values):
+    # pow(x, 2) as the formula computes it on Python floats, NumPy's x * x can differ in the last bit. The ufunc with
+    # a broadcast float64 exponent calls pow without the x * x fast path of ``values ** 2``, and without an array of
+    # exponents
+    return np.power(values, np.float64(2.))
+
+
+def _corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, reference_flux=None):
+    """
+    Corrected flux (aux3), its variance (aux4) and the error of the magpsf flux of the correction formula, in units
+    of ``10**(-0.4 * magnitude)``, and the status of each detection. The magnitude and flux outputs are both computed
+    from these, with the operations of :func:`correction` in the same order, so they are equal to its outputs.
+    """
+    magnr, magpsf, sigmagnr, sigmapsf, isdiffpos = np.broadcast_arrays(
+        *[np.asarray(value, dtype=np.float64) for value in (magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)])
+
+    with np.errstate(all="ignore"):
+        nonfinite = ~(np.isfinite(magnr) & np.isfinite(magpsf) & np.isfinite(sigmagnr) & np.isfinite(sigmapsf) &
+                      np.isfinite(isdiffpos))
+        negative = (magnr < 0) | (magpsf < 0)
+        aux1 = magnitude_to_flux(magnr) if reference_flux is None else np.asarray(reference_flux, dtype=np.float64)
+        aux2 = magnitude_to_flux(magpsf)
+        aux3 = aux1 + isdiffpos * aux2
+        aux4 = _squared(aux2) * _squared(sigmapsf) - _squared(aux1) * _squared(sigmagnr)
+        error_psf = aux2 * sigmapsf
+
+    return aux3, aux4, error_psf, _status(negative, nonfinite, aux3, aux4)
+
+
+def count_status(status, corrected=None):
+    """
+    Add the detections of each status but ``STATUS_OK`` to the branch counters of the running stage (see
+    :func:`lc_correction.instrumentation.count`), under the names of :data:`STATUS_NAMES`. It does nothing when
+    the instrumentation is disabled.
+
+    :param status: Status of each detection, from :func:`correction_kernel`
+    :type status: :py:class:`numpy.ndarray`
+
+    :param corrected: Only count the detections that are corrected, the outputs of the others are NaN
+    :type corrected: :py:class:`numpy.ndarray`
+    """
+    if not enabled():
+        return
+    status = np.asarray(status)
+    if corrected is not None:
+        status = status[np.asarray(corrected, dtype=bool)]
+    for code, name in STATUS_NAMES.items():
+        n = np.count_nonzero(status == code)
+        if code != STATUS_OK and n > 0:
+            count(name, n)
+
+
+def correction_status(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos):
+    """
+    Status of the correction of many detections, the last output of :func:`correction_kernel`, without the corrected
+    values. A status only describes a detection: the outputs of the correction are the same for every status.
+
+    :param magnr: Magnitude of nearest source in reference image PSF-catalog within 30 arcsec [mag]
+    :type magnr: :py:class:`numpy.ndarray`
+
+    :param magpsf: Magnitude from PSF-fit photometry [mag]
+    :type magpsf: :py:class:`numpy.ndarray`
+
+    :param sigmagnr: 1-sigma uncertainty in magnr within 30 arcsec [mag]
+    :type sigmagnr: :py:class:`numpy.ndarray`
+
+    :param sigmapsf: 1-sigma uncertainty in magpsf [mag]
+    :type sigmapsf: :py:class:`numpy.ndarray`
+
+    :param isdiffpos: 1 => candidate is from positive (sci minus ref) subtraction; -1 => candidate is from negative (ref minus sci) subtraction
+    :type isdiffpos: :py:class:`numpy.ndarray`
+
+    :return: One of the ``STATUS_*`` codes for each detection
+    :rtype: :py:class:`numpy.ndarray`
+
+    Example::
+
+        status = correction_status(df.magnr.values, df.magpsf.values, ...)
+        bad = df[status == STATUS_NONFINITE]
+    """
+    return _corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)[3]
+
+
+def _invalid(status):
+    return status == STATUS_NEGATIVE_MAG
+
+
+def _magnitudes(flux, variance, error_psf, status):
+    """Corrected magnitude, sigma and sigma_ext of :func:`_corrected_fluxes`."""
+    with np.errstate(all="ignore"):
+        positive = flux > 0
+        magpsf_corr = np.where(positive, -2.5 * np.log10(flux), ZERO_MAG)
+        sigmapsf_corr = np.where(positive & (variance >= 0), np.sqrt(variance) / flux, ZERO_MAG)
+        sigmapsf_corr_ext = np.where(positive, error_psf / flux, ZERO_MAG)
+    invalid = _invalid(status)
+    magpsf_corr[invalid] = np.nan
+    sigmapsf_corr[invalid] = np.nan
+    sigmapsf_corr_ext[invalid] = np.nan
+    return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+
+
+def _microjansky(flux, variance, error_psf, status):
+    """Corrected flux, error and error_ext of :func:`_corrected_fluxes` in µJy."""
+    with np.errstate(all="ignore"):
+        flux_corr = flux * MICROJANSKY
+        flux_corr_err = np.sqrt(variance) * MICROJANSKY
+        flux_corr_err_ext = error_psf * MICROJANSKY
+    invalid = _invalid(status)
+    flux_corr[invalid] = np.nan
+    flux_corr_err[invalid] = np.nan
+    flux_corr_err_ext[invalid] = np.nan
+    return flux_corr, flux_corr_err, flux_corr_err_ext
+
+
+def correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, reference_flux=None):
+    """
+    Correction of many detections, with a status code for each detection (see :func:`correction_status`) instead of
+    exceptions. The outputs are the outputs of :func:`correction` for each detection, bit for bit, and the status
+    does not change them.
+
+    ========================== =============================================
+    Status                     Outputs
+    ========================== =============================================
+    STATUS_OK                  corrected magnitude, sigma and sigma_ext
+    STATUS_NEGATIVE_MAG        NaN
+    STATUS_NONPOSITIVE_FLUX    ZERO_MAG
+    STATUS_NEGATIVE_VARIANCE   sigma is ZERO_MAG
+    STATUS_NONFINITE           as the formula: ZERO_MAG for a NaN corrected
+                               flux, sigma is ZERO_MAG for a NaN variance
+    ========================== =============================================
+
+    :param magnr: Magnitude of nearest source in reference image PSF-catalog within 30 arcsec [mag]
+    :type magnr: :py:class:`numpy.ndarray`
+
+    :param magpsf: Magnitude from PSF-fit photometry [mag]
+    :type magpsf: :py:class:`numpy.ndarray`
+
+    :param sigmagnr: 1-sigma uncertainty in magnr within 30 arcsec [mag]
+    :type sigmagnr: :py:class:`numpy.ndarray`
+
+    :param sigmapsf: 1-sigma uncertainty in magpsf [mag]
+    :type sigmapsf: :py:class:`numpy.ndarray`
+
+    :param isdiffpos: 1 => candidate is from positive (sci minus ref) subtraction; -1 => candidate is from negative (ref minus sci) subtraction
+    :type isdiffpos: :py:class:`numpy.ndarray`
+
+    :param reference_flux: Flux of magnr if it is already computed
+    :type reference_flux: :py:class:`numpy.ndarray`
+
+    :return: Arrays with correction for magnitude, sigma and sigma_ext, and the status of each detection
+    :rtype: tuple
+
+    Example::
+
+        m_corr, s_corr, s_corr_ext, status = correction_kernel(df.magnr.values, df.magpsf.values, ...)
+    """
+    flux, variance, error_psf, status = _corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos,
+                                                          reference_flux=reference_flux)
+    return _magnitudes(flux, variance, error_psf, status) + (status,)
+
+
+def flux_correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos, reference_flux=None):
+    """
+    :func:`correction_kernel` with the corrected flux in µJy (zero point :data:`FLUX_ZERO_POINT`) instead of the
+    corrected magnitude. The flux is the sum computed by the correction, so it is not converted to a magnitude and
+    back. A flux is defined where a magnitude is not: a non positive corrected flux is returned as it is.
+
+    ========================== =============================================
+    Status                     Outputs
+    ========================== =============================================
+    STATUS_OK                  corrected flux, error and error_ext
+    STATUS_NEGATIVE_MAG        NaN
+    STATUS_NONPOSITIVE_FLUX    corrected flux, error and error_ext
+    STATUS_NEGATIVE_VARIANCE   error is NaN
+    STATUS_NONFINITE           NaN where they depend on a NaN input
+    ========================== =============================================
+
+    :return: Arrays with the corrected flux, error and error_ext [µJy], and the status of each detection
+    :rtype: tuple
+
+    Example::
+
+        flux, error, error_ext, status = flux_correction_kernel(df.magnr.values, df.magpsf.values, ...)
+    """
+    flux, variance, error_psf, status = _corrected_fluxes(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos,
+                                                          reference_flux=reference_flux)
+    return _microjansky(flux, variance, error_psf, status) + (status,)
+
+
+def flux_to_magnitude(flux_corr, flux_corr_err, flux_corr_err_ext):
+    """
+    Corrected magnitude, sigma and sigma_ext of the outputs of :func:`flux_correction_kernel`. They are the outputs of
+    :func:`correction_kernel`, up to rounding.
+
+    :param flux_corr: Corrected flux [µJy]
+    :type flux_corr: :py:class:`numpy.ndarray`
+
+    :param flux_corr_err: Error of the corrected flux [µJy]
+    :type flux_corr_err: :py:class:`numpy.ndarray`
+
+    :param flux_corr_err_ext: Error of the magpsf flux [µJy]
+    :type flux_corr_err_ext: :py:class:`numpy.ndarray`
+
+    :return: Arrays with correction for magnitude, sigma and sigma_ext
+    :rtype: tuple
+    """
+    flux, error, error_ext = [np.asarray(values, dtype=np.float64) for values in
+                              (flux_corr, flux_corr_err, flux_corr_err_ext)]
+    with np.errstate(all="ignore"):
+        positive = flux > 0
+        magpsf_corr = np.where(positive, FLUX_ZERO_POINT - 2.5 * np.log10(flux), ZERO_MAG)
+        sigmapsf_corr = np.where(positive & ~np.isnan(error), error / flux, ZERO_MAG)
+        sigmapsf_corr_ext = np.where(positive, error_ext / flux, ZERO_MAG)
+    missing = np.isnan(flux)
+    magpsf_corr[missing] = np.nan
+    sigmapsf_corr[missing] = np.nan
+    sigmapsf_corr_ext[missing] = np.nan
+    return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+
+
+def correction_vectorized(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos):
+    """
+    Vectorized version of :func:`correction`, :func:`correction_kernel` without the status.
+
+    :param magnr: Magnitude of nearest source in reference image PSF-catalog within 30 arcsec [mag]
+    :type magnr: :py:class:`numpy.ndarray`
+
+    :param magpsf: Magnitude from PSF-fit photometry [mag]
+    :type magpsf: :py:class:`numpy.ndarray`
+
+    :param sigmagnr: 1-sigma uncertainty in magnr within 30 arcsec [mag]
+    :type sigmagnr: :py:class:`numpy.ndarray`
+
+    :param sigmapsf: 1-sigma uncertainty in magpsf [mag]
+    :type sigmapsf: :py:class:`numpy.ndarray`
+
+    :param isdiffpos: 1 => candidate is from positive (sci minus ref) subtraction; -1 => candidate is from negative (ref minus sci) subtraction
+    :type isdiffpos: :py:class:`numpy.ndarray`
+
+    :return: Arrays with correction for magnitude, sigma and sigma_ext
+    :rtype: tuple
+
+    Example::
+
+        (m_corr, s_corr, s_corr_ext) = correction_vectorized(df.magnr.values, df.magpsf.values, ...)
+    """
+    return correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)[:3]
+
+
+def apply_correction(candidate):
+    """
+    Correction function for a set of detections
+
+    :param candidate: A dataframe with detections of a candidate.
+    :type candidate: :py:class:`pd.DataFrame`
+
+    :return: Wrapper for correction for magnitude, sigma and sigma_ext
+    :rtype: tuple
+
+    Example::
+
+        (m_corr, s_corr, s_corr_ext) = correction(a, b, c, d, e)
+    """
+    isdiffpos = 1 if (candidate["isdiffpos"] in ["t", "1"]) else -1
+    magnr = candidate["magnr"]
+    magpsf = candidate['magpsf']
+    sigmagnr = candidate['sigmagnr']
+    sigmapsf = candidate['sigmapsf']
+
+    magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext = correction(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+
+    return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+
+
+def near_stellar(first_distnr, first_distpsnr1, first_sgscore1, first_chinr, first_sharpnr, thresholds=None):
+    """
+    Get if object is near stellar
+
+    :param first_distnr: Distance to nearest source in reference image PSF-catalog within 30 arcsec [pixels]
+    :type first_distnr: :py:class:`float`
+
+    :param first_distpsnr1: Distance of closest source from PS1 catalog; if exists within 30 arcsec [arcsec]
+    :type first_distpsnr1: :py:class:`float`
+
+    :param first_sgscore1: Star/Galaxy score of closest source from PS1 catalog 0 <= sgscore <= 1 where closer to 1 implies higher likelihood of being a star
+    :type first_sgscore1: :py:class:`float`
+
+    :param first_chinr: DAOPhot chi parameter of nearest source in reference image PSF-catalog within 30 arcsec
+    :type first_chinr: :py:class:`float`
+
+    :param first_sharpnr: DAOPhot sharp parameter of nearest source in reference image PSF-catalog within 30 arcsec
+    :type first_sharpnr: :py:class:`float`
+
+    :param thresholds: Thresholds, by default :data:`DEFAULT_THRESHOLDS`
+    :type thresholds: :py:class:`StellarThresholds`
+
+    :return: nearZTF, nearPS1, stellarPS1 and stellarZTF, in this order
+    :rtype: tuple
+    """
+    t = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+    nearZTF = 0 <= first_distnr < t.distance
+    nearPS1 = 0 <= first_distpsnr1 < t.distance
+    stellarPS1 = first_sgscore1 > t.score
+    stellarZTF = first_chinr < t.chinr and t.sharpnr_min < first_sharpnr < t.sharpnr_max
+    return nearZTF, nearPS1, stellarPS1, stellarZTF
+
+
+def classify_stellar(distnr, distpsnr1, sgscore1, chinr, sharpnr, thresholds=None):
+    """
+    Vectorized :func:`near_stellar` and :func:`is_stellar` over the first detections of many ``[objectId, fid]``
+    pairs. With a sequence of profiles, every profile is evaluated in the same call: the inputs are read once and
+    compared against a column of thresholds, and each flag has one row per profile.
+
+    :param distnr: distnr of each first detection
+    :type distnr: :py:class:`numpy.ndarray`
+
+    :param distpsnr1: distpsnr1 of each first detection
+    :type distpsnr1: :py:class:`numpy.ndarray`
+
+    :param sgscore1: sgscore1 of each first detection
+    :type sgscore1: :py:class:`numpy.ndarray`
+
+    :param chinr: chinr of each first detection
+    :type chinr: :py:class:`numpy.ndarray`
+
+    :param sharpnr: sharpnr of each first detection
+    :type sharpnr: :py:class:`numpy.ndarray`
+
+    :param thresholds: A profile or a sequence of profiles, by default :data:`DEFAULT_THRESHOLDS`
+    :type thresholds: :py:class:`StellarThresholds` or list
+
+    :return: nearZTF, nearPS1, stellarPS1, stellarZTF and stellar boolean arrays, of shape (n,) for a profile and
+        (profiles, n) for a sequence of profiles
+    :rtype: dict
+
+    Example::
+
+        flags = classify_stellar(first.distnr, first.distpsnr1, first.sgscore1, first.chinr, first.sharpnr,
+                                 thresholds=[DEFAULT_THRESHOLDS, StellarThresholds(score=0.5)])
+        stellar_strict = flags["stellar"][1]
+    """
+    thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+    single = isinstance(thresholds, StellarThresholds)
+    profiles = [thresholds] if single else list(thresholds)
+    distnr, distpsnr1, sgscore1, chinr, sharpnr = [np.asarray(values, dtype=np.float64)[np.newaxis]
+                                                   for values in (distnr, distpsnr1, sgscore1, chinr, sharpnr)]
+
+    def column(field):
+        return np.array([getattr(profile, field) for profile in profiles], dtype=np.float64)[:, np.newaxis]
+
+    with np.errstate(invalid="ignore"):
+        distance = column("distance")
+        nearZTF = (0 <= distnr) & (distnr < distance)
+        nearPS1 = (0 <= distpsnr1) & (distpsnr1 < distance)
+        stellarPS1 = sgscore1 > column("score")
+        stellarZTF = (chinr < column("chinr")) & (column("sharpnr_min") < sharpnr) & (sharpnr < column("sharpnr_max"))
+    flags = {"nearZTF": nearZTF, "nearPS1": nearPS1, "stellarPS1": stellarPS1, "stellarZTF": stellarZTF,
+             "stellar": is_stellar(nearZTF, nearPS1, stellarPS1, stellarZTF)}
+    return {name: values[0] if single else values for name, values in flags.items()}
+
+
+def is_stellar(nearZTF, nearPS1, stellarPS1, stellarZTF):
+    """
+    Get if object is stellar
+
+    :param nearZTF:
+    :type nearZTF: bool
+
+    :param nearPS1:
+    :type nearPS1: bool
+
+    :param stellarPS1:
+    :type stellarPS1: bool
+
+    :param stellarZTF:
+    :type stellarZTF: bool
+
+    :return: if the object is stellar
+    :rtype: bool
+
+    """
+    return (nearZTF & nearPS1 & stellarPS1) | (nearZTF & ~nearPS1 & stellarZTF)
+
+
+def is_dubious(corrected, isdiffpos, corr_magstats):
+    """Get if object is dubious
+
+    :param corrected:
+    :type corrected: bool
+
+    :param isdiffpos:
+    :type isdiffpos: bool
+
+    :param corr_magstats:
+    :type corr_magstats: bool
+
+    :return: if the object is dubious
+    :rtype: bool
+    """
+    return (~corrected & (isdiffpos == -1)) | (corr_magstats & ~corrected) | (~corr_magstats & corrected)
@@ -0,0 +1,126 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def _encode_arrow(oid, categories=None):
+    """
+    :func:`encode_objects` of an Arrow array. The ids are dictionary encoded by Arrow, so no Python strings are made.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if isinstance(oid, pa.ChunkedArray):
+        oid = oid.combine_chunks() if oid.num_chunks > 0 else pa.array([], type=oid.type)
+    if categories is not None:
+        value_set = categories if isinstance(categories, pa.Array) else pa.array(categories)
+        codes = pc.fill_null(pc.index_in(oid, value_set=value_set), -1)
+        return codes.to_numpy(zero_copy_only=False).astype(np.int64), categories
+    if not pa.types.is_dictionary(oid.type):
+        oid = pc.dictionary_encode(oid)
+    # rank of each dictionary value in lexicographic order, missing values keep -1
+    order = pc.sort_indices(oid.dictionary).to_numpy()
+    rank = np.empty(len(order) + 1, dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    rank[-1] = -1
+    codes = pc.fill_null(oid.indices, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+    return rank[codes], oid.dictionary.take(pa.array(order))
+
+
+def encode_objects(oid, categories=None):
+    """
+    Encode object ids as dense integer codes, in the lexicographic order of the ids. The strings are hashed once;
+    a categorical with sorted categories is not hashed at all.
+
+    :param oid: Object id of each row
+    :type oid: :py:class:`pd.Series`, :py:class:`numpy.ndarray` or :py:class:`pa.Array`
+
+    :param categories: Sorted object ids to encode against (e.g. the objects of another table). Ids not in it get -1.
+    :type categories: :py:class:`pd.Index` or :py:class:`pa.Array`
+
+    :return: Code of each row and the sorted object ids (an Arrow array for Arrow ids)
+    :rtype: tuple(:py:class:`numpy.ndarray`, :py:class:`pd.Index`)
+
+    Example::
+
+        codes, objects = encode_objects(detections.objectId)
+    """
+    # pyarrow is not imported here, an Arrow array can only exist if some other module imported it
+    pa = sys.modules.get("pyarrow")
+    if pa is not None and isinstance(oid, (pa.Array, pa.ChunkedArray)):
+        return _encode_arrow(oid, categories)
+    values = oid.values if isinstance(oid, (pd.Series, pd.Index)) else oid
+    if isinstance(values, pd.Categorical) and categories is None:
+        if values.categories.is_monotonic_increasing:
+            return values.codes.astype(np.int64), values.categories
+        # rank of each category in lexicographic order, missing values keep -1
+        order = values.categories.argsort()
+        rank = np.empty(len(order) + 1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        rank[-1] = -1
+        return rank[values.codes], values.categories[order]
+    if categories is not None:
+        return categories.get_indexer(values).astype(np.int64), categories
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), pd.Index(uniques)
+
+
+def group_keys(codes, fid, stride=None):
+    """
+    Combine object codes and filter ids in a single integer key, ``code * stride + fid``. Sorting by the key is
+    sorting by objectId and fid.
+
+    :param codes: Object code of each row, from :func:`encode_objects`
+    :type codes: :py:class:`numpy.ndarray`
+
+    :param fid: Filter id of each row
+    :type fid: :py:class:`numpy.ndarray`
+
+    :param stride: Greater than every filter id, by default the maximum filter id plus one. Keys of two tables can
+        only be compared if they share the stride.
+    :type stride: int
+
+    :return: Key of each row and the stride
+    :rtype: tuple(:py:class:`numpy.ndarray`, int)
+    """
+    fid = np.asarray(fid).astype(np.int64)
+    if stride is None:
+        stride = int(fid.max()) + 1 if len(fid) > 0 else 1
+    return codes * stride + fid, stride
+
+
+def encode_groups(oid, fid):
+    """
+    Encode ``[objectId, fid]`` pairs as a single integer key. ZTF filter ids go from 1 to 3, so the stride is usually 4.
+
+    :param oid: Object id of each row
+    :type oid: :py:class:`pd.Series` or :py:class:`numpy.ndarray`
+
+    :param fid: Filter id of each row
+    :type fid: :py:class:`numpy.ndarray`
+
+    :return: Key of each row
+    :rtype: :py:class:`numpy.ndarray`
+
+    Example::
+
+        order = np.argsort(encode_groups(df.objectId, df.fid.values), kind="stable")
+    """
+    codes, _ = encode_objects(oid)
+    return group_keys(codes, fid)[0]
+
+
+def sort_groups(oid, fid, *by):
+    """
+    Stable order of the rows by objectId, fid and then the ``by`` arrays, using the integer key.
+
+    :return: Positions of the rows in sorted order and the key of each row (in input order)
+    :rtype: tuple(:py:class:`numpy.ndarray`, :py:class:`numpy.ndarray`)
+    """
+    key = encode_groups(oid, fid)
+    if by:
+        order = np.lexsort(tuple(np.asarray(values) for values in reversed(by)) + (key,))
+    else:
+        order = np.argsort(key, kind="stable")
+    return order, key
@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from joblib import Parallel, delayed, effective_n_jobs
+
+from .compute import compute_dmdt, compute_magstats, compute_object_stats, correct_detections
+
+STAGES = ["corrected", "magstats", "objstats", "dmdt"]  #: outputs of the bulk pipeline
+
+
+def run_stages(detections, non_detections, step_name=None, flags=False, dt_min=0.5):
+    """
+    Run the whole correction chain over a set of objects: correction, magnitude statistics, object statistics and
+    dm/dt.
+
+    :param detections: A dataframe with detections.
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param non_detections: A dataframe with non detections.
+    :type non_detections: :py:class:`pd.DataFrame`
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param dt_min:
+    :type dt_min: float
+
+    :return: corrected, magstats, objstats and dmdt dataframes
+    :rtype: dict
+    """
+    corrected = correct_detections(detections)
+    magstats = compute_magstats(corrected, flags=flags)
+    objstats = compute_object_stats(corrected, magstats, step_name=step_name, flags=flags)
+    dmdt = compute_dmdt(magstats, non_detections, dt_min=dt_min)
+    return {"corrected": corrected, "magstats": magstats, "objstats": objstats, "dmdt": dmdt}
+
+
+def hash_partition(values, n_shards):
+    """
+    Shard of each value. The hash does not depend on the process, so detections and non detections of the same
+    object always land in the same shard.
+
+    :param values: Values to partition by (e.g. objectId)
+    :type values: :py:class:`pd.Series`
+
+    :param n_shards: Number of shards
+    :type n_shards: int
+
+    :return: Shard of each value
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return (pd.util.hash_array(np.asarray(values, dtype=object)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def write_ipc(df, path):
+    """
+    Write a dataframe (with its index) as an Arrow IPC file.
+    """
+    table = pa.Table.from_pandas(df)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_ipc(path):
+    """
+    Read a dataframe from an Arrow IPC file. The file is memory mapped, so it is not copied through a pipe.
+    """
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def _sort_by_shard(df, shard_by, n_shards):
+    """
+    Rows of a dataframe grouped by shard, so each shard is a contiguous slice. The sort is stable, so a shard keeps
+    the input order of its rows.
+
+    :return: The sorted dataframe and the bounds of the shards, shard ``i`` is ``df.iloc[bounds[i]:bounds[i + 1]]``
+    :rtype: tuple
+    """
+    shards = hash_partition(df[shard_by], n_shards)
+    order = np.argsort(shards, kind="stable")
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+    return df.iloc[order], bounds
+
+
+def _run_shard(detections_path, non_detections_path, out_dir, step_name, flags, dt_min):
+    results = run_stages(read_ipc(detections_path), read_ipc(non_detections_path), step_name=step_name,
+                         flags=flags, dt_min=dt_min)
+    paths = {}
+    for stage, result in results.items():
+        paths[stage] = os.path.join(out_dir, stage + ".arrow")
+        write_ipc(result, paths[stage])
+    return paths
+
+
+def _concat(results, levels):
+    result = pd.concat(results)
+    # shards keep the input order of their rows, so a stable sort by the group keys gives the serial order
+    return result.sort_index(level=levels, sort_remaining=False, kind="mergesort")
+
+
+def run_bulk(detections, non_detections, n_jobs=1, shard_by="objectId", n_shards=None, step_name=None,
+             flags=False, dt_min=0.5, tmp_dir=None):
+    """
+    Run the whole correction chain in parallel. Detections and non detections are hash partitioned by ``shard_by``
+    so an object lands in a single shard, each shard is written as a memory mapped Arrow file, and the shards are
+    processed in a process pool. The result is the same as :func:`run_stages`.
+
+    :param detections: A dataframe with detections.
+    :type detections: :py:class:`pd.DataFrame`
+
+    :param non_detections: A dataframe with non detections.
+    :type non_detections: :py:class:`pd.DataFrame`
+
+    :param n_jobs: Number of processes, as in joblib
+    :type n_jobs: int
+
+    :param shard_by: Column to partition by, it must keep all the rows of an object together
+    :type shard_by: string
+
+    :param n_shards: Number of shards, by default four per process
+    :type n_shards: int
+
+    :param step_name:
+    :type step_name: string
+
+    :param flags: If you want compute flags, set it like True
+    :type flags: boolean
+
+    :param dt_min:
+    :type dt_min: float
+
+    :param tmp_dir: Directory for the shards, by default a temporary directory
+    :type tmp_dir: string
+
+    :return: corrected, magstats, objstats and dmdt dataframes
+    :rtype: dict
+
+    Example::
+
+        results = run_bulk(detections, non_detections, n_jobs=8)
+        magstats = results["magstats"]
+    """
+    n_jobs = effective_n_jobs(n_jobs)
+    # without detections there are no shards to concatenate, the serial run gives the empty frames
+    if (n_jobs == 1 and n_shards is None) or len(detections) == 0:
+        return run_stages(detections, non_detections, step_name=step_name, flags=flags, dt_min=dt_min)
+    n_shards = 4 * n_jobs if n_shards is None else n_shards
+
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        detections, detections_bounds = _sort_by_shard(detections, shard_by, n_shards)
+        non_detections, non_detections_bounds = _sort_by_shard(non_detections, shard_by, n_shards)
+        tasks = []
+        for shard in range(n_shards):
+            start, end = detections_bounds[shard], detections_bounds[shard + 1]
+            if start == end:
+                continue
+            shard_dir = os.path.join(work_dir, str(shard))
+            os.mkdir(shard_dir)
+            detections_path = os.path.join(shard_dir, "detections.arrow")
+            non_detections_path = os.path.join(shard_dir, "non_detections.arrow")
+            write_ipc(detections.iloc[start:end], detections_path)
+            write_ipc(non_detections.iloc[non_detections_bounds[shard]:non_detections_bounds[shard + 1]],
+                      non_detections_path)
+            tasks.append(delayed(_run_shard)(detections_path, non_detections_path, shard_dir, step_name, flags,
+                                             dt_min))
+        paths = Parallel(n_jobs=n_jobs)(tasks)
+
+        results = {stage: [read_ipc(shard_paths[stage]) for shard_paths in paths] for stage in STAGES}
+        return {
+            "corrected": _concat(results["corrected"], ["objectId", "fid"]),
+            "magstats": _concat(results["magstats"], ["objectId", "fid"]),
+            "objstats": _concat(results["objstats"], ["objectId"]),
+            "dmdt": _concat(results["dmdt"], ["objectId", "fid"]),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,264 @@
+import math
+import shelve
+from collections import OrderedDict
+
+import numpy as np
+
+from .instrumentation import enabled
+from .kernels import (DISTANCE_THRESHOLD, TRIPLE_NAN, ZERO_MAG, _corrected_fluxes, _isdiffpos, _mjd, _value,
+                      count_status, near_stellar)
+
+FIRST_FIELDS = ['mjd', 'distnr', 'distpsnr1', 'sgscore1', 'chinr', 'sharpnr']  #: first detection near/stellar inputs
+
+
+class Reference:
+    """
+    Photometry of the source of a reference image, shared by every detection of an ``[objectId, fid]`` pair with the
+    same rfid, with the reference flux term ``10**(-0.4 * magnr)`` and its variance computed once. It also keeps the
+    near/stellar inputs of the first detection seen with this reference.
+    """
+
+    def __init__(self, magnr, sigmagnr, distnr, first=None):
+        self.magnr = magnr
+        self.sigmagnr = sigmagnr
+        self.distnr = distnr
+        # a negative magnr is not corrected, and its Python power could overflow
+        self.flux = np.nan if magnr < 0 else 10**(-0.4 * magnr)
+        self.flux_variance = self.flux**2 * sigmagnr**2
+        self.first = {field: np.nan for field in FIRST_FIELDS} if first is None else dict(first)
+
+    @classmethod
+    def from_candidate(cls, candidate):
+        """
+        :param candidate: A detection, like the candidate of an alert. It must have mjd or jd.
+        :type candidate: dict
+        """
+        reference = cls(_value(candidate, "magnr"), _value(candidate, "sigmagnr"), _value(candidate, "distnr"))
+        reference.update_first(candidate)
+        return reference
+
+    def update_first(self, candidate):
+        """
+        Keep the near/stellar inputs of the candidate if it is the first detection seen with this reference.
+        """
+        mjd = _mjd(candidate)
+        if math.isnan(self.first["mjd"]) or mjd < self.first["mjd"]:
+            self.first = {field: mjd if field == "mjd" else _value(candidate, field) for field in FIRST_FIELDS}
+
+    def near_stellar(self):
+        """
+        :return: nearZTF, nearPS1, stellarPS1 and stellarZTF of the first detection, as :func:`near_stellar`
+        :rtype: tuple
+        """
+        return near_stellar(self.first["distnr"], self.first["distpsnr1"], self.first["sgscore1"],
+                            self.first["chinr"], self.first["sharpnr"])
+
+    def correction(self, magpsf, sigmapsf, isdiffpos):
+        """
+        Correction of a detection with this reference. It returns the same values as :func:`correction`, reusing the
+        reference flux and variance. It is scalar Python, as :func:`correction`, so a single alert does not pay the
+        overhead of the array kernels.
+
+        :return: Correction for magnitude, sigma and sigma_ext
+        :rtype: tuple
+        """
+        if enabled():
+            count_status(_corrected_fluxes(self.magnr, magpsf, self.sigmagnr, sigmapsf, isdiffpos,
+                                           reference_flux=self.flux)[3])
+        if self.magnr < 0 or magpsf < 0:
+            return TRIPLE_NAN
+        aux2 = 10**(-0.4 * magpsf)
+        aux3 = self.flux + isdiffpos * aux2
+        if not aux3 > 0:
+            return ZERO_MAG, ZERO_MAG, ZERO_MAG
+        magpsf_corr = -2.5 * np.log10(aux3)
+        # the terms of aux4 in the order of the formula, so the values are the same bit for bit
+        aux4 = aux2**2 * sigmapsf**2 - self.flux_variance
+        sigmapsf_corr = math.sqrt(aux4) / aux3 if aux4 >= 0 else ZERO_MAG
+        sigmapsf_corr_ext = aux2 * sigmapsf / aux3
+        return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+
+    def matches(self, candidate):
+        """
+        True if the reference photometry of the candidate is the cached one.
+        """
+        magnr, sigmagnr = _value(candidate, "magnr"), _value(candidate, "sigmagnr")
+        return ((magnr == self.magnr or (magnr != magnr and self.magnr != self.magnr)) and
+                (sigmagnr == self.sigmagnr or (sigmagnr != sigmagnr and self.sigmagnr != self.sigmagnr)))
+
+    def to_dict(self):
+        return {"magnr": self.magnr, "sigmagnr": self.sigmagnr, "distnr": self.distnr, "first": dict(self.first)}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["magnr"], state["sigmagnr"], state["distnr"], first=state["first"])
+
+
+class ReferenceCache:
+    """
+    Least recently used cache of :class:`Reference` keyed by ``(objectId, fid, rfid)``. A miss means that the
+    reference of the pair is new, either a new object or a reference change. A cached reference whose magnr or
+    sigmagnr differ from the ones of a detection is replaced, and counted as a miss.
+
+    With ``path``, the references evicted from memory (and all of them on :meth:`close`) are written to a
+    :mod:`shelve` store, and memory misses are looked up there, so the cache persists across nights.
+
+    Example::
+
+        with ReferenceCache(max_size=100000, path="references") as cache:
+            for candidate in candidates:
+                magnitudes, reference = correct_candidate(candidate, cache)
+            print(cache.stats())
+    """
+
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.store = shelve.open(path) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self.mismatches = 0
+
+    @staticmethod
+    def _store_key(key):
+        return "{}/{}/{}".format(*key)
+
+    def get(self, key):
+        """
+        :param key: objectId, fid and rfid
+        :type key: tuple
+
+        :return: The reference, or None on a miss
+        :rtype: :class:`Reference`
+        """
+        reference = self.entries.get(key)
+        if reference is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return reference
+        if self.store is not None:
+            state = self.store.get(self._store_key(key))
+            if state is not None:
+                reference = Reference.from_dict(state)
+                self._insert(key, reference)
+                self.hits += 1
+                self.store_hits += 1
+                return reference
+        self.misses += 1
+        return None
+
+    def put(self, key, reference):
+        """
+        :param key: objectId, fid and rfid
+        :type key: tuple
+
+        :param reference: The reference
+        :type reference: :class:`Reference`
+        """
+        self._insert(key, reference)
+
+    def _insert(self, key, reference):
+        self.entries[key] = reference
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.evictions += 1
+            if self.store is not None:
+                self.store[self._store_key(evicted_key)] = evicted.to_dict()
+
+    def lookup(self, candidate):
+        """
+        Get the reference of a detection, creating it on a miss.
+
+        :param candidate: A detection, like the candidate of an alert. It must have objectId, fid and rfid.
+        :type candidate: dict
+
+        :return: The reference, and True if it was a hit
+        :rtype: tuple
+        """
+        key = (candidate["objectId"], candidate["fid"], candidate.get("rfid"))
+        # hit in memory with the same photometry, the path of almost every alert, with the checks of matches and
+        # update_first inlined
+        reference = self.entries.get(key)
+        if (reference is not None and candidate.get("magnr") == reference.magnr and
+                candidate.get("sigmagnr") == reference.sigmagnr):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if not reference.first["mjd"] <= _mjd(candidate):
+                reference.update_first(candidate)
+            return reference, True
+        reference = self.get(key)
+        if reference is not None and not reference.matches(candidate):
+            self.hits -= 1
+            self.misses += 1
+            self.mismatches += 1
+            reference = None
+        if reference is None:
+            reference = Reference.from_candidate(candidate)
+            self.put(key, reference)
+            return reference, False
+        reference.update_first(candidate)
+        return reference, True
+
+    def stats(self):
+        """
+        :return: Size, hits, misses, hits from the store, evictions, mismatches and hit rate
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "store_hits": self.store_hits,
+                "evictions": self.evictions, "mismatches": self.mismatches,
+                "hit_rate": self.hits / total if total > 0 else np.nan}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def flush(self):
+        """
+        Write the references in memory to the store.
+        """
+        if self.store is None:
+            return
+        for key, reference in self.entries.items():
+            self.store[self._store_key(key)] = reference.to_dict()
+        self.store.sync()
+
+    def close(self):
+        if self.store is not None:
+            self.flush()
+            self.store.close()
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def correct_candidate(candidate, cache):
+    """
+    Correction of a detection using the cached reference of its ``(objectId, fid, rfid)``. The magnitudes are the same
+    as :func:`lc_correction.compute.apply_correction`, NaN if the detection is not corrected (distnr over the
+    threshold), so they can be given to :meth:`lc_correction.incremental.IncrementalMagStats.update`.
+
+    :param candidate: A detection, like the candidate of an alert.
+    :type candidate: dict
+
+    :param cache: The reference cache
+    :type cache: :class:`ReferenceCache`
+
+    :return: magpsf_corr, sigmapsf_corr and sigmapsf_corr_ext, and the reference
+    :rtype: tuple
+    """
+    reference, _ = cache.lookup(candidate)
+    if not _value(candidate, "distnr") < DISTANCE_THRESHOLD:
+        return TRIPLE_NAN, reference
+    isdiffpos = _isdiffpos(candidate["isdiffpos"])
+    return reference.correction(candidate["magpsf"], candidate["sigmapsf"], isdiffpos), reference
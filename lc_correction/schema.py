@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from .helpers import COL_PS1_ZTF
+from .kernels import ISDIFFPOS_SIGN
+
+DETECTIONS_SCHEMA = {
+    'objectId': 'category',
+    'candid': np.int64,
+    'mjd': np.float64,
+    'fid': np.int8,
+    'pid': np.int64,
+    'diffmaglim': np.float32,
+    'isdiffpos': np.int8,
+    'nid': np.int32,
+    'ra': np.float64,
+    'dec': np.float64,
+    'magpsf': np.float32,
+    'sigmapsf': np.float32,
+    'magap': np.float32,
+    'sigmagap': np.float32,
+    'distnr': np.float32,
+    'magnr': np.float32,
+    'sigmagnr': np.float32,
+    'chinr': np.float32,
+    'sharpnr': np.float32,
+    'rb': np.float32,
+    'magapbig': np.float32,
+    'sigmagapbig': np.float32,
+    'rfid': np.int64,
+    'jdendref': np.float64,
+    'ndethist': np.int32,
+    'ncovhist': np.int32,
+    'jdstarthist': np.float64,
+    'jdendhist': np.float64,
+    'parent_candid': np.int64,
+}  #: compact dtypes of detections, mjd and coordinates keep float64
+DETECTIONS_SCHEMA.update({column: np.int64 if column.startswith('objectidps') or column == 'candid'
+                          else np.int16 if column == 'nmtchps' else np.float32
+                          for column in COL_PS1_ZTF})
+
+CORRECTED_SCHEMA = dict(DETECTIONS_SCHEMA, **{
+    'magpsf_corr': np.float32,
+    'sigmapsf_corr': np.float32,
+    'sigmapsf_corr_ext': np.float32,
+    'mjdendref': np.float64,
+    'corrected': np.bool_,
+    'dubious': np.bool_,
+    'has_stamp': np.bool_,
+    'step_id_corr': 'category',
+})  #: compact dtypes of corrected detections
+
+NON_DETECTIONS_SCHEMA = {
+    'objectId': 'category',
+    'fid': np.int8,
+    'mjd': np.float64,
+    'diffmaglim': np.float32,
+}  #: compact dtypes of non detections
+
+
+def isdiffpos_sign(isdiffpos, dtype=np.int8):
+    """
+    Sign of the subtraction, 1 or -1, of isdiffpos values given as strings ('t', 'f', '1' or '0'). Numeric values
+    are returned unchanged.
+
+    :param isdiffpos: isdiffpos of detections
+    :type isdiffpos: :py:class:`pd.Series`
+
+    :param dtype: dtype of the sign of string values
+    :type dtype: dtype
+
+    :return: Sign of each detection, NaN for unknown strings
+    :rtype: :py:class:`pd.Series`
+    """
+    if pd.api.types.is_numeric_dtype(isdiffpos.dtype) and not pd.api.types.is_bool_dtype(isdiffpos.dtype):
+        return isdiffpos
+    sign = isdiffpos.astype(object).map(ISDIFFPOS_SIGN)
+    return sign if sign.isna().any() else sign.astype(dtype)
+
+
+def coerce_schema(df, schema=None):
+    """
+    Cast the columns of a dataframe to a compact schema. Columns not in the schema are kept as they are. Use it once
+    at the entry of a pipeline, the compute functions keep these dtypes.
+
+    :param df: A dataframe with detections, corrected detections or non detections
+    :type df: :py:class:`pd.DataFrame`
+
+    :param schema: dtype of each column, by default :data:`CORRECTED_SCHEMA` (which contains the detection columns)
+    :type schema: dict
+
+    :return: A dataframe with the compact dtypes
+    :rtype: :py:class:`pd.DataFrame`
+
+    Example::
+
+        detections = coerce_schema(pd.read_parquet(path))
+    """
+    schema = CORRECTED_SCHEMA if schema is None else schema
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if column == 'isdiffpos':
+            sign = isdiffpos_sign(df[column])
+            if sign.isna().any():
+                raise ValueError("Unknown isdiffpos values: {}".format(df.loc[sign.isna(), column].unique()))
+            df[column] = sign.astype(dtype)
+        elif dtype != 'category' and np.issubdtype(dtype, np.integer) and df[column].isna().any():
+            # integer columns with nulls keep a float dtype
+            df[column] = df[column].astype(np.float64)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
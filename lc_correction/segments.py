@@ -0,0 +1,167 @@
+import numpy as np
+
+
+def segment_starts(*keys):
+    """
+    Get the first position of every segment of consecutive equal keys.
+
+    :param keys: Sorted arrays with the keys of each row (e.g. objectId and fid)
+    :type keys: :py:class:`numpy.ndarray`
+
+    :return: Start position of each segment
+    :rtype: :py:class:`numpy.ndarray`
+
+    Example::
+
+        starts = segment_starts(df.objectId.values, df.fid.values)
+    """
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for key in keys:
+        key = np.asarray(key)
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def segment_ids(starts, n):
+    """
+    Get the segment number of every row.
+
+    :param starts: Start position of each segment
+    :type starts: :py:class:`numpy.ndarray`
+
+    :param n: Number of rows
+    :type n: int
+
+    :return: Segment number of each row
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return np.repeat(np.arange(len(starts)), segment_lengths(starts, n))
+
+
+def segment_lengths(starts, n):
+    """
+    Get the number of rows of every segment.
+
+    :param starts: Start position of each segment
+    :type starts: :py:class:`numpy.ndarray`
+
+    :param n: Number of rows
+    :type n: int
+
+    :return: Length of each segment
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return np.diff(np.append(starts, n))
+
+
+def segment_count(values, starts):
+    """
+    Number of non NaN values of every segment.
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.add.reduceat(~np.isnan(values), starts).astype(np.int64)
+
+
+def segment_sum(values, starts):
+    """
+    Sum of non NaN values of every segment.
+    """
+    if len(starts) == 0:
+        return np.zeros(0)
+    values = np.asarray(values, dtype=np.float64)
+    return np.add.reduceat(np.where(np.isnan(values), 0., values), starts)
+
+
+def segment_mean(values, starts):
+    """
+    Mean of non NaN values of every segment, NaN if the segment has no values.
+    """
+    count = segment_count(values, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, segment_sum(values, starts) / count, np.nan)
+
+
+def segment_std(values, starts, ddof=1):
+    """
+    Standard deviation of non NaN values of every segment, NaN if the segment has not enough values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = segment_count(values, starts)
+    mean = segment_mean(values, starts)
+    deviation = values - np.repeat(mean, segment_lengths(starts, len(values)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = segment_sum(deviation**2, starts) / (count - ddof)
+        return np.where(count > ddof, np.sqrt(variance), np.nan)
+
+
+def segment_min(values, starts):
+    """
+    Minimum of non NaN values of every segment, NaN if the segment has no values.
+    """
+    if len(starts) == 0:
+        return np.zeros(0)
+    return np.fmin.reduceat(np.asarray(values, dtype=np.float64), starts)
+
+
+def segment_max(values, starts):
+    """
+    Maximum of non NaN values of every segment, NaN if the segment has no values.
+    """
+    if len(starts) == 0:
+        return np.zeros(0)
+    return np.fmax.reduceat(np.asarray(values, dtype=np.float64), starts)
+
+
+def segment_median(values, starts):
+    """
+    Median of non NaN values of every segment, NaN if the segment has no values. The values are sorted inside
+    each segment, so the median is exact.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    ids = segment_ids(starts, n)
+    # NaN are sorted to the end of their segment
+    order = np.lexsort((values, ids))
+    sorted_values = values[order]
+    count = segment_count(values, starts)
+    low = starts + np.maximum(count - 1, 0) // 2
+    high = starts + count // 2
+    low = np.minimum(low, max(n - 1, 0))
+    high = np.minimum(high, max(n - 1, 0))
+    with np.errstate(invalid="ignore"):
+        median = (sorted_values[low] + sorted_values[high]) / 2
+    return np.where(count > 0, median, np.nan)
+
+
+def segment_nunique(values, starts):
+    """
+    Number of distinct non NaN values of every segment.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    ids = segment_ids(starts, n)
+    order = np.lexsort((values, ids))
+    sorted_values = values[order]
+    sorted_ids = ids[order]
+    new = np.ones(n, dtype=bool)
+    new[1:] = (sorted_values[1:] != sorted_values[:-1]) | (sorted_ids[1:] != sorted_ids[:-1])
+    new &= ~np.isnan(sorted_values)
+    return np.bincount(sorted_ids, weights=new, minlength=len(starts)).astype(np.int64)
+
+
+def segment_first_of_max(values, starts):
+    """
+    Position of the first row holding the maximum of every segment. With rows stably sorted by value inside
+    each segment, this is the same row that ``argmax`` returns over the unsorted segment.
+    """
+    n = len(values)
+    maximum = np.repeat(segment_max(values, starts), segment_lengths(starts, n))
+    positions = np.flatnonzero(values == maximum)
+    return positions[np.searchsorted(positions, starts)]
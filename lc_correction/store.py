@@ -0,0 +1,280 @@
+"""
+On-disk light curve store of detections and non detections, for random access recomputation of a few objects.
+
+Each append writes a part: an Arrow IPC file with the rows sorted by objectId, fid and mjd, so the rows of an
+``[objectId, fid]`` pair are a contiguous segment, and an index file with the offset and length of each segment.
+Parts are memory mapped, so loading an object reads its segments only, O(light curve length) instead of O(file
+size). A JSON manifest lists the parts of each kind, and it is replaced atomically.
+
+Appending a night adds a part. Loading from several parts sorts and deduplicates the rows of the requested objects
+(a later part wins), so :meth:`LightCurveStore.compact` merges the parts in one when there are more than
+``max_parts``. From a single part, :meth:`LightCurveStore.load` returns slices of the memory mapped file, without
+copies.
+
+Example::
+
+    store = LightCurveStore("lightcurves")
+    store.append(detections, non_detections)
+    results = store.recompute(["ZTF18aazxcwf", "ZTF20aaelulu"])
+    magstats = results["magstats"].to_pandas()
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .arrow import correct_table, dmdt_table, magstats_table
+from .keys import encode_objects, group_keys
+from .segments import segment_lengths, segment_starts
+
+KINDS = ["detections", "non_detections"]  #: kinds of rows in a store
+DUPLICATE_KEYS = {"detections": ["mjd", "candid"], "non_detections": ["mjd"]}  #: besides objectId and fid
+MANIFEST = "manifest.json"
+
+
+def _to_table(data):
+    if isinstance(data, pd.DataFrame):
+        if "objectId" not in data.columns:
+            data = data.reset_index()
+        data = pa.Table.from_pandas(data, preserve_index=False)
+    elif isinstance(data, pa.RecordBatch):
+        data = pa.Table.from_batches([data])
+    if "mjd" not in data.column_names and "jd" in data.column_names:
+        data = data.append_column("mjd", pc.subtract(data["jd"], 2400000.5))
+    # the same objectId type in every part
+    return data.set_column(data.column_names.index("objectId"), "objectId", data["objectId"].cast(pa.string()))
+
+
+def _conform(table, schema):
+    """Cast a table to the schema of the store: missing columns are null and extra columns are dropped."""
+    columns = [table[field.name].cast(field.type) if field.name in table.column_names
+               else pa.nulls(table.num_rows, field.type) for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _numpy(column):
+    return column.to_numpy() if column.null_count == 0 else column.to_pandas().values
+
+
+def _sort(table, kind, deduplicate=False):
+    """
+    Sort the rows by objectId, fid and the duplicate keys, and optionally drop duplicated rows keeping the last one.
+
+    :return: The sorted table, and the ``[objectId, fid]`` key of each row
+    :rtype: tuple
+    """
+    codes, _ = encode_objects(table["objectId"])
+    key, _ = group_keys(codes, _numpy(table["fid"]))
+    by = [_numpy(table[column]) for column in DUPLICATE_KEYS[kind] if column in table.column_names]
+    order = np.lexsort(tuple(reversed(by)) + (key,))
+    key = key[order]
+    if deduplicate and len(order) > 1:
+        sorted_by = [key] + [values[order] for values in by]
+        # a row is kept if the next one has other keys, equal rows keep their input (append) order
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = np.logical_or.reduce([values[1:] != values[:-1] for values in sorted_by])
+        order, key = order[last], key[last]
+    return table.take(pa.array(order, type=pa.int64())), key
+
+
+def _write_ipc(table, path):
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_ipc(path):
+    # memory mapped, the buffers of the table point to the file
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class _Part:
+    """
+    A part of a store: the rows, memory mapped, and the segment of each object.
+    """
+
+    def __init__(self, path):
+        self.table = _read_ipc(path + ".arrow")
+        index = _read_ipc(path + ".index.arrow").to_pandas()
+        self.segments = index.set_index(["objectId", "fid"])
+        # the segments of an object are contiguous
+        self.objects = index.groupby("objectId", sort=True).agg(offset=("offset", "min"), length=("length", "sum"))
+
+    def ranges(self, oids, fids=None):
+        """Offset and length of the rows of the objects, merging contiguous ranges."""
+        if fids is None:
+            rows = self.objects.reindex(oids).dropna()
+        else:
+            keys = pd.MultiIndex.from_product([oids, fids], names=["objectId", "fid"])
+            rows = self.segments.reindex(keys).dropna()
+        rows = rows.sort_values("offset")
+        ranges = []
+        for offset, length in zip(rows["offset"].values.astype(np.int64), rows["length"].values.astype(np.int64)):
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1][1] += length
+            else:
+                ranges.append([offset, length])
+        return ranges
+
+
+class LightCurveStore:
+    """
+    Light curve store in a directory.
+
+    :param path: Directory of the store, created if it does not exist
+    :type path: string
+
+    :param max_parts: Parts of a kind that trigger a compaction on append
+    :type max_parts: int
+    """
+
+    def __init__(self, path, max_parts=8):
+        self.path = path
+        self.max_parts = max_parts
+        os.makedirs(path, exist_ok=True)
+        manifest = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"next_part": 0, "parts": {kind: [] for kind in KINDS}}
+        self._parts = {}
+
+    def _part(self, name):
+        if name not in self._parts:
+            self._parts[name] = _Part(os.path.join(self.path, name))
+        return self._parts[name]
+
+    def parts(self, kind="detections"):
+        """
+        :return: Names of the parts of a kind, in append order
+        :rtype: list
+        """
+        return list(self.manifest["parts"][kind])
+
+    def schema(self, kind="detections"):
+        parts = self.parts(kind)
+        return self._part(parts[0]).table.schema if parts else None
+
+    def _save_manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _write_part(self, table, kind):
+        """Sort and deduplicate a table, write it as a new part with its index and return its name."""
+        name = "{}-{:06d}".format(kind, self.manifest["next_part"])
+        self.manifest["next_part"] += 1
+        table, key = _sort(table, kind, deduplicate=True)
+        starts = segment_starts(key)
+        index = pa.table({"objectId": table["objectId"].take(pa.array(starts, type=pa.int64())),
+                          "fid": table["fid"].take(pa.array(starts, type=pa.int64())),
+                          "offset": pa.array(starts, type=pa.int64()),
+                          "length": pa.array(segment_lengths(starts, table.num_rows), type=pa.int64())})
+        _write_ipc(table, os.path.join(self.path, name + ".arrow"))
+        _write_ipc(index, os.path.join(self.path, name + ".index.arrow"))
+        return name
+
+    def append(self, detections=None, non_detections=None):
+        """
+        Add the detections and non detections of a night. Rows already in the store (same candid for detections,
+        same objectId, fid and mjd for non detections) are replaced.
+
+        :param detections: Detections, they must have objectId, fid, candid and mjd (or jd)
+        :type detections: :py:class:`pd.DataFrame` or :py:class:`pa.Table`
+
+        :param non_detections: Non detections, they must have objectId, fid and mjd (or jd)
+        :type non_detections: :py:class:`pd.DataFrame` or :py:class:`pa.Table`
+        """
+        for kind, data in zip(KINDS, [detections, non_detections]):
+            if data is None or len(data) == 0:
+                continue
+            table = _to_table(data)
+            schema = self.schema(kind)
+            if schema is not None:
+                table = _conform(table, schema)
+            self.manifest["parts"][kind].append(self._write_part(table, kind))
+        self._save_manifest()
+        for kind in KINDS:
+            if len(self.manifest["parts"][kind]) > self.max_parts:
+                self.compact(kind)
+
+    def compact(self, kind=None):
+        """
+        Merge the parts of a kind (or of every kind) in a single part.
+        """
+        for kind in KINDS if kind is None else [kind]:
+            parts = self.parts(kind)
+            if len(parts) <= 1:
+                continue
+            table = pa.concat_tables([self._part(name).table for name in parts])
+            self.manifest["parts"][kind] = [self._write_part(table, kind)]
+            self._save_manifest()
+            for name in parts:
+                self._parts.pop(name, None)
+                for suffix in [".arrow", ".index.arrow"]:
+                    os.remove(os.path.join(self.path, name + suffix))
+
+    def objects(self, kind="detections"):
+        """
+        :return: Sorted object ids of a kind
+        :rtype: :py:class:`pd.Index`
+        """
+        index = pd.Index([], dtype=object)
+        for name in self.parts(kind):
+            index = index.union(self._part(name).objects.index)
+        return index
+
+    def load(self, oids, kind="detections", fids=None):
+        """
+        Rows of some objects, sorted by objectId, fid and mjd. From a single part, the columns are slices of the
+        memory mapped file.
+
+        :param oids: Object ids
+        :type oids: list
+
+        :param kind: detections or non_detections
+        :type kind: string
+
+        :param fids: Filter ids to load, by default all of them
+        :type fids: list
+
+        :rtype: :py:class:`pa.Table`
+        """
+        oids = sorted(set(oids))
+        parts = self.parts(kind)
+        if not parts:
+            return pa.table({"objectId": pa.array([], type=pa.string())})
+        slices = [self._part(name).table.slice(offset, length) for name in parts
+                  for offset, length in self._part(name).ranges(oids, fids)]
+        table = pa.concat_tables(slices) if slices else self.schema(kind).empty_table()
+        if len(parts) > 1:
+            table = _sort(table, kind, deduplicate=True)[0]
+        return table
+
+    def recompute(self, oids, flags=False, dt_min=0.5):
+        """
+        Correction, magnitude statistics and dm/dt of some objects, with the stages of :mod:`lc_correction.arrow`.
+
+        :param oids: Object ids
+        :type oids: list
+
+        :param flags: If you want compute flags, set it like True
+        :type flags: boolean
+
+        :param dt_min:
+        :type dt_min: float
+
+        :return: corrected, magstats and dmdt tables (dmdt only if the store has non detections)
+        :rtype: dict
+        """
+        corrected = correct_table(self.load(oids))
+        magstats = magstats_table(corrected, flags=flags)
+        results = {"corrected": corrected, "magstats": magstats}
+        if self.parts("non_detections"):
+            results["dmdt"] = dmdt_table(magstats, self.load(oids, "non_detections"), dt_min=dt_min)
+        return results
@@ -0,0 +1,249 @@
+"""
+Asyncio consumer of an alert stream. Alerts are gathered in micro-batches, closed when they reach ``batch_size``
+alerts or when the first alert of the batch has waited ``max_delay`` seconds. Each batch is corrected with
+:func:`lc_correction.compute.correction_kernel` in an executor, and the incremental statistics of its objects are
+updated there. Results are yielded in arrival order.
+
+The queue of closed batches holds at most ``max_pending`` batches: when the consumer of the results is slower than
+the source, the source is not read until there is room, so the memory is bounded.
+
+Example::
+
+    corrector = StreamCorrector(batch_size=500, max_delay=0.05)
+
+    async def main():
+        async for result in corrector.run(avro_source("data_examples/avros")):
+            print(result["objectId"], result["magpsf_corr"])
+        print(corrector.stats())
+
+    asyncio.run(main())
+"""
+import asyncio
+import concurrent.futures
+import time
+from collections import deque
+
+import numpy as np
+
+from .compute import DISTANCE_THRESHOLD, correction_kernel, log_status
+from .incremental import IncrementalMagStats, IncrementalObjectStats
+from .io import read_alerts
+from .kernels import _isdiffpos, _value
+
+_DONE = object()
+
+
+async def avro_source(source, rate=None):
+    """
+    Alerts of a set of ZTF avro files, as an asynchronous stream. The files are read in a thread, so the event loop
+    is not blocked. It stands for the broker in tests and replays.
+
+    :param source: An avro file, a directory with avro files (read recursively) or an iterable of them
+    :type source: str or iterable
+
+    :param rate: Maximum alerts per second, by default as fast as they are read
+    :type rate: float
+
+    :return: An asynchronous generator of alerts
+    :rtype: async generator of dict
+    """
+    loop = asyncio.get_running_loop()
+    alerts = read_alerts(source)
+    start = time.perf_counter()
+    n = 0
+    while True:
+        alert = await loop.run_in_executor(None, next, alerts, _DONE)
+        if alert is _DONE:
+            return
+        if rate is not None:
+            await asyncio.sleep(max(0., start + n / rate - time.perf_counter()))
+        n += 1
+        yield alert
+
+
+async def iterate(alerts):
+    """
+    Asynchronous stream of an iterable of alerts.
+    """
+    for alert in alerts:
+        yield alert
+
+
+class StreamCorrector:
+    """
+    Correction of a stream of alerts in micro-batches, keeping the incremental magnitude statistics of each
+    ``[objectId, fid]`` pair and the statistics of each object.
+
+    Each result is a dict with the objectId, candid, fid and mjd of the alert candidate, its corrected flag,
+    magpsf_corr, sigmapsf_corr and sigmapsf_corr_ext (NaN if not corrected, as in
+    :func:`lc_correction.compute.correct_detections`) and the status of :func:`lc_correction.compute.correction_kernel`.
+    The statistics are in :attr:`magstats` and :attr:`objstats`.
+
+    :param batch_size: Maximum alerts of a batch
+    :type batch_size: int
+
+    :param max_delay: Maximum seconds the first alert of a batch waits for the batch to be closed
+    :type max_delay: float
+
+    :param max_pending: Maximum closed batches waiting to be processed
+    :type max_pending: int
+
+    :param executor: Executor where the batches are processed, by default a single thread. The statistics are
+        updated there, so the executor must run the batches one at a time (e.g. one worker).
+    :type executor: :py:class:`concurrent.futures.Executor`
+
+    :param max_latencies: Number of latencies kept for the percentiles
+    :type max_latencies: int
+    """
+
+    def __init__(self, batch_size=1000, max_delay=0.1, max_pending=4, executor=None, max_latencies=100000):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self.magstats = {}  #: :class:`IncrementalMagStats` by (objectId, fid)
+        self.objstats = {}  #: :class:`IncrementalObjectStats` by objectId
+        self.latencies = deque(maxlen=max_latencies)
+        self.n_alerts = 0
+        self.n_batches = 0
+        self.start = None
+        self.end = None
+
+    def process(self, alerts):
+        """
+        Correct a batch of alerts and update the statistics. It is called in the executor.
+
+        :param alerts: Alerts of the batch
+        :type alerts: list of dict
+
+        :return: The result of each alert
+        :rtype: list of dict
+        """
+        candidates = []
+        for alert in alerts:
+            candidate = dict(alert["candidate"])
+            candidate["objectId"] = alert["objectId"]
+            candidate["mjd"] = candidate["jd"] - 2400000.5
+            candidates.append(candidate)
+
+        def column(name):
+            return np.array([_value(candidate, name) for candidate in candidates], dtype=np.float64)
+
+        isdiffpos = np.array([_isdiffpos(candidate["isdiffpos"]) for candidate in candidates], dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            corrected = column("distnr") < DISTANCE_THRESHOLD
+        magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext, status = correction_kernel(
+            column("magnr"), column("magpsf"), column("sigmagnr"), column("sigmapsf"), isdiffpos)
+        log_status(status, corrected)
+        magpsf_corr[~corrected] = np.nan
+        sigmapsf_corr[~corrected] = np.nan
+        sigmapsf_corr_ext[~corrected] = np.nan
+
+        results = []
+        for i, candidate in enumerate(candidates):
+            oid, fid = candidate["objectId"], candidate["fid"]
+            magnitudes = (float(magpsf_corr[i]), float(sigmapsf_corr[i]), float(sigmapsf_corr_ext[i]))
+            stats = self.magstats.get((oid, fid))
+            if stats is None:
+                stats = self.magstats[(oid, fid)] = IncrementalMagStats()
+            stats.update(candidate, corrected_magnitudes=magnitudes)
+            objstats = self.objstats.get(oid)
+            if objstats is None:
+                objstats = self.objstats[oid] = IncrementalObjectStats()
+            objstats.update(candidate)
+            results.append({"objectId": oid, "candid": candidate["candid"], "fid": fid, "mjd": candidate["mjd"],
+                            "corrected": bool(corrected[i]), "magpsf_corr": magnitudes[0],
+                            "sigmapsf_corr": magnitudes[1], "sigmapsf_corr_ext": magnitudes[2],
+                            "status": int(status[i])})
+        return results
+
+    async def _batches(self, source, queue):
+        """
+        Gather the alerts of the source in batches of (arrival time, alert) and put them in the queue, then None (or
+        the error of the source).
+        """
+        iterator = source.__aiter__()
+        pending = None
+        batch = []
+        deadline = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if deadline is None else max(0., deadline - time.perf_counter())
+                # the pending read is kept across batches, so a deadline never cancels the source
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if done:
+                    try:
+                        alert = pending.result()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        pending = None
+                    now = time.perf_counter()
+                    if not batch:
+                        deadline = now + self.max_delay
+                    batch.append((now, alert))
+                if len(batch) >= self.batch_size or (batch and time.perf_counter() >= deadline):
+                    await queue.put(batch)
+                    batch = []
+                    deadline = None
+            if batch:
+                await queue.put(batch)
+        except Exception as error:
+            # the consumer raises the errors of the source
+            await queue.put(error)
+            return
+        finally:
+            if pending is not None:
+                pending.cancel()
+        await queue.put(None)
+
+    async def run(self, source):
+        """
+        Correct a stream of alerts.
+
+        :param source: Alerts, like the ones of :func:`avro_source`
+        :type source: async iterable or iterable of dict
+
+        :return: The result of each alert, in arrival order
+        :rtype: async generator of dict
+        """
+        if not hasattr(source, "__aiter__"):
+            source = iterate(source)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_pending)
+        producer = asyncio.ensure_future(self._batches(source, queue))
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                if self.start is None:
+                    self.start = batch[0][0]
+                results = await loop.run_in_executor(self.executor, self.process, [alert for _, alert in batch])
+                now = time.perf_counter()
+                self.latencies.extend(now - arrival for arrival, _ in batch)
+                self.n_alerts += len(batch)
+                self.n_batches += 1
+                self.end = now
+                for result in results:
+                    yield result
+        finally:
+            producer.cancel()
+
+    def stats(self):
+        """
+        :return: Alerts, batches, mean batch size, throughput (alerts per second from the first arrival to the last
+            result) and latency percentiles in seconds, from the arrival of an alert to its result
+        :rtype: dict
+        """
+        seconds = self.end - self.start if self.n_alerts > 0 else 0.
+        latencies = np.array(self.latencies)
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) > 0 else (np.nan, np.nan)
+        return {"alerts": self.n_alerts, "batches": self.n_batches,
+                "batch_size": self.n_alerts / self.n_batches if self.n_batches > 0 else np.nan,
+                "seconds": seconds, "throughput": self.n_alerts / seconds if seconds > 0 else np.nan,
+                "latency_p50": float(p50), "latency_p99": float(p99)}
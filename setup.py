@@ -12,6 +12,9 @@ setup(
     author="ALeRCE Team",
     author_email='contact@alerce.online',
     packages=['lc_correction'],
+    entry_points={
+        'console_scripts': ['lc-correction=lc_correction.cli:main'],
+    },
     install_requires=required_packages,
     build_requires=required_packages
 )
\ No newline at end of file
@@ -1,2 +1,15 @@
 from .test_correction import *
 from .test_helpers import *
+from .test_incremental import *
+from .test_io import *
+from .test_pipeline import *
+from .test_bulk import *
+from .test_schema import *
+from .test_keys import *
+from .test_reference import *
+from .test_instrumentation import *
+from .test_arrow import *
+from .test_stream import *
+from .test_store import *
+from .test_kernels import *
+from .test_cache import *
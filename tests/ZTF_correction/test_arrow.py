@@ -0,0 +1,83 @@
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from lc_correction.arrow import *
+from lc_correction.compute import apply_object_stats_df, compute_dmdt, compute_magstats, correct_detections
+from lc_correction.helpers import get_clean_corrected
+from lc_correction.keys import encode_objects
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+def read_table(name):
+    table = pq.read_table(os.path.join(PARQUET_PATH, name))
+    # the index columns are written by pandas
+    return table.drop([column for column in table.column_names if column.startswith("__index")])
+
+
+def with_mjd(table):
+    return table.append_column("mjd", pa.compute.subtract(table["jd"], 2400000.5)).drop(["jd"])
+
+
+class TestArrow(unittest.TestCase):
+    def setUp(self) -> None:
+        self.detections = with_mjd(read_table("10_objects_detections.parquet"))
+        self.non_detections = with_mjd(read_table("10_objects_non_detections.parquet"))
+        self.corrected = read_table("10_objects_corrected.parquet")
+        self.magstats = read_table("10_objects_magstats.parquet")
+
+    def test_encode_objects(self):
+        oid = pa.chunked_array([["ZTF20b", "ZTF19a"], ["ZTF20b", None, "ZTF21c"]])
+        codes, objects = encode_objects(oid)
+        np.testing.assert_array_equal(codes, [1, 0, 1, -1, 2])
+        self.assertEqual(objects.to_pylist(), ["ZTF19a", "ZTF20b", "ZTF21c"])
+        codes, _ = encode_objects(pa.array(["ZTF21c", "ZTF00x"]).dictionary_encode(), categories=objects)
+        np.testing.assert_array_equal(codes, [2, -1])
+
+    def test_correct_table(self):
+        expected = correct_detections(self.detections.to_pandas()).reset_index()
+        result = correct_table(self.detections).to_pandas()
+        # fid keeps its input dtype, pandas index levels are int64
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+        self.assertEqual(result.corrected.sum(), 1373)
+
+    def test_record_batch(self):
+        batch = self.detections.combine_chunks().to_batches()[0]
+        pd.testing.assert_frame_equal(correct_table(batch).to_pandas(),
+                                      correct_table(self.detections).to_pandas())
+
+    def test_magstats_table(self):
+        expected = compute_magstats(self.corrected.to_pandas(), flags=True).reset_index()
+        result = magstats_table(self.corrected, flags=True).to_pandas()
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_object_stats_table(self):
+        magstats = magstats_table(self.corrected)
+        expected = apply_object_stats_df(self.corrected.to_pandas(), magstats.to_pandas(), flags=True)
+        result = object_stats_table(self.corrected, magstats, flags=True).to_pandas().set_index("objectId")
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_object_stats_missing_magstats(self):
+        magstats = magstats_table(self.corrected)
+        oid = magstats["objectId"][0].as_py()
+        magstats = magstats.filter(pa.compute.not_equal(magstats["objectId"], oid))
+        result = object_stats_table(self.corrected, magstats).to_pandas().set_index("objectId")
+        self.assertEqual(len(result), 10)
+        self.assertTrue(np.isnan(result.loc[oid, "ndet"]))
+        self.assertTrue(result.drop(oid).ndet.notna().all())
+
+    def test_dmdt_table(self):
+        expected = compute_dmdt(self.magstats.to_pandas(), self.non_detections.to_pandas()).reset_index()
+        result = dmdt_table(self.magstats, self.non_detections).to_pandas()
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_clean_corrected_table(self):
+        corrected = correct_table(self.detections)
+        expected = get_clean_corrected(correct_detections(self.detections.to_pandas()))
+        result = clean_corrected_table(corrected).to_pandas()
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
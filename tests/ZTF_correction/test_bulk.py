@@ -0,0 +1,97 @@
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from lc_correction import bulk
+from lc_correction.bulk import *
+from lc_correction.cli import main
+from lc_correction.compute import *
+from lc_correction.pipeline import STAGES, hash_partition, run_stages
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+class TestBulkCorrectParquet(unittest.TestCase):
+    def setUp(self) -> None:
+        self.detections_path = os.path.join(PARQUET_PATH, "10_objects_detections.parquet")
+        self.non_detections_path = os.path.join(PARQUET_PATH, "10_objects_non_detections.parquet")
+        detections = pd.read_parquet(self.detections_path)
+        non_detections = pd.read_parquet(self.non_detections_path)
+        detections["mjd"] = detections.jd - 2400000.5
+        non_detections["mjd"] = non_detections.jd - 2400000.5
+        self.expected = run_stages(detections, non_detections, flags=True)
+        self.out = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.out.cleanup()
+
+    def check_output(self):
+        levels = {"corrected": ["objectId", "fid"], "magstats": ["objectId", "fid"], "objstats": ["objectId"],
+                  "dmdt": ["objectId", "fid"]}
+        for stage in STAGES:
+            result = pd.read_parquet(os.path.join(self.out.name, stage))
+            result = result.sort_index(level=levels[stage], sort_remaining=False, kind="mergesort")
+            pd.testing.assert_frame_equal(result, self.expected[stage], check_index_type=False,
+                                          check_categorical=False)
+
+    def test_bulk_correct_parquet(self):
+        n_buckets = bulk_correct_parquet(self.detections_path, self.non_detections_path, self.out.name,
+                                         memory_budget=1, flags=True)
+        self.assertGreater(n_buckets, 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.out.name, "corrected"))), n_buckets)
+        self.check_output()
+
+    def test_cli(self):
+        main(["bulk", "--detections", self.detections_path, "--non-detections", self.non_detections_path,
+              "--out", self.out.name, "--flags"])
+        self.check_output()
+
+    def test_spill_files(self):
+        # one file per flush whatever the number of buckets, and the rows of each bucket in their input order
+        table = pq.read_table(self.detections_path)
+        with tempfile.TemporaryDirectory() as directory:
+            spill = bulk._Spill(directory, "detections", table.schema, buffer_size=table.nbytes // 4)
+            bulk._partition(table.to_batches(max_chunksize=100), 50, spill)
+            self.assertEqual(len(os.listdir(directory)), spill.n_files)
+            self.assertLessEqual(spill.n_files, 5)
+            shards = hash_partition(table.column("objectId").to_pandas(), 50)
+            buckets = [bucket for bucket in spill.locations]
+            self.assertEqual(sorted(residue for _, residue in buckets), sorted(set(shards.tolist())))
+            for _, residue in buckets:
+                expected = table.filter(pa.array(shards == residue)).to_pandas()
+                result = spill.read((50, residue))
+                pd.testing.assert_frame_equal(result.drop(columns="mjd"), expected)
+
+            # splitting keeps every object in one bucket, and the files of removed buckets are deleted
+            bucket = max(buckets, key=spill.size)
+            parts = bulk._split(bucket, 4, [spill])
+            self.assertNotIn(bucket, spill)
+            objects = [set(spill.read(part).objectId) for part in parts if part in spill]
+            self.assertEqual(sum(len(part) for part in objects), len(set.union(*objects)))
+            for bucket in list(spill.locations):
+                spill.remove(bucket)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_bulk_split(self):
+        # the spilled buckets are larger than the parquet files, so some of the first buckets are over the budget
+        budget = 1024 ** 2
+        sizes = []
+
+        def split(bucket, n_parts, spills):
+            sizes.append(sum(spill.size(bucket) for spill in spills))
+            return _split(bucket, n_parts, spills)
+
+        _split = bulk._split
+        with mock.patch.object(bulk, "_split", side_effect=split) as spy:
+            n_buckets = bulk_correct_parquet(self.detections_path, self.non_detections_path, self.out.name,
+                                             memory_budget=budget // 1024 ** 2, flags=True)
+        self.assertGreater(spy.call_count, 0)
+        self.assertTrue(all(size * MEMORY_EXPANSION > budget for size in sizes))
+        size = bulk._parquet_size(self.detections_path)[1] + bulk._parquet_size(self.non_detections_path)[1]
+        self.assertGreater(n_buckets, math.ceil(size * MEMORY_EXPANSION / budget))
+        self.check_output()
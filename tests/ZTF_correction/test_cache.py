@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lc_correction.cache import *
+from lc_correction.compute import *
+from lc_correction.pipeline import run_stages
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
+        self.non_detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_non_detections.parquet"))
+        self.detections["mjd"] = self.detections.jd - 2400000.5
+        del self.detections["jd"]
+        self.non_detections["mjd"] = self.non_detections.jd - 2400000.5
+        del self.non_detections["jd"]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.sqlite")
+        self.oid = self.detections.objectId.iloc[0]
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def assert_results(self, results, expected):
+        for stage in CACHED_STAGES:
+            pd.testing.assert_frame_equal(results[stage], expected[stage])
+
+    def test_fingerprints(self):
+        fingerprints = group_fingerprints(self.detections, self.non_detections)
+        self.assertEqual(len(fingerprints), 16)
+        shuffled = group_fingerprints(self.detections.sample(frac=1, random_state=0),
+                                      self.non_detections.sample(frac=1, random_state=0))
+        pd.testing.assert_series_equal(shuffled, fingerprints)
+        non_detections = self.non_detections.reset_index(drop=True)
+        last = non_detections[non_detections.objectId == self.oid].mjd.idxmax()
+        changed = group_fingerprints(self.detections, non_detections.drop(last))
+        self.assertEqual(list(changed.index[changed != fingerprints]), [(self.oid, non_detections.fid[last])])
+        objects = object_fingerprints(fingerprints)
+        self.assertEqual(len(objects), 10)
+        self.assertEqual(list(objects.index[object_fingerprints(changed) != objects]), [self.oid])
+
+    def test_run_cached(self):
+        expected = run_stages(self.detections, self.non_detections)
+        cache = ResultCache(self.path)
+        results = run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(len(results["dirty"]), 10)
+        self.assert_results(results, expected)
+        results = run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(len(results["dirty"]), 0)
+        self.assertIsNone(results["corrected"])
+        self.assert_results(results, expected)
+
+        detections = self.detections.reset_index(drop=True)
+        detections = detections.drop(detections[detections.objectId == self.oid].mjd.idxmax())
+        results = run_cached(detections, self.non_detections, cache)
+        self.assertEqual(list(results["dirty"]), [self.oid])
+        self.assertEqual(set(results["corrected"].index.get_level_values("objectId")), {self.oid})
+        self.assert_results(results, run_stages(detections, self.non_detections))
+
+        results = run_cached(detections, self.non_detections, cache, flags=True)
+        self.assertEqual(len(results["dirty"]), 10)
+        self.assert_results(results, run_stages(detections, self.non_detections, flags=True))
+        cache.close()
+
+    def test_eviction(self):
+        cache = ResultCache(self.path)
+        run_cached(self.detections, self.non_detections, cache)
+        size = cache.size()
+        cache.max_bytes = size // 2
+        cache.evict()
+        self.assertLessEqual(cache.size(), size // 2)
+        self.assertGreater(len(cache), 0)
+        results = run_cached(self.detections, self.non_detections, cache)
+        self.assertGreater(len(results["dirty"]), 0)
+        self.assert_results(results, run_stages(self.detections, self.non_detections))
+
+    def test_version(self):
+        cache = ResultCache(self.path)
+        run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(len(cache), 42)
+        cache.close()
+        self.assertEqual(len(ResultCache(self.path, version="0.0.0")), 0)
+
+    def test_implementation(self):
+        cache = ResultCache(self.path)
+        run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(len(run_cached(self.detections, self.non_detections, cache)["dirty"]), 0)
+        with mock.patch("lc_correction.cache.implementation_hash", return_value="another implementation"):
+            results = run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(len(results["dirty"]), 10)
+        self.assert_results(results, run_stages(self.detections, self.non_detections))
+        self.assertEqual(len(implementation_hash()), 40)
+
+    def test_running_size(self):
+        def table_size():
+            return cache.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        cache = ResultCache(self.path)
+        run_cached(self.detections, self.non_detections, cache)
+        self.assertEqual(cache.size(), table_size())
+        # replaced rows leave the size
+        run_cached(self.detections, self.non_detections, cache, flags=True)
+        self.assertEqual(cache.size(), table_size())
+        cache.max_bytes = cache.size() // 3
+        run_cached(self.detections, self.non_detections, cache)
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+        self.assertEqual(cache.size(), table_size())
+        size = cache.size()
+        cache.close()
+        cache = ResultCache(self.path)
+        self.assertEqual(cache.size(), size)
+        cache.clear()
+        self.assertEqual(cache.size(), 0)
+        cache.close()
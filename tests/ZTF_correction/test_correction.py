@@ -3,6 +3,7 @@ import fastavro
 import unittest
 
 from lc_correction.compute import *
+from lc_correction.helpers import get_ps1_ztf
 
 AVRO_PATH = "data_examples/avros"
 CSV_PATH = "data_examples/csv"
@@ -13,7 +14,7 @@ def read_avro(avro_path):
     with open(avro_path, "rb") as file:
         try:
             reader = fastavro.reader(file)
-            data = reader.next()
+            data = next(reader)
         except Exception:
            return None
     return data
@@ -30,6 +31,24 @@ def get_avros(oid):
     return data
 
 
+def baseline_correction(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos):
+    # the scalar correction formula of the first release, the reference of every implementation, on Python floats
+    # as apply_correction_df gave them
+    magnr, magpsf, sigmagnr, sigmapsf, isdiffpos = map(float, (magnr, magpsf, sigmagnr, sigmapsf, isdiffpos))
+    if magnr < 0 or magpsf < 0:
+        return TRIPLE_NAN
+    aux1 = 10**(-0.4 * magnr)
+    aux2 = 10**(-0.4 * magpsf)
+    aux3 = aux1 + isdiffpos * aux2
+    if aux3 > 0:
+        magpsf_corr = -2.5 * np.log10(aux3)
+        aux4 = aux2**2 * sigmapsf**2 - aux1**2 * sigmagnr**2
+        sigmapsf_corr = np.sqrt(aux4) / aux3 if aux4 >= 0 else ZERO_MAG
+        sigmapsf_corr_ext = aux2 * sigmapsf / aux3
+        return magpsf_corr, sigmapsf_corr, sigmapsf_corr_ext
+    return ZERO_MAG, ZERO_MAG, ZERO_MAG
+
+
 class TestZTF18aazxcwf(unittest.TestCase):
     def setUp(self) -> None:
         self.oid = "ZTF18aazxcwf"
@@ -51,6 +70,110 @@ class TestDataframeCorrection(unittest.TestCase):
     def setUp(self) -> None:
         self.data = pd.read_csv(os.path.join(CSV_PATH, "raw_detections.csv"))
 
+    def test_correction_vectorized_parity(self):
+        data = self.data.copy()
+        data["isdiffpos"] = data["isdiffpos"].map({'t': 1., 'f': -1., '1': 1., '0': -1.})
+        expected = np.array([baseline_correction(x.magnr, x.magpsf, x.sigmagnr, x.sigmapsf, x.isdiffpos)
+                             for x in data.itertuples()])
+        scalar = np.array([correction(x.magnr, x.magpsf, x.sigmagnr, x.sigmapsf, x.isdiffpos)
+                           for x in data.itertuples()])
+        result = correction_vectorized(data.magnr.values, data.magpsf.values, data.sigmagnr.values,
+                                       data.sigmapsf.values, data.isdiffpos.values)
+        np.testing.assert_array_equal(scalar, expected)
+        for i in range(3):
+            np.testing.assert_array_equal(result[i], expected[:, i])
+
+    def test_correction_nonfinite_parity(self):
+        # magnr, sigmagnr, sigmapsf or isdiffpos NaN, infinite magnr and magpsf
+        magnr = np.array([np.nan, 15., 15., 15., np.inf, 15., -np.inf])
+        magpsf = np.array([17., 17., 17., 17., 17., np.inf, 17.])
+        sigmagnr = np.array([0.01, np.nan, 0.01, 0.01, 0.01, 0.01, 0.01])
+        sigmapsf = np.array([0.1, 0.1, np.nan, 0.1, 0.1, 0.1, 0.1])
+        isdiffpos = np.array([1., 1., 1., np.nan, 1., 1., 1.])
+        expected = np.array([baseline_correction(*args) for args in zip(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)])
+        scalar = np.array([correction(*args) for args in zip(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)])
+        *result, status = correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+        np.testing.assert_array_equal(scalar, expected)
+        np.testing.assert_array_equal(np.column_stack(result), expected)
+        np.testing.assert_array_equal(expected[0], [ZERO_MAG, ZERO_MAG, ZERO_MAG])
+        np.testing.assert_array_equal(expected[3], [ZERO_MAG, ZERO_MAG, ZERO_MAG])
+        self.assertTrue(np.isfinite(expected[4]).all())
+        np.testing.assert_array_equal(status[:6], STATUS_NONFINITE)
+        np.testing.assert_array_equal(status[6], STATUS_NEGATIVE_MAG)
+
+        candidate = {"magnr": 15., "magpsf": 17., "sigmagnr": 0.01, "sigmapsf": 0.1, "isdiffpos": "x"}
+        self.assertEqual(apply_correction(candidate), baseline_correction(15., 17., 0.01, 0.1, -1))
+
+    def test_correction_vectorized_branches(self):
+        magnr = np.array([-1., 15., 15., 15.])
+        magpsf = np.array([17., 15., 17., 15.])
+        sigmagnr = np.array([0.01, 0.01, 10., 0.01])
+        sigmapsf = np.array([0.1, 0.1, 0.1, 0.1])
+        isdiffpos = np.array([1., -1., 1., 1.])
+        result = correction_vectorized(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+        expected = [baseline_correction(*args) for args in zip(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)]
+        np.testing.assert_array_equal(np.column_stack(result), np.array(expected))
+        self.assertTrue(np.isnan(result[0][0]))
+        self.assertEqual(result[0][1], ZERO_MAG)
+        self.assertEqual(result[1][2], ZERO_MAG)
+
+    def test_correction_kernel_status(self):
+        magnr = np.array([15., -1., 15., 15., np.nan, 15.])
+        magpsf = np.array([17., 17., 15., 17., 17., np.inf])
+        sigmagnr = np.array([0.01, 0.01, 0.01, 10., 0.01, 0.01])
+        sigmapsf = np.array([0.1, 0.1, 0.1, 0.1, 0.1, 0.1])
+        isdiffpos = np.array([1., 1., -1., 1., 1., 1.])
+        *result, status = correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+        np.testing.assert_array_equal(status, [STATUS_OK, STATUS_NEGATIVE_MAG, STATUS_NONPOSITIVE_FLUX,
+                                               STATUS_NEGATIVE_VARIANCE, STATUS_NONFINITE, STATUS_NONFINITE])
+        np.testing.assert_array_equal(correction_status(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos), status)
+        expected = [baseline_correction(*args) for args in zip(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)]
+        np.testing.assert_array_equal(np.column_stack(result), np.array(expected))
+
+    def test_flux_correction_kernel(self):
+        magnr = np.array([15., -1., 15., 15., np.nan, 16.])
+        magpsf = np.array([17., 17., 15., 17., 17., 17.])
+        sigmagnr = np.array([0.01, 0.01, 0.01, 10., 0.01, 0.01])
+        sigmapsf = np.array([0.1, 0.1, 0.1, 0.1, 0.1, 0.1])
+        isdiffpos = np.array([1., 1., -1., 1., 1., -1.])
+        flux, error, error_ext, status = flux_correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+        *expected, expected_status = correction_kernel(magnr, magpsf, sigmagnr, sigmapsf, isdiffpos)
+        np.testing.assert_array_equal(status, expected_status)
+        finite = status != STATUS_NONFINITE
+        for result, values in zip(flux_to_magnitude(flux, error, error_ext), expected):
+            np.testing.assert_allclose(result[finite], values[finite], rtol=1e-12)
+        # 1 uJy is 23.9 mag
+        self.assertAlmostEqual(flux[0], 10 ** (-0.4 * (15. - FLUX_ZERO_POINT)) + 10 ** (-0.4 * (17. - FLUX_ZERO_POINT)))
+        self.assertEqual(flux[2], 0.)
+        self.assertTrue(np.isnan(error[3]))
+        self.assertTrue(np.isnan(flux[[1, 4]]).all())
+
+    def test_correct_detections_fluxes(self):
+        data = self.data.copy()
+        data["mjd"] = data.jd - 2400000.5
+        expected = correct_detections(data)
+        result = correct_detections(data, fluxes=True)
+        pd.testing.assert_frame_equal(result.drop(columns=FLUX_COLUMNS), expected)
+        magnitudes = flux_to_magnitude(*[result[name].values for name in FLUX_COLUMNS])
+        for name, values in zip(MAGNITUDE_COLUMNS, magnitudes):
+            np.testing.assert_allclose(values, expected[name].values, rtol=1e-6)
+
+        fluxes = correct_detections(data, fluxes=True, magnitudes=False)
+        self.assertFalse(set(MAGNITUDE_COLUMNS) & set(fluxes.columns))
+        pd.testing.assert_frame_equal(fluxes, result.drop(columns=MAGNITUDE_COLUMNS))
+        pd.testing.assert_frame_equal(compute_magstats(fluxes), compute_magstats(expected), rtol=1e-6)
+        grouped = data.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True, fluxes=True,
+                                                          magnitudes=False)
+        pd.testing.assert_frame_equal(grouped.sort_index(), fluxes.sort_index(), check_like=True)
+
+    def test_correction_kernel_logging(self):
+        data = self.data.copy()
+        data["mjd"] = data.jd - 2400000.5
+        data.loc[data.distnr < DISTANCE_THRESHOLD, "sigmagnr"] = np.nan
+        with self.assertLogs("lc_correction.compute", level="WARNING") as logs:
+            correct_detections(data)
+        self.assertEqual(len(logs.records), 1)
+
     def test_apply_correction_df_c1(self):
         dflarge = self.data.groupby(["objectId", "fid"]).apply(apply_correction_df ,calculate_dubious=True)
         dubious = dflarge.loc[dflarge.dubious]
@@ -78,6 +201,15 @@ class TestDataframeCorrection(unittest.TestCase):
         self.assertTrue(example["dubious"])
 
 
+    def test_correct_detections(self):
+        data = self.data.copy()
+        data.at[180, "isdiffpos"] = 'f'
+        data.at[150, "distnr"] = 0.1
+        expected = data.copy().groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+        result = correct_detections(data)
+        pd.testing.assert_frame_equal(result, expected)
+
+
 class TestDataframeCorrectionChain(unittest.TestCase):
     def setUp(self) -> None:
         self.detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
@@ -107,6 +239,15 @@ class TestDataframeCorrectionChain(unittest.TestCase):
         self.assertEqual(unique_detections, self.unique_objects)
         self.assertEqual(unique_non_detections, self.unique_objects)
 
+    def test_correction_parity(self):
+        data = self.detections
+        isdiffpos = data["isdiffpos"].map({'t': 1., 'f': -1., '1': 1., '0': -1.}).values
+        expected = np.array([baseline_correction(*args) for args in zip(data.magnr, data.magpsf, data.sigmagnr,
+                                                                        data.sigmapsf, isdiffpos)])
+        result = correction_vectorized(data.magnr.values, data.magpsf.values, data.sigmagnr.values,
+                                       data.sigmapsf.values, isdiffpos)
+        np.testing.assert_array_equal(np.column_stack(result), expected)
+
     def test_apply_correction_df(self):
         corrected = self.detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
         for col in self.corrected_cols:
@@ -114,6 +255,20 @@ class TestDataframeCorrectionChain(unittest.TestCase):
         self.assertEqual(len(corrected.index.levels[0]), self.unique_objects)
         self.assertEqual(corrected.corrected.values.sum(), 1373)
 
+    def test_correct_detections(self):
+        expected = self.detections.copy().groupby(["objectId", "fid"]).apply(apply_correction_df,
+                                                                             calculate_dubious=True)
+        result = correct_detections(self.detections)
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(result.corrected.values.sum(), 1373)
+        # float32 magnitudes give float64 corrected magnitudes, and the magstats of both paths have the same dtypes
+        self.assertEqual(self.detections.magpsf.dtype, np.float32)
+        for col in MAGNITUDE_COLUMNS:
+            self.assertEqual(result[col].dtype, np.float64)
+        corrected = result.reset_index()
+        pd.testing.assert_frame_equal(compute_magstats(corrected, flags=True),
+                                      corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats, flags=True))
+
     def test_apply_mag_stats(self):
         magstats = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats)
         self.assertEqual(len(magstats.index.levels[0]), 10)
@@ -121,6 +276,45 @@ class TestDataframeCorrectionChain(unittest.TestCase):
         for col in self.magstats_cols:
             self.assertIn(col, magstats.columns)
 
+    def test_compute_magstats(self):
+        expected = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats, flags=True)
+        result = compute_magstats(self.corrected, flags=True)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_compute_magstats_overrides(self):
+        oid = self.corrected.objectId.iloc[0]
+        sgscore1 = pd.Series({oid: 0.9})
+        result = compute_magstats(self.corrected, sgscore1=sgscore1, distnr=0.5)
+        expected = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats, distnr=0.5)
+        expected_oid = self.corrected[self.corrected.objectId == oid].groupby(["objectId", "fid"]).apply(
+            apply_mag_stats, sgscore1=0.9, distnr=0.5)
+        expected.loc[expected_oid.index] = expected_oid
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_compute_magstats_thresholds(self):
+        thresholds = StellarThresholds(distance=0.5, score=0.3)
+        expected = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats, thresholds=thresholds)
+        result = compute_magstats(self.corrected, thresholds=thresholds)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_stellar_columns(self):
+        result = compute_magstats(self.corrected)
+        first = self.corrected.sort_values("mjd").groupby(["objectId", "fid"]).first()
+        stellarPS1 = first.sgscore1 > SCORE_THRESHOLD
+        stellarZTF = (first.chinr < CHINR_THRESHOLD) & (SHARPNR_MIN < first.sharpnr) & (first.sharpnr < SHARPNR_MAX)
+        pd.testing.assert_series_equal(result.stellarPS1, stellarPS1, check_names=False)
+        pd.testing.assert_series_equal(result.stellarZTF, stellarZTF, check_names=False)
+
+    def test_classify_stellar_df(self):
+        profiles = {"default": DEFAULT_THRESHOLDS, "strict": StellarThresholds(distance=0.5, score=0.9)}
+        first = get_ps1_ztf(self.corrected, columns=STELLAR_COLUMNS)
+        flags = classify_stellar_df(first, profiles)
+        names = ["nearZTF", "nearPS1", "stellarZTF", "stellarPS1", "stellar"]
+        for profile, thresholds in profiles.items():
+            expected = compute_magstats(self.corrected, thresholds=thresholds)[names]
+            pd.testing.assert_frame_equal(flags[profile], expected, check_names=False)
+        pd.testing.assert_frame_equal(classify_stellar_df(first), flags["default"])
+
     def test_apply_object_stats(self):
         objstats = apply_object_stats_df(self.corrected, self.magstats)
         self.assertEqual(len(objstats), 10)
@@ -128,8 +322,46 @@ class TestDataframeCorrectionChain(unittest.TestCase):
             self.assertIn(col, objstats.columns)
         self.assertEqual(objstats.ndubious.sum(), 4)
 
+    def test_compute_object_stats(self):
+        for flags in [False, True]:
+            expected = apply_object_stats_df(self.corrected.copy(), self.magstats.copy(), flags=flags)
+            result = compute_object_stats(self.corrected, self.magstats, flags=flags)
+            pd.testing.assert_frame_equal(result, expected)
+
+    def test_compute_object_stats_missing_band(self):
+        # an object without r band and an object without magnitude statistics
+        oids = self.magstats.objectId.unique()
+        magstats = self.magstats[~((self.magstats.objectId == oids[0]) & (self.magstats.fid == 2)) &
+                                 (self.magstats.objectId != oids[1])]
+        expected = apply_object_stats_df(self.corrected.copy(), magstats.copy(), step_name="test")
+        result = compute_object_stats(self.corrected.set_index(["objectId", "fid"]), magstats, step_name="test")
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertTrue(np.isnan(result.loc[oids[0], "g-r_mean"]))
+        self.assertTrue(np.isnan(result.loc[oids[1], "ndet"]))
+
     def test_apply_do_dmdt_df(self):
         dmdt = do_dmdt_df(self.magstats, self.non_detections)
         self.assertEqual(len(dmdt.index.levels[0]), 10)
         self.assertEqual(len(dmdt), 16)
         self.assertEqual(dmdt.close_nondet.sum(), 1)
+
+    def test_compute_dmdt(self):
+        expected = do_dmdt_df(self.magstats.copy(), self.non_detections.copy())
+        result = compute_dmdt(self.magstats, self.non_detections)
+        pd.testing.assert_frame_equal(result, expected)
+        shuffled = self.non_detections.sample(frac=1, random_state=0)
+        pd.testing.assert_frame_equal(compute_dmdt(self.magstats, shuffled), expected)
+
+    def test_compute_dmdt_dtypes(self):
+        # float32 and float64 magnitude statistics and diffmaglim, one object at a time or all of them
+        magstats = compute_magstats(correct_detections(self.detections).reset_index()).reset_index()
+        non_detections = self.non_detections.astype({"diffmaglim": np.float64})
+        for stats in [self.magstats, magstats]:
+            for non_dets in [self.non_detections, non_detections]:
+                for oid in [None] + list(stats.objectId.unique()):
+                    subset = stats if oid is None else stats[stats.objectId == oid]
+                    nd_subset = non_dets if oid is None else non_dets[non_dets.objectId == oid]
+                    expected = do_dmdt_df(subset.copy(), nd_subset.copy())
+                    result = compute_dmdt(subset, nd_subset)
+                    self.assertEqual(result.dtypes.to_dict(), expected.dtypes.to_dict())
+                    pd.testing.assert_frame_equal(result, expected, check_exact=True)
@@ -24,6 +24,21 @@ class TestHelpersCorrectionChain(unittest.TestCase):
     def test_get_ps1_ztf(self):
         result = get_ps1_ztf(self.detections)
         self.assertEqual(len(result), 16)
+        self.assertEqual(list(result.columns), ["objectId", "fid"] + COL_PS1_ZTF)
+        first = self.detections.groupby(["objectId", "fid"]).apply(
+            lambda x: x[x.mjd == x.mjd.min()][COL_PS1_ZTF].iloc[0]).reset_index()
+        pd.testing.assert_frame_equal(result, first, check_dtype=False)
+
+    def test_get_ps1_ztf_ties(self):
+        detections = self.detections.copy()
+        first = detections.sort_values("mjd").groupby(["objectId", "fid"]).head(1)
+        tie = first.index[0]
+        duplicate = detections.loc[[tie]].assign(candid=1, sgscore1=0.5)
+        detections = pd.concat([duplicate, detections])
+        result = get_ps1_ztf(detections, columns=["candid", "sgscore1"])
+        self.assertEqual(list(result.columns), ["objectId", "fid", "candid", "sgscore1"])
+        row = result[(result.objectId == first.loc[tie, "objectId"]) & (result.fid == first.loc[tie, "fid"])]
+        self.assertEqual(row.candid.iloc[0], 1)
 
     def test_helpers_clean_corrected(self):
         corrected = self.detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
@@ -0,0 +1,215 @@
+import json
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.incremental import *
+
+from .test_correction import get_avros
+
+
+def avro_detections(oid):
+    candidates = [avro["candidate"] for avro in get_avros(oid)]
+    detections = pd.DataFrame(candidates)
+    detections["objectId"] = oid
+    detections["mjd"] = detections.jd - 2400000.5
+    return candidates, detections
+
+
+class TestIncrementalMagStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = "ZTF18aazxcwf"
+        self.candidates, self.detections = avro_detections(self.oid)
+        corrected = self.detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+        self.magstats = corrected.reset_index().groupby(["objectId", "fid"]).apply(apply_mag_stats, flags=True)
+
+    def assertSeriesEqual(self, result, expected):
+        self.assertEqual(list(result.index), list(expected.index))
+        for key in expected.index:
+            if isinstance(expected[key], (bool, np.bool_)):
+                self.assertEqual(bool(result[key]), bool(expected[key]), key)
+            else:
+                np.testing.assert_allclose(float(result[key]), float(expected[key]), rtol=1e-10, err_msg=key)
+
+    def get_stats(self, candidates):
+        stats = {}
+        for candidate in candidates:
+            stats.setdefault(candidate["fid"], IncrementalMagStats()).update(candidate)
+        return stats
+
+    def test_update(self):
+        stats = self.get_stats(self.candidates)
+        for fid, fid_stats in stats.items():
+            self.assertSeriesEqual(fid_stats.to_series(flags=True), self.magstats.loc[(self.oid, fid)])
+
+    def test_update_out_of_order(self):
+        stats = self.get_stats(self.candidates[::-1])
+        for fid, fid_stats in stats.items():
+            self.assertSeriesEqual(fid_stats.to_series(flags=True), self.magstats.loc[(self.oid, fid)])
+
+    def test_dubious_lowest_candid(self):
+        # the detection with the lowest mjd is corrected, the one with the lowest candid is not
+        candidates = sorted([dict(c) for c in self.candidates if c["fid"] == 1], key=lambda c: c["jd"])
+        candids = sorted(c["candid"] for c in candidates)
+        candidates[0]["distnr"], candidates[0]["candid"] = 0.5, candids[-1]
+        candidates[-1]["distnr"], candidates[-1]["candid"] = 5., candids[0]
+        detections = pd.DataFrame(candidates)
+        detections["objectId"] = self.oid
+        detections["mjd"] = detections.jd - 2400000.5
+        corrected = detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+        expected = corrected.reset_index().groupby(["objectId", "fid"]).apply(apply_mag_stats, flags=True)
+        expected = expected.loc[(self.oid, 1)]
+
+        for order in [candidates, candidates[::-1]]:
+            stats = self.get_stats(order)[1]
+            self.assertNotEqual(stats.ndubious_corrected, stats.ndubious_uncorrected)
+            self.assertSeriesEqual(stats.to_series(flags=True), expected)
+            restored = IncrementalMagStats.from_dict(json.loads(json.dumps(stats.to_dict())))
+            self.assertSeriesEqual(restored.to_series(flags=True), expected)
+        half = len(candidates) // 2
+        for parts in [(detections[:half], detections[half:]), (detections[half:], detections[:half])]:
+            stats = merge(*[IncrementalMagStats.from_frame(part) for part in parts])
+            self.assertSeriesEqual(stats.finalize(flags=True), expected)
+
+    def test_serialization(self):
+        half = len(self.candidates) // 2
+        stats = self.get_stats(self.candidates[:half])
+        for candidate in self.candidates[half:]:
+            state = json.loads(json.dumps(stats[candidate["fid"]].to_dict()))
+            stats[candidate["fid"]] = IncrementalMagStats.from_dict(state)
+            stats[candidate["fid"]].update(candidate)
+        for fid, fid_stats in stats.items():
+            self.assertSeriesEqual(fid_stats.to_series(flags=True), self.magstats.loc[(self.oid, fid)])
+
+
+def avro_non_detections(oid):
+    non_detections = {}
+    for avro in get_avros(oid):
+        for prv in avro["prv_candidates"] or []:
+            if prv["candid"] is None:
+                non_detections[(prv["fid"], prv["jd"])] = prv
+    non_detections = list(non_detections.values())
+    frame = pd.DataFrame(non_detections)[["fid", "jd", "diffmaglim"]]
+    frame["objectId"] = oid
+    frame["mjd"] = frame.jd - 2400000.5
+    return non_detections, frame
+
+
+class TestIncrementalObjectStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = "ZTF20aaelulu"
+        self.candidates, detections = avro_detections(self.oid)
+        self.non_detections, self.non_detections_df = avro_non_detections(self.oid)
+        corrected = detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+        self.corrected = corrected.reset_index()
+        self.magstats = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats).reset_index()
+
+    def assertSeriesEqual(self, result, expected):
+        self.assertEqual(list(result.index), list(expected.index))
+        for key in expected.index:
+            if isinstance(expected[key], (str, bool, np.bool_)):
+                self.assertEqual(result[key], expected[key], key)
+            else:
+                np.testing.assert_allclose(float(result[key]), float(expected[key]), rtol=1e-6, err_msg=key)
+
+    def test_object_stats(self):
+        expected = apply_object_stats_df(self.corrected, self.magstats.copy(), flags=True).loc[self.oid]
+        stats = IncrementalObjectStats()
+        magstats = {}
+        for candidate in self.candidates:
+            stats.update(candidate)
+            magstats.setdefault(candidate["fid"], IncrementalMagStats()).update(candidate)
+        self.assertSeriesEqual(stats.to_series(magstats=magstats, flags=True), expected)
+        state = json.loads(json.dumps(stats.to_dict()))
+        restored = IncrementalObjectStats.from_dict(state)
+        self.assertSeriesEqual(restored.to_series(magstats=magstats, flags=True), expected)
+
+    def test_dmdt(self):
+        expected = do_dmdt_df(self.magstats.copy(), self.non_detections_df)
+        for order in [1, -1]:
+            dmdt = {}
+            events = [(True, c) for c in self.candidates] + [(False, nd) for nd in self.non_detections]
+            for is_detection, event in events[::order]:
+                fid_dmdt = dmdt.setdefault(event["fid"], IncrementalDmdt())
+                if is_detection:
+                    fid_dmdt.update_detection(event)
+                else:
+                    fid_dmdt.update_non_detection(event)
+            for fid, fid_dmdt in dmdt.items():
+                restored = IncrementalDmdt.from_dict(json.loads(json.dumps(fid_dmdt.to_dict())))
+                self.assertSeriesEqual(restored.to_series(), expected.loc[(self.oid, fid)])
+
+    def test_dmdt_replayed_alerts(self):
+        expected = do_dmdt_df(self.magstats.copy(), self.non_detections_df)
+        dmdt = {}
+        for candidate in self.candidates:
+            dmdt.setdefault(candidate["fid"], IncrementalDmdt()).update_detection(candidate)
+        sizes = None
+        for _ in range(3):
+            for avro in get_avros(self.oid):
+                for prv in avro["prv_candidates"] or []:
+                    if prv["candid"] is None and prv["fid"] in dmdt:
+                        dmdt[prv["fid"]].update_non_detection(prv)
+            if sizes is not None:
+                self.assertEqual({fid: len(d.non_detections) for fid, d in dmdt.items()}, sizes)
+            sizes = {fid: len(d.non_detections) for fid, d in dmdt.items()}
+        for fid, fid_dmdt in dmdt.items():
+            self.assertSeriesEqual(fid_dmdt.to_series(), expected.loc[(self.oid, fid)])
+            restored = IncrementalDmdt.from_dict(json.loads(json.dumps(fid_dmdt.to_dict())))
+            self.assertEqual(restored.non_detections, fid_dmdt.non_detections)
+            self.assertSeriesEqual(fid_dmdt.merge(restored).to_series(), expected.loc[(self.oid, fid)])
+            self.assertEqual(len(fid_dmdt.merge(restored).non_detections), len(fid_dmdt.non_detections))
+
+
+class TestMergeableStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = "ZTF20aaelulu"
+        _, detections = avro_detections(self.oid)
+        corrected = detections.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+        self.corrected = corrected.reset_index()
+        self.magstats = self.corrected.groupby(["objectId", "fid"]).apply(apply_mag_stats, flags=True)
+        self.objstats = apply_object_stats_df(self.corrected, self.magstats.reset_index(), flags=True)
+        rng = np.random.default_rng(0)
+        self.fragments = np.array_split(self.corrected.iloc[rng.permutation(len(self.corrected))], 4)
+
+    assertSeriesEqual = TestIncrementalObjectStats.assertSeriesEqual
+
+    def test_running_stats(self):
+        values = np.random.default_rng(1).normal(18, 1, 101)
+        values[[3, 40]] = np.nan
+        left, right = RunningStats.from_values(values[:30]), RunningStats.from_values(values[30:])
+        expected = RunningStats()
+        for value in values:
+            expected.update(value)
+        for result in [merge(left, right), merge(right, left), merge(RunningStats(), merge(left, right))]:
+            self.assertEqual(result.count, expected.count)
+            np.testing.assert_allclose([result.get_mean(), result.get_std(), result.get_median()],
+                                       [expected.get_mean(), expected.get_std(), expected.get_median()])
+            self.assertEqual(result.values, expected.values)
+
+    def test_magstats(self):
+        partials = [partial_magstats(fragment) for fragment in self.fragments]
+        for merged in [merge_partials(*partials), merge_partials(*partials[::-1]),
+                       merge_partials(merge_partials(partials[0], partials[1]),
+                                      merge_partials(partials[2], partials[3]))]:
+            self.assertEqual(sorted(merged), sorted(self.magstats.index))
+            for key, stats in merged.items():
+                self.assertSeriesEqual(stats.finalize(flags=True), self.magstats.loc[key])
+
+    def test_magstats_from_detections(self):
+        # without corrected magnitudes, the fragments are corrected as the detections are merged
+        raw = self.corrected.drop(columns=["magpsf_corr", "sigmapsf_corr", "sigmapsf_corr_ext", "corrected",
+                                           "dubious"])
+        merged = merge_partials(*[partial_magstats(fragment) for fragment in np.array_split(raw, 3)])
+        for key, stats in merged.items():
+            self.assertSeriesEqual(stats.finalize(flags=True), self.magstats.loc[key])
+        state = json.loads(json.dumps(next(iter(merged.values())).to_dict()))
+        self.assertIsInstance(IncrementalMagStats.from_dict(state), IncrementalMagStats)
+
+    def test_object_stats(self):
+        partials = [partial_object_stats(fragment) for fragment in self.fragments]
+        magstats = {fid: stats for (_, fid), stats in
+                    merge_partials(*[partial_magstats(fragment) for fragment in self.fragments]).items()}
+        a, b, c, d = [partial[self.oid] for partial in partials]
+        for stats in [merge(merge(merge(a, b), c), d), merge(a, merge(b, merge(c, d))), merge(merge(d, c),
+                                                                                              merge(b, a))]:
+            self.assertSeriesEqual(stats.finalize(magstats=magstats, flags=True), self.objstats.loc[self.oid])
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.instrumentation import *
+
+from .test_correction import CSV_PATH, PARQUET_PATH
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = pd.read_csv(os.path.join(CSV_PATH, "raw_detections.csv"))
+        self.data.loc[:2, "magnr"] = -1.
+        self.data["mjd"] = self.data.jd - 2400000.5
+
+    def tearDown(self) -> None:
+        disable()
+
+    def test_disabled(self):
+        collector = MemoryCollector()
+        correct_detections(self.data)
+        self.assertFalse(enabled())
+        self.assertEqual(collector.records, [])
+
+    def test_memory_collector(self):
+        with instrumented(MemoryCollector(), memory=True) as collector:
+            corrected = correct_detections(self.data)
+            magstats = compute_magstats(corrected)
+        summary = collector.summary()
+        self.assertEqual(list(summary.index), ["correct_detections", "compute_magstats"])
+        self.assertEqual(summary.loc["correct_detections", "rows_in"], len(self.data))
+        self.assertEqual(summary.loc["correct_detections", "rows_out"], len(corrected))
+        self.assertEqual(summary.loc["correct_detections", "groups"], len(magstats))
+        self.assertEqual(summary.loc["compute_magstats", "rows_out"], len(magstats))
+        self.assertTrue((summary.peak_memory > 0).all())
+        self.assertTrue((summary.seconds > 0).all())
+        self.assertEqual(summary.loc["correct_detections", "negative_magnitude"], 3)
+
+    def branches(self, corrected):
+        # the NaN and ZERO_MAG outputs of the corrected detections
+        magpsf_corr = corrected.magpsf_corr[corrected.corrected]
+        sigmapsf_corr = corrected.sigmapsf_corr[corrected.corrected]
+        branches = {"negative_magnitude": magpsf_corr.isna().sum(),
+                    "nonpositive_flux": (magpsf_corr == ZERO_MAG).sum(),
+                    "negative_variance": ((sigmapsf_corr == ZERO_MAG) & (magpsf_corr != ZERO_MAG)).sum()}
+        return {branch: value for branch, value in branches.items() if value > 0}
+
+    def test_branch_counters(self):
+        detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
+        detections["mjd"] = detections.jd - 2400000.5
+        for data in [self.data, detections]:
+            with instrumented(MemoryCollector()) as collector:
+                corrected = correct_detections(data)
+            counters = collector.records[0]["counters"]
+            self.assertEqual({branch: value for branch, value in counters.items() if value > 0},
+                             self.branches(corrected))
+        self.assertEqual(counters.get("nonpositive_flux", 0), 0)
+        self.assertEqual(counters["negative_variance"], 666)
+
+    def test_scalar_counters(self):
+        # one alert at a time, the corrected detections as the batch path counts them
+        data = self.data[self.data.distnr < DISTANCE_THRESHOLD]
+        with instrumented(MemoryCollector()) as collector:
+            for candidate in data.to_dict("records"):
+                apply_correction(candidate)
+        counters = {}
+        for record in collector.records:
+            for branch, value in record["counters"].items():
+                counters[branch] = counters.get(branch, 0) + value
+        self.assertEqual(set(counters), {"negative_magnitude", "nonpositive_flux", "negative_variance"})
+        self.assertEqual(counters, self.branches(correct_detections(self.data)))
+
+    def test_groupby_apply(self):
+        with instrumented(MemoryCollector()) as collector:
+            corrected = self.data.groupby(["objectId", "fid"]).apply(apply_correction_df, calculate_dubious=True)
+            corrected.reset_index().groupby(["objectId", "fid"]).apply(apply_mag_stats)
+        summary = collector.summary()
+        n_groups = self.data.groupby(["objectId", "fid"]).ngroups
+        # pandas calls the first group twice
+        self.assertGreaterEqual(summary.loc["apply_correction_df", "groups"], n_groups)
+        self.assertGreaterEqual(summary.loc["apply_mag_stats", "groups"], n_groups)
+
+    def test_callback(self):
+        records = []
+        with instrumented(CallbackSink(records.append)):
+            correct_detections(self.data)
+        self.assertEqual([record["stage"] for record in records], ["correct_detections"])
+
+    def test_prometheus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lc_correction.prom")
+            with instrumented(PrometheusFileSink(path, interval=3600)):
+                correct_detections(self.data)
+                correct_detections(self.data)
+            with open(path) as f:
+                text = f.read()
+        self.assertIn('lc_correction_stage_calls_total{stage="correct_detections"} 2', text)
+        self.assertIn('lc_correction_branch_total{stage="correct_detections",branch="negative_magnitude"} 6', text)
+        self.assertIn("# TYPE lc_correction_stage_seconds_total counter", text)
@@ -0,0 +1,88 @@
+import os
+import unittest
+
+import pyarrow as pa
+
+from lc_correction.compute import *
+from lc_correction.io import *
+
+from .test_correction import AVRO_PATH, get_avros
+
+
+class TestReadAvroBatches(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = "ZTF20aaelulu"
+        self.path = os.path.join(AVRO_PATH, self.oid)
+        self.avros = get_avros(self.oid)
+        candids = set()
+        non_detections = set()
+        for avro in self.avros:
+            candids.add(avro["candid"])
+            for prv in avro["prv_candidates"] or []:
+                if prv["candid"] is None:
+                    non_detections.add((prv["fid"], prv["jd"]))
+                else:
+                    candids.add(prv["candid"])
+        self.candids = candids
+        self.non_detections = non_detections
+
+    def read(self, **kwargs):
+        batches = list(read_avro_batches(self.path, **kwargs))
+        detections = pa.Table.from_batches([b[0] for b in batches]).to_pandas()
+        non_detections = pa.Table.from_batches([b[1] for b in batches]).to_pandas()
+        return batches, detections, non_detections
+
+    def test_read_alerts(self):
+        alerts = list(read_alerts(self.path))
+        self.assertEqual(len(alerts), len(self.avros))
+
+    def test_read_avro_batches(self):
+        batches, detections, non_detections = self.read()
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(list(detections.columns), COL_DETECTIONS)
+        self.assertEqual(list(non_detections.columns), COL_NON_DETECTIONS)
+        self.assertEqual(set(detections.candid), self.candids)
+        self.assertEqual(len(detections), len(self.candids))
+        self.assertEqual(len(non_detections), len(self.non_detections))
+        self.assertEqual((detections.parent_candid == 0).sum(), len(self.avros))
+        self.assertTrue((detections.objectId == self.oid).all())
+
+    def test_batch_size(self):
+        batches, detections, non_detections = self.read(batch_size=10, columns=["objectId", "candid", "mjd"])
+        self.assertGreater(len(batches), 1)
+        for batch_detections, batch_non_detections in batches:
+            self.assertLessEqual(batch_detections.num_rows, 10)
+            self.assertLessEqual(batch_non_detections.num_rows, 10)
+        self.assertEqual(list(detections.columns), ["objectId", "candid", "mjd"])
+        self.assertEqual(set(detections.candid), self.candids)
+
+    def test_out_of_order(self):
+        # newest alerts first: their previous candidates come before the candidates of the older alerts
+        paths = sorted(os.path.join(self.path, name) for name in os.listdir(self.path))[::-1]
+        alert_candids = {avro["candid"] for avro in self.avros}
+        for batch_size in [100000, 10]:
+            batches = list(read_avro_batches(paths, batch_size=batch_size))
+            detections = pa.Table.from_batches([b[0] for b in batches]).to_pandas()
+            self.assertEqual(set(detections.candid), self.candids)
+            alerts = detections[detections.parent_candid == 0]
+            self.assertEqual(set(alerts.candid), alert_candids)
+            self.assertEqual(len(alerts), len(alert_candids))
+            self.assertTrue(alerts.magnr.notna().any())
+            if batch_size == 100000:
+                self.assertEqual(len(detections), len(self.candids))
+
+    def test_max_seen(self):
+        batches, detections, non_detections = self.read(max_seen=2)
+        # older duplicates are read again, but nothing is lost
+        self.assertEqual(set(detections.candid), self.candids)
+        self.assertEqual(set(zip(non_detections.fid, non_detections.mjd + 2400000.5)), self.non_detections)
+        self.assertGreater(len(non_detections), len(self.non_detections))
+
+    def test_correction_chain(self):
+        _, detections, non_detections = self.read()
+        corrected = correct_detections(detections)
+        magstats = compute_magstats(corrected)
+        dmdt = compute_dmdt(magstats, non_detections)
+        self.assertEqual(len(corrected), len(self.candids))
+        self.assertEqual(len(magstats), 2)
+        self.assertEqual(len(dmdt), 2)
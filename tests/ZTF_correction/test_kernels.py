@@ -0,0 +1,71 @@
+import dataclasses
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import lc_correction
+from lc_correction import compute, kernels
+from lc_correction.reference import Reference, ReferenceCache, correct_candidate
+
+
+class TestKernels(unittest.TestCase):
+    def test_light_import(self):
+        code = "import sys, lc_correction.kernels; print(sorted({'pandas', 'pyarrow'} & set(sys.modules)))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_import_without_pyarrow(self):
+        # pandas imports pyarrow when it is installed, so it is blocked to check that compute does not need it
+        code = "import sys; sys.modules['pyarrow'] = None; import lc_correction.compute, lc_correction.helpers"
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_compute_exports(self):
+        for name in ["DISTANCE_THRESHOLD", "STATUS_NAMES", "correction", "correction_kernel", "near_stellar",
+                     "is_dubious"]:
+            self.assertIs(getattr(compute, name), getattr(kernels, name))
+
+    def test_lazy_attributes(self):
+        self.assertEqual(lc_correction.__version__, "1.0.0")
+        self.assertIs(lc_correction.correction, kernels.correction)
+        self.assertIs(lc_correction.correct_detections, compute.correct_detections)
+        self.assertIn("compute_magstats", dir(lc_correction))
+        with self.assertRaises(AttributeError):
+            lc_correction.missing
+
+    def test_classify_stellar(self):
+        rng = np.random.default_rng(0)
+        n = 200
+        inputs = [rng.uniform(-1, 3, n), rng.uniform(-1, 3, n), rng.uniform(0, 1, n), rng.uniform(0, 5, n),
+                  rng.uniform(-0.5, 0.5, n)]
+        profiles = [kernels.DEFAULT_THRESHOLDS, kernels.StellarThresholds(distance=1., score=0.8, sharpnr_min=-0.2)]
+        flags = kernels.classify_stellar(*inputs, thresholds=profiles)
+        self.assertEqual(flags["stellar"].shape, (2, n))
+        for p, thresholds in enumerate(profiles):
+            for i in range(n):
+                expected = kernels.near_stellar(*[values[i] for values in inputs], thresholds=thresholds)
+                for name, value in zip(["nearZTF", "nearPS1", "stellarPS1", "stellarZTF"], expected):
+                    self.assertEqual(flags[name][p, i], value)
+                self.assertEqual(flags["stellar"][p, i], kernels.is_stellar(*expected))
+        single = kernels.classify_stellar(*inputs)
+        np.testing.assert_array_equal(single["stellar"], flags["stellar"][0])
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            kernels.DEFAULT_THRESHOLDS.score = 0.
+
+    def test_squared(self):
+        # values where NumPy's x * x and Python's x**2 differ in the last bit
+        values = 10 ** (-0.4 * np.random.default_rng(0).uniform(5, 25, 100000))
+        expected = np.array([value ** 2 for value in values.tolist()])
+        self.assertTrue(np.any(values * values != expected))
+        np.testing.assert_array_equal(kernels._squared(values), expected)
+
+    def test_scalar_paths(self):
+        # one alert is corrected with scalar Python, the array kernels are for the batch paths
+        candidate = {"objectId": "a", "fid": 1, "rfid": 1, "magnr": 15., "sigmagnr": 0.01, "distnr": 0.5,
+                     "magpsf": 17., "sigmapsf": 0.1, "isdiffpos": "t", "mjd": 58000.}
+        with mock.patch.object(kernels, "_corrected_fluxes", side_effect=AssertionError("array kernel")):
+            expected = kernels.correction(15., 17., 0.01, 0.1, 1)
+            self.assertEqual(Reference(15., 0.01, 0.5).correction(17., 0.1, 1), expected)
+            self.assertEqual(correct_candidate(candidate, ReferenceCache())[0], expected)
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lc_correction.keys import *
+
+
+class TestKeys(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = pd.Series(["ZTF20b", "ZTF19a", "ZTF20b", "ZTF19a", "ZTF21c"])
+        self.fid = np.array([1, 2, 3, 1, 2])
+        self.mjd = np.array([3., 2., 1., 1., 5.])
+
+    def test_encode_objects(self):
+        codes, objects = encode_objects(self.oid)
+        np.testing.assert_array_equal(codes, [1, 0, 1, 0, 2])
+        self.assertEqual(list(objects), ["ZTF19a", "ZTF20b", "ZTF21c"])
+        codes, _ = encode_objects(pd.Series(["ZTF21c", "ZTF00x"]), categories=objects)
+        np.testing.assert_array_equal(codes, [2, -1])
+
+    def test_encode_categorical(self):
+        expected, _ = encode_objects(self.oid)
+        codes, objects = encode_objects(self.oid.astype("category"))
+        np.testing.assert_array_equal(codes, expected)
+        unsorted = self.oid.astype(pd.CategoricalDtype(["ZTF21c", "ZTF20b", "ZTF19a"]))
+        codes, objects = encode_objects(unsorted)
+        np.testing.assert_array_equal(codes, expected)
+
+    def test_sort_groups(self):
+        order, key = sort_groups(self.oid, self.fid, self.mjd)
+        expected = pd.DataFrame({"objectId": self.oid, "fid": self.fid, "mjd": self.mjd}).sort_values(
+            ["objectId", "fid", "mjd"], kind="mergesort").index.values
+        np.testing.assert_array_equal(order, expected)
+        self.assertEqual(len(np.unique(key)), 5)
+        self.assertTrue((np.diff(key[order]) >= 0).all())
@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.pipeline import *
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+class TestRunBulk(unittest.TestCase):
+    def setUp(self) -> None:
+        self.detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
+        self.non_detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_non_detections.parquet"))
+        self.detections["mjd"] = self.detections.jd - 2400000.5
+        del self.detections["jd"]
+        self.non_detections["mjd"] = self.non_detections.jd - 2400000.5
+        del self.non_detections["jd"]
+
+    def test_run_stages(self):
+        results = run_stages(self.detections, self.non_detections)
+        self.assertEqual(list(results), STAGES)
+        self.assertEqual(len(results["corrected"]), 1381)
+        self.assertEqual(len(results["magstats"]), 16)
+        self.assertEqual(len(results["objstats"]), 10)
+        self.assertEqual(len(results["dmdt"]), 16)
+
+    def test_hash_partition(self):
+        shards = hash_partition(self.detections.objectId, 3)
+        self.assertTrue(((shards >= 0) & (shards < 3)).all())
+        by_object = pd.Series(shards).groupby(self.detections.objectId.values).nunique()
+        self.assertTrue((by_object == 1).all())
+
+    def test_run_bulk(self):
+        expected = run_stages(self.detections, self.non_detections, flags=True)
+        results = run_bulk(self.detections, self.non_detections, n_jobs=2, n_shards=3, flags=True)
+        for stage in STAGES:
+            pd.testing.assert_frame_equal(results[stage], expected[stage])
+
+    def test_run_bulk_empty(self):
+        detections, non_detections = self.detections.iloc[:0], self.non_detections.iloc[:0]
+        expected = run_stages(detections, non_detections)
+        results = run_bulk(detections, non_detections, n_jobs=2, n_shards=3)
+        for stage in STAGES:
+            self.assertEqual(len(results[stage]), 0)
+            self.assertEqual(list(results[stage].columns), list(expected[stage].columns))
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.incremental import IncrementalMagStats, IncrementalObjectStats
+from lc_correction.reference import *
+from lc_correction.stream import StreamCorrector
+
+from .test_correction import CSV_PATH
+
+
+class TestReferenceCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.candidates = pd.read_csv(os.path.join(CSV_PATH, "raw_detections.csv")).to_dict("records")
+
+    def assertMagnitudesEqual(self, result, expected):
+        np.testing.assert_array_equal(np.array(result, dtype=float), np.array(expected, dtype=float))
+
+    def test_correct_candidate(self):
+        cache = ReferenceCache()
+        for candidate in self.candidates:
+            magnitudes, reference = correct_candidate(candidate, cache)
+            expected = apply_correction(candidate) if candidate["distnr"] < DISTANCE_THRESHOLD else TRIPLE_NAN
+            self.assertMagnitudesEqual(magnitudes, expected)
+        keys = {(c["objectId"], c["fid"], c["rfid"]) for c in self.candidates}
+        stats = cache.stats()
+        self.assertEqual(stats["size"], len(keys))
+        self.assertEqual(stats["hits"] + stats["misses"], len(self.candidates))
+        self.assertEqual(stats["misses"], len(keys) + stats["mismatches"])
+
+    def test_reference_correction(self):
+        reference = Reference(15., 0.01, 0.5)
+        for args in [(17., 0.1, 1), (15., 0.1, -1), (17., 10., 1), (-1., 0.1, 1), (np.nan, 0.1, 1)]:
+            self.assertMagnitudesEqual(reference.correction(*args), correction(15., args[0], 0.01, args[1], args[2]))
+        reference = Reference(np.nan, 0.01, 0.5)
+        self.assertMagnitudesEqual(reference.correction(17., 0.1, 1), correction(np.nan, 17., 0.01, 0.1, 1))
+
+    def test_unknown_isdiffpos(self):
+        # the batch, reference, stream and incremental paths agree on an unknown isdiffpos
+        oid, fid = self.candidates[0]["objectId"], self.candidates[0]["fid"]
+        candidates = [dict(c) for c in self.candidates if c["objectId"] == oid and c["fid"] == fid]
+        candidates[0]["distnr"], candidates[0]["isdiffpos"] = 0.5, "x"
+        detections = pd.DataFrame(candidates)
+        detections["mjd"] = detections.jd - 2400000.5
+        corrected = correct_detections(detections).reset_index()
+        expected = corrected[MAGNITUDE_COLUMNS].values
+        self.assertEqual(expected[0, 0], ZERO_MAG)
+
+        cache = ReferenceCache()
+        self.assertMagnitudesEqual([correct_candidate(c, cache)[0] for c in candidates], expected)
+        results = StreamCorrector().process([{"objectId": oid, "candidate": c} for c in candidates])
+        self.assertMagnitudesEqual([[r[name] for name in MAGNITUDE_COLUMNS] for r in results], expected)
+
+        stats, objstats = IncrementalMagStats(), IncrementalObjectStats()
+        for candidate in candidates:
+            stats.update(dict(candidate, mjd=candidate["jd"] - 2400000.5))
+            objstats.update(dict(candidate, mjd=candidate["jd"] - 2400000.5))
+        magstats = compute_magstats(corrected, flags=True).loc[(oid, fid)]
+        self.assertEqual(stats.ndubious, magstats["ndubious"])
+        np.testing.assert_allclose(stats.to_series(flags=True)[magstats.index].astype(float), magstats.astype(float))
+        self.assertEqual(objstats.min_isdiffpos, corrected.isdiffpos.min())
+
+    def test_incremental(self):
+        cache = ReferenceCache()
+        expected, result = {}, {}
+        for candidate in self.candidates:
+            key = (candidate["objectId"], candidate["fid"])
+            expected.setdefault(key, IncrementalMagStats()).update(candidate)
+            magnitudes, _ = correct_candidate(candidate, cache)
+            result.setdefault(key, IncrementalMagStats()).update(candidate, corrected_magnitudes=magnitudes)
+        for key in expected:
+            pd.testing.assert_series_equal(result[key].to_series(flags=True), expected[key].to_series(flags=True))
+
+    def test_lru(self):
+        cache = ReferenceCache(max_size=2)
+        for oid in ["a", "b", "a", "c"]:
+            cache.lookup({"objectId": oid, "fid": 1, "rfid": 1, "magnr": 15., "sigmagnr": 0.01, "distnr": 0.5,
+                          "mjd": 59000.})
+        self.assertIn(("a", 1, 1), cache)
+        self.assertNotIn(("b", 1, 1), cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_reference_change(self):
+        cache = ReferenceCache()
+        candidate = {"objectId": "a", "fid": 1, "rfid": 1, "magnr": 15., "sigmagnr": 0.01, "distnr": 0.5,
+                     "mjd": 59000.}
+        self.assertFalse(cache.lookup(candidate)[1])
+        self.assertTrue(cache.lookup(dict(candidate, mjd=58000.))[1])
+        self.assertEqual(cache.get(("a", 1, 1)).first["mjd"], 58000.)
+        self.assertFalse(cache.lookup(dict(candidate, rfid=2))[1])
+        self.assertFalse(cache.lookup(dict(candidate, magnr=16.))[1])
+        self.assertEqual(cache.mismatches, 1)
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "references")
+            with ReferenceCache(max_size=1, path=path) as cache:
+                for candidate in self.candidates:
+                    correct_candidate(candidate, cache)
+            with ReferenceCache(max_size=1, path=path) as cache:
+                for candidate in self.candidates:
+                    magnitudes, _ = correct_candidate(candidate, cache)
+                    expected = apply_correction(candidate) if candidate["distnr"] < DISTANCE_THRESHOLD \
+                        else TRIPLE_NAN
+                    self.assertMagnitudesEqual(magnitudes, expected)
+                self.assertEqual(cache.misses, cache.mismatches)
+                self.assertGreater(cache.store_hits, 0)
@@ -0,0 +1,68 @@
+import os
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.pipeline import STAGES, run_stages
+from lc_correction.schema import *
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self) -> None:
+        self.detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
+        self.non_detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_non_detections.parquet"))
+        self.detections["mjd"] = self.detections.jd - 2400000.5
+        self.non_detections["mjd"] = self.non_detections.jd - 2400000.5
+
+    def test_coerce_schema(self):
+        detections = coerce_schema(self.detections)
+        self.assertIsInstance(detections.objectId.dtype, pd.CategoricalDtype)
+        self.assertEqual(detections.isdiffpos.dtype, np.int8)
+        self.assertEqual(detections.fid.dtype, np.int8)
+        self.assertEqual(detections.candid.dtype, np.int64)
+        self.assertEqual(detections.magpsf.dtype, np.float32)
+        self.assertEqual(detections.mjd.dtype, np.float64)
+        self.assertTrue(set(detections.isdiffpos.unique()) <= {-1, 1})
+        self.assertLess(detections.memory_usage(deep=True).sum(), self.detections.memory_usage(deep=True).sum())
+        # columns out of the schema are kept
+        self.assertEqual(detections.pdiffimfilename.dtype, object)
+
+    def test_coerce_schema_unknown_isdiffpos(self):
+        detections = self.detections.copy()
+        detections.loc[0, "isdiffpos"] = "x"
+        with self.assertRaises(ValueError):
+            coerce_schema(detections)
+
+    def test_coerce_schema_nulls(self):
+        detections = self.detections.copy()
+        detections["rfid"] = detections.rfid.astype(float)
+        detections.loc[0, "rfid"] = np.nan
+        detections = coerce_schema(detections)
+        self.assertEqual(detections.rfid.dtype, np.float64)
+
+    def test_dtype_stable(self):
+        detections = coerce_schema(self.detections)
+        non_detections = coerce_schema(self.non_detections, NON_DETECTIONS_SCHEMA)
+        corrected = correct_detections(detections)
+        self.assertEqual(corrected.isdiffpos.dtype, np.int8)
+        # corrected magnitudes are float64 unless they are coerced
+        self.assertEqual(corrected.magpsf_corr.dtype, np.float64)
+        self.assertEqual(corrected.sigmapsf_corr_ext.dtype, np.float64)
+        self.assertEqual(coerce_schema(corrected).magpsf_corr.dtype, np.float32)
+        self.assertEqual(corrected.corrected.dtype, bool)
+        self.assertEqual(corrected.dubious.dtype, bool)
+
+        legacy = detections.groupby(["objectId", "fid"], observed=True).apply(apply_correction_df,
+                                                                                calculate_dubious=True)
+        self.assertEqual(legacy.isdiffpos.dtype, np.int8)
+        self.assertEqual(legacy.magpsf_corr.dtype, np.float64)
+
+        expected = run_stages(self.detections, self.non_detections)
+        results = run_stages(detections, non_detections)
+        for stage in STAGES:
+            result = results[stage].reset_index()
+            reference = expected[stage].reset_index()
+            self.assertEqual(len(result), len(reference))
+            pd.testing.assert_frame_equal(result, reference, check_dtype=False, check_categorical=False,
+                                          rtol=1e-5)
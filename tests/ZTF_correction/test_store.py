@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from lc_correction.compute import compute_dmdt, compute_magstats, correct_detections
+from lc_correction.store import *
+
+PARQUET_PATH = "data_examples/parquets"
+
+
+class TestLightCurveStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.path = tempfile.mkdtemp()
+        self.detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_detections.parquet"))
+        self.non_detections = pd.read_parquet(os.path.join(PARQUET_PATH, "10_objects_non_detections.parquet"))
+        self.detections["mjd"] = self.detections.jd - 2400000.5
+        self.non_detections["mjd"] = self.non_detections.jd - 2400000.5
+        self.oids = sorted(self.detections.objectId.unique())[:3]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.path)
+
+    def expected(self, df, oids, fids=None):
+        df = df[df.objectId.isin(oids)]
+        if fids is not None:
+            df = df[df.fid.isin(fids)]
+        return df.sort_values(["objectId", "fid", "mjd", "candid"]).reset_index(drop=True)
+
+    def assertLoaded(self, store, oids, fids=None):
+        result = store.load(oids, fids=fids).to_pandas()
+        pd.testing.assert_frame_equal(result[self.detections.columns], self.expected(self.detections, oids, fids))
+
+    def test_append_load(self):
+        store = LightCurveStore(self.path)
+        store.append(self.detections, self.non_detections)
+        self.assertLoaded(store, self.oids)
+        self.assertLoaded(store, self.oids, fids=[2])
+        self.assertEqual(store.load(["ZTF00aaaaaaa"]).num_rows, 0)
+        self.assertEqual(len(store.objects()), 10)
+
+    def test_parts_and_compaction(self):
+        store = LightCurveStore(self.path)
+        half = len(self.detections) // 2
+        store.append(self.detections.iloc[:half])
+        # overlapping nights, the repeated detections are not duplicated
+        store.append(self.detections.iloc[half - 100:])
+        self.assertEqual(len(store.parts()), 2)
+        self.assertLoaded(store, self.oids)
+        store.compact()
+        self.assertEqual(len(store.parts()), 1)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+        self.assertLoaded(store, self.oids)
+
+    def test_automatic_compaction(self):
+        store = LightCurveStore(self.path, max_parts=2)
+        for chunk in np.array_split(np.arange(len(self.detections)), 3):
+            store.append(self.detections.iloc[chunk])
+        self.assertEqual(len(store.parts()), 1)
+        self.assertLoaded(store, self.oids)
+
+    def test_reopen(self):
+        LightCurveStore(self.path).append(self.detections, self.non_detections)
+        store = LightCurveStore(self.path)
+        self.assertEqual(len(store.parts("non_detections")), 1)
+        self.assertLoaded(store, self.oids)
+
+    def test_zero_copy(self):
+        store = LightCurveStore(self.path)
+        store.append(self.detections)
+        store.load(self.oids)
+        allocated = pa.total_allocated_bytes()
+        table = store.load(self.oids)
+        self.assertEqual(pa.total_allocated_bytes(), allocated)
+        self.assertEqual(table.num_rows, self.detections.objectId.isin(self.oids).sum())
+
+    def test_recompute(self):
+        store = LightCurveStore(self.path)
+        store.append(self.detections, self.non_detections)
+        results = store.recompute(self.oids, flags=True)
+        detections = self.detections[self.detections.objectId.isin(self.oids)]
+        non_detections = self.non_detections[self.non_detections.objectId.isin(self.oids)]
+        magstats = compute_magstats(correct_detections(detections), flags=True)
+        pd.testing.assert_frame_equal(results["magstats"].to_pandas(), magstats.reset_index(), check_dtype=False)
+        dmdt = compute_dmdt(magstats, non_detections)
+        pd.testing.assert_frame_equal(results["dmdt"].to_pandas(), dmdt.reset_index(), check_dtype=False)
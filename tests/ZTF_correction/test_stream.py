@@ -0,0 +1,92 @@
+import asyncio
+import math
+import os
+import unittest
+
+from lc_correction.compute import *
+from lc_correction.incremental import *
+from lc_correction.stream import *
+
+from .test_correction import AVRO_PATH, get_avros
+
+
+def run(corrector, source):
+    async def consume():
+        return [result async for result in corrector.run(source)]
+    return asyncio.run(consume())
+
+
+class TestStreamCorrector(unittest.TestCase):
+    def setUp(self) -> None:
+        self.oid = "ZTF18abdgukn"
+        self.path = os.path.join(AVRO_PATH, self.oid)
+        self.alerts = get_avros(self.oid)
+
+    def test_avro_source(self):
+        corrector = StreamCorrector(batch_size=4, max_delay=1.)
+        results = run(corrector, avro_source(self.path))
+        self.assertEqual([result["candid"] for result in results], [alert["candid"] for alert in self.alerts])
+        stats = corrector.stats()
+        self.assertEqual(stats["alerts"], len(self.alerts))
+        self.assertEqual(stats["batches"], math.ceil(len(self.alerts) / 4))
+        self.assertGreater(stats["throughput"], 0)
+        self.assertLessEqual(stats["latency_p50"], stats["latency_p99"])
+
+    def test_correction(self):
+        results = run(StreamCorrector(batch_size=3), self.alerts)
+        for alert, result in zip(self.alerts, results):
+            candidate = alert["candidate"]
+            self.assertEqual(result["corrected"], candidate["distnr"] < DISTANCE_THRESHOLD)
+            if result["corrected"]:
+                np.testing.assert_allclose([result["magpsf_corr"], result["sigmapsf_corr"],
+                                            result["sigmapsf_corr_ext"]], apply_correction(candidate))
+            else:
+                self.assertTrue(math.isnan(result["magpsf_corr"]))
+
+    def test_incremental_stats(self):
+        corrector = StreamCorrector(batch_size=5)
+        run(corrector, self.alerts)
+        expected = {}
+        for alert in self.alerts:
+            expected.setdefault(alert["candidate"]["fid"], IncrementalMagStats()).update(alert["candidate"])
+        self.assertEqual(set(corrector.magstats), {(self.oid, fid) for fid in expected})
+        for fid, stats in expected.items():
+            pd.testing.assert_series_equal(corrector.magstats[(self.oid, fid)].to_series(), stats.to_series())
+        self.assertEqual(corrector.objstats[self.oid].to_series()["lastmjd"],
+                         max(alert["candidate"]["jd"] for alert in self.alerts) - 2400000.5)
+
+    def test_deadline(self):
+        async def slow_source():
+            for alert in self.alerts:
+                await asyncio.sleep(0.02)
+                yield alert
+
+        corrector = StreamCorrector(batch_size=1000, max_delay=0.01)
+        results = run(corrector, slow_source())
+        self.assertEqual(len(results), len(self.alerts))
+        self.assertGreater(corrector.stats()["batches"], 1)
+
+    def test_backpressure(self):
+        read = []
+
+        async def source():
+            for alert in self.alerts:
+                read.append(alert["candid"])
+                yield alert
+
+        async def consume():
+            corrector = StreamCorrector(batch_size=1, max_delay=0., max_pending=1)
+            async for result in corrector.run(source()):
+                # the source is never far ahead of the consumer
+                self.assertLessEqual(len(read), read.index(result["candid"]) + 4)
+                await asyncio.sleep(0.001)
+        asyncio.run(consume())
+        self.assertEqual(len(read), len(self.alerts))
+
+    def test_source_error(self):
+        async def source():
+            yield self.alerts[0]
+            raise ValueError("broken source")
+
+        with self.assertRaises(ValueError):
+            run(StreamCorrector(batch_size=1), source())